@@ -1,10 +1,23 @@
 import datetime as dt
+import os
+import time
+import traceback
+from collections.abc import Iterator
+from contextlib import contextmanager
 from typing import Any
 
 import appdaemon.plugins.hass.hassapi as hass
 import battalk as bt
 import const2 as cs
+import fleet2 as fl
+import gridctl2 as gc
+import lazylog2 as lz
+import mcplan2 as mc
+import numpy as np
+import plan2 as pl
 import prices2 as p2
+import prof2 as pf
+import stance2 as st
 import utils2 as ut
 
 """BatMan2 App
@@ -21,8 +34,32 @@ class BatMan2(hass.Hass):
         self.callback_handles: list[Any] = []
 
         # create internals
-        self.debug: bool = cs.DEBUG
+        self.debug: bool = bool(self.args.get("debug", cs.DEBUG))
+        if self.debug:
+            self.set_log_level("DEBUG")
+        self.lg = lz.LazyLog(self)
         self.secrets = self.get_app("scrts")
+        # time our callbacks
+        self.perf = self.get_app("perf")
+        if self.perf:
+            self.perf.instrument(  # type: ignore[attr-defined]
+                self,
+                [
+                    "price_current_cb",
+                    "watchdog_cb",
+                    "watchdog_runin_cb",
+                    "lowpv_runin_cb",
+                    "pv_current_cb",
+                    "grid_power_cb",
+                    "grid_sensor_cb",
+                    "soc_cb",
+                ],
+            )
+        # history of prices, SoC, setpoints and stances
+        self.recorder = self.get_app("recorder")
+        # time the phases of each control pass
+        self.prof = pf.PassProfiler()
+        self.prof.set_deep(self.get_state(cs.PROFILE) == "on")
         self.greedy: int = 0  # 0 = not greedy, 1 = greedy hi price, -1 = greedy low price
         self.greedy_ll = cs.PRICES["nul"]
         self.greedy_hh = cs.PRICES["top"]
@@ -32,6 +69,12 @@ class BatMan2(hass.Hass):
         self.tibber_prices: dict[str, float] = {}
         self.tibber_sensor: str = self.secrets.get_tibber_sensor()  # type: ignore[attr-defined]
         self.tibber_quarters: bool = True  # whether the Tibber prices are quarterly or not
+        # shared price service; when it is not running we fetch the prices ourselves
+        self.prices_app = self.get_app("prices")
+        self.home: str | None = self.args.get("home_id")  # Tibber home; default is the first home
+        self.new_prices: bool = False  # the price service has new prices for today
+        if self.prices_app:
+            self.prices_app.subscribe(self.prices_cb, home=self.home)  # type: ignore[attr-defined]
         self.price: dict = {
             "today": [],
             "tomor": [],
@@ -45,16 +88,31 @@ class BatMan2(hass.Hass):
         self.ev_charging: bool = False
         self.ctrl_by_me: bool = True  # whether the app is allowed to control the batteries
         self.bats_min_soc: float = 0.0
+        self.below_min_soc: bool = False  # whether the SoC of the fleet is below bats_min_soc
+        # derived values of other apps (e.g. the minimum SoC); when not running we read them from HA
+        self.bus = self.get_app("bus")
         self.pv_current: float = 0.0  # A; used to monitor PV overcurrent
         self.pv_volt: float = 0.0  # V; used to control PV current
         self.pv_power: int = 0  # W
         self.low_pv = self.get_state(cs.LOW_PV) == "on"
         self.soc: float = 0.0  # % average state of charge
-        self.soc_list: list[float] = [0.0, 0.0]  # %; state of charge for each battery
-        self.pwr_sp_list: list[int] = [0, 0]  # W; power setpoints of batteries
-        self.steps = ut.get_steps(cs.RAMP_RATE[0])
-        self.step_cnt = 0  # keep track of the number of steps it took to ramp
-        self.stance_list: list[str] = ["NOM", "NOM"]  # current control stance for each battery
+        # SoC [%] and power setpoints [W] of each battery
+        self.fleet = fl.BatteryFleet(cs.BATTALK["bats"])
+        # composes the grid target sent to the P1 meter
+        self.grid = gc.OvercurrentGuard(
+            limit=float(self.fleet.max_charge.sum() + self.fleet.max_discharge.sum())
+        )
+        # limits the grid import; measured on the bus (tibberlive) or the P1 meter sensor
+        self.limiter = gc.ImportLimiter(
+            floor=-float(self.fleet.max_charge.sum() + self.fleet.max_discharge.sum())
+        )
+        # changes of the base grid target are ramped; one step every RAMP_RATE[1] seconds
+        self.ramp = gc.Ramp()
+        self.ramp_handle: Any = None
+        self.stance_list: list[str] = [cs.NOM] * len(self.fleet)  # current control stance for each battery
+        # continue where we left off when the app was reloaded
+        self.snapshot_file: str = os.path.join(str(self.config_dir), cs.SNAPSHOT["file"])
+        self.restored: bool = self.restore_state()
         # get credentials and authenticate with the batteries
         self.bat_ctrl = self.get_bats()
         for _b in self.bat_ctrl:
@@ -102,9 +160,19 @@ class BatMan2(hass.Hass):
         # App control is allowed or prohibited
         self.callback_handles.append(self.listen_state(self.watchdog_cb, cs.CTRL_BY_ME))
         # Minimum SoC is reached
-        self.callback_handles.append(self.listen_state(self.watchdog_cb, cs.BAT_MIN_SOC_WD))
-        # PV overcurrent detected
-        self.callback_handles.append(self.listen_state(self.watchdog_cb, cs.PV_CURRENT_WD))
+        if self.bus:
+            # compare the SoC with the minimum SoC ourselves instead of waiting for HA to do it
+            self.bus.subscribe(cs.BUS_MIN_SOC, self.min_soc_cb)  # type: ignore[attr-defined]
+            for _bat in self.fleet.entities(cs.BAT_SOC):
+                self.callback_handles.append(self.listen_state(self.soc_cb, _bat))
+        else:
+            self.callback_handles.append(self.listen_state(self.watchdog_cb, cs.BAT_MIN_SOC_WD))
+        # PV current; fast path to limit overcurrent
+        self.callback_handles.append(self.listen_state(self.pv_current_cb, cs.PV_CURRENT))
+        # grid power; fast path to limit the grid import
+        if self.bus:
+            self.bus.subscribe(cs.BUS_GRID_POWER, self.grid_power_cb)  # type: ignore[attr-defined]
+        self.callback_handles.append(self.listen_state(self.grid_sensor_cb, cs.GRID_POWER))
         # minimum greed
         self.callback_handles.append(self.listen_state(self.watchdog_cb, cs.GREED_LL))
         # maximum greed
@@ -113,45 +181,50 @@ class BatMan2(hass.Hass):
         self.callback_handles.append(
             self.listen_state(self.watchdog_cb, cs.LOW_PV, duration=dt.timedelta(seconds=60))
         )
+        # profiling switches
+        self.callback_handles.append(self.listen_state(self.profile_cb, cs.PROFILE))
+        self.callback_handles.append(self.listen_state(self.profile_cb, cs.PROFILE_DUMP, new="on"))
 
     def update_price_states(self) -> None:
         """Get current states for prices by calling the callback directly"""
         self.price_current_cb()
         # "entity", "list", "none", self.get_state(cs.PRICES["entity"], attribute=cs.PRICES["attr"]["now"]) )
 
-    def get_soc(self) -> tuple[float, list[float]]:
-        """Get current state of charge (SoC) for all batteries."""
-        soc_list: list[float] = []
-        for bat in cs.BATTERIES:
+    def get_soc(self) -> float:
+        """Get current state of charge (SoC) for all batteries. Returns the SoC of the fleet."""
+        for _idx, bat in enumerate(self.fleet.entities(cs.BAT_SOC)):
             _s: Any = self.get_state(entity_id=bat, attribute="state")
             try:
                 _soc = float(_s)
-            except ValueError:
+            except (TypeError, ValueError):
                 self.log(f"*** Invalid SoC value for {bat}: {_s}. Setting to 0.0", level="ERROR")
                 _soc = 0.0
-            soc_list.append(_soc)
-        soc_now: float = sum(soc_list) / len(soc_list)
-        return soc_now, soc_list
+            self.fleet.soc[_idx] = _soc
+        return self.fleet.soc_avg()
+
+    def get_min_soc(self) -> float:
+        """Get the SoC required to provide power until next morning; from the bus, or from HA."""
+        _bms: Any = self.bus.get(cs.BUS_MIN_SOC) if self.bus else None  # type: ignore[attr-defined]
+        if _bms is None:
+            _bms = self.get_state(cs.BAT_MIN_SOC)
+        return float(_bms)
 
-    def get_pwr_sp(self) -> list[int]:
+    def get_pwr_sp(self) -> None:
         """Get current power setpoints for all batteries."""
         # TODO: directly get the actual setpoint from the batteries (faster)
-        pwr_list: list[int] = []
-        for bat in cs.SETPOINTS:
+        for _idx, bat in enumerate(self.fleet.entities(cs.BAT_SETPOINT)):
             _sp: Any = self.get_state(entity_id=bat, attribute="state")
             try:
-                _setpoint = int(_sp)
-            except ValueError:
+                _setpoint = int(float(_sp))
+            except (TypeError, ValueError):
                 self.log(f"*** Invalid setpoint value for {bat}: {_sp}. Setting to 0", level="ERROR")
                 _setpoint = 0
-            pwr_list.append(_setpoint)
-
-        return pwr_list
+            self.fleet.setpoint[_idx] = _setpoint
 
     def get_bat_strat(self) -> list[str]:
         """Get current control stance for all batteries."""
         bat_list: list[str] = []
-        for bat in cs.BAT_STANCE:
+        for bat in self.fleet.entities(cs.BAT_STRATEGY):
             _sp: Any | None = self.get_state(entity_id=bat, attribute="state")
             if _sp is not None:
                 bat_list.append(str(_sp))
@@ -161,38 +234,41 @@ class BatMan2(hass.Hass):
 
     def update_states(self):
         """Update internal states based on current conditions."""
-        self.log("---------------------------   ------------------------", level="DEBUG")
+        self.lg.debug("---------------------------   ------------------------")
         # update the calendar/season info
         self.datum = ut.get_these_days()
         # minimum SoC required to provide power until next morning
-        _bms: Any = self.get_state(cs.BAT_MIN_SOC)
-        self.bats_min_soc = float(_bms)
-        self.log(f"BAT minimum SoC             = {self.bats_min_soc:8.1f}  %", level="DEBUG")
+        self.bats_min_soc = self.get_min_soc()
+        self.lg.debug("BAT minimum SoC             = %8.1f  %%", self.bats_min_soc)
         # get current SoC
-        self.soc, self.soc_list = self.get_soc()
-        self.log(f"BAT current SoC             = {self.soc:8.1f}  %  <- {self.soc_list}", level="DEBUG")
+        self.soc = self.get_soc()
+        self.below_min_soc = self.soc < self.bats_min_soc
+        self.lg.debug("BAT current SoC             = %8.1f  %%  <- %s", self.soc, self.fleet.soc.tolist)
         # get battery power setpoints
-        self.pwr_sp_list = self.get_pwr_sp()
-        _ssp = sum(self.pwr_sp_list)
-        self.log(f"BAT actual setpoints        = {_ssp:+6.0f}    W  <- {self.pwr_sp_list}", level="DEBUG")
+        self.get_pwr_sp()
+        self.lg.debug(
+            "BAT actual setpoints        = %+6.0f    W  <- %s",
+            self.fleet.setpoint.sum,
+            self.fleet.setpoint.tolist,
+        )
         # get battery power stances
         self.stance_list = self.get_bat_strat()
-        self.log(f"BAT current stance          = {self.stance_list}", level="DEBUG")
+        self.lg.debug("BAT current stance          = %s", self.stance_list)
         # get PV current and power values
         _pvc: Any = self.get_state(cs.PV_CURRENT)
         self.pv_current = float(_pvc)
-        self.log(f"PV actual current           = {self.pv_current:9.2f} A", level="DEBUG")
+        self.lg.debug("PV actual current           = %9.2f A", self.pv_current)
         _pvv: Any = self.get_state(cs.PV_VOLTAGE)
         self.pv_volt = int(float(_pvv))
-        self.log(f"PV actual voltage           = {self.pv_volt:9.2f} V", level="DEBUG")
-        self.log(f"PV calculated power (I x U) = {(self.pv_current * self.pv_volt):8.1f}  W", level="DEBUG")
+        self.lg.debug("PV actual voltage           = %9.2f V", self.pv_volt)
+        self.lg.debug("PV calculated power (I x U) = %8.1f  W", lambda: self.pv_current * self.pv_volt)
         _pvp: Any = self.get_state(cs.PV_POWER)
         self.pv_power = int(float(_pvp))
-        # fmt: off
-        self.log(
-            f"PV actual power             = {self.pv_power:+6.0f}    W  (delta={abs(abs(self.pv_power) - (self.pv_current * self.pv_volt)):.0f})", level="DEBUG"
+        self.lg.debug(
+            "PV actual power             = %+6.0f    W  (delta=%.0f)",
+            self.pv_power,
+            lambda: abs(abs(self.pv_power) - (self.pv_current * self.pv_volt)),
         )
-        # fmt: on
         # do we have an override for the default sunny/non-sunny behaviour ?
         self.zomwin_override = False
         if self.get_state(cs.ZOMWIN_OVERRIDE) == "on":
@@ -210,22 +286,18 @@ class BatMan2(hass.Hass):
             self.greedy_hh,
             self.datum["sunny"] and not self.zomwin_override,
         )
-        match self.greedy:
-            case -1:
-                _s = "greedy to CHARGE"
-            case 1:
-                _s = "greedy for DISCHARGE"
-            case _:
-                _s = "NOT greedy"
-        self.log(
-            f"Greed                       =  {_s}  ({self.greedy_ll:.1f} / {self.greedy_hh:.1f})", level="DEBUG"
+        self.lg.debug(
+            "Greed                       =  %s  (%.1f / %.1f)",
+            {-1: "greedy to CHARGE", 1: "greedy for DISCHARGE"}.get(self.greedy, "NOT greedy"),
+            self.greedy_ll,
+            self.greedy_hh,
         )
         # check whether the EV is currently charging
         _evc: Any = self.get_state(cs.EV_REQ_PWR)
         self.ev_charging = False
         if str(_evc) == "on":
             self.ev_charging = True
-        self.log(f"EV charging                 =  {str(_evc).upper()}", level="DEBUG")
+        self.lg.debug("EV charging                 =  %s", lambda: str(_evc).upper())
         # check if we are going to assist the EV
         # self.ev_assist = cs.EV_ASSIST
         # if self.price["now"] > self.price["stats"]["q3"]:
@@ -238,23 +310,43 @@ class BatMan2(hass.Hass):
         self.ctrl_by_me = False
         if str(_ctrl) == "on":
             self.ctrl_by_me = True
-            self.log("Control by app              =  ENABLED", level="DEBUG")
+            self.lg.debug("Control by app              =  ENABLED")
         else:
-            self.log("Control by app              =  DISABLED", level="INFO")
+            self.lg.summary("ctrl_by_me", "Control by app              =  DISABLED")
         if self.zomwin_override:
-            self.log("Zomer/Winter Override       =  ENABLED", level="INFO")
+            self.lg.summary("zomwin_override", "Zomer/Winter Override       =  ENABLED")
         else:
-            self.log("Zomer/Winter Override       =  DISABLED", level="DEBUG")
+            self.lg.debug("Zomer/Winter Override       =  DISABLED")
 
-    def update_tibber_prices(self) -> None:
-        self.tibber_prices = p2.get_pricedict(
-            token=self.secrets.get_tibber_token(),  # type: ignore[attr-defined]
-            url=self.secrets.get_tibber_url(),  # type: ignore[attr-defined]
-        )
-        self.log(f"Updated Tibber prices: {len(self.tibber_prices)} prices received.", level="DEBUG")
+    def update_tibber_prices(self) -> dict | None:
+        """Get today's prices from the price service, or from Tibber when the service is not running.
+
+        Returns:
+            the price statistics computed by the price service, or None
+        """
+        _stats: dict | None = None
+        _day = None
+        if self.prices_app:
+            _day = self.prices_app.get_day(fetch=True, home=self.home)  # type: ignore[attr-defined]
+        if _day is not None:
+            self.tibber_prices = _day.pricedict()
+            _stats = _day.stats_dict()
+        elif self.home:
+            self.tibber_prices = p2.get_pricedicts(
+                token=self.secrets.get_tibber_token(),  # type: ignore[attr-defined]
+                url=self.secrets.get_tibber_url(),  # type: ignore[attr-defined]
+            ).get(self.home, {})
+        else:
+            self.tibber_prices = p2.get_pricedict(
+                token=self.secrets.get_tibber_token(),  # type: ignore[attr-defined]
+                url=self.secrets.get_tibber_url(),  # type: ignore[attr-defined]
+            )
+        self.lg.debug("Updated Tibber prices: %d prices received.", len(self.tibber_prices))
         self.tibber_quarters = False
-        if len(self.tibber_prices) == 96:
+        # 92 or 100 quarters on DST transition days
+        if len(self.tibber_prices) == ut.quarters_in_day(self.datum["today"]):
             self.tibber_quarters = True
+        return _stats
 
     def update_price_slots(self, prices: list[float]) -> None:
         """Update the cheap and expensive price slots.
@@ -266,72 +358,78 @@ class BatMan2(hass.Hass):
             None
         """
         self.log(f"I think the SoC is now {self.soc} %", level="INFO")
-        # Attempt to predict the number of charge slots we need
-        # (100 [%] - self.soc [%] )
-        # / ( (cs.MAX_CHARGE [W/h.bat] / 100 [W/%] )
-        #     ) * 4 [qrt/hr] = [qrt]
-        _cqrtrs: int = int((100 - self.soc) / (abs(cs.MAX_CHARGE) / 100) * 4)
-        self.log(f"I think I need to charge for {_cqrtrs} quarters today.\n  :", level="INFO")
-        if _cqrtrs > cs.SLOTS[0]:
-            _cqrtrs = cs.SLOTS[0]
-        _cslot: int = -1 * _cqrtrs
-        _dslot: int = cs.SLOTS[1]
-        # allow for hourly prices
-        _div = 1 if self.tibber_quarters else 4
-        # in case of hourly prices we need to make sure we get int(hours)
-        _cslot = int(_cslot / _div)
-
-        # Get sorted indices of the price list
-        sorted_indices = self.price["stats"]["idx"]["ALL"]
-
-        # Get the N cheapest slots indices in Q1
-        all_cheap = self.price["stats"]["idx"]["Q1"][_cslot:]
-        charge_today = all_cheap
-        charge_today.sort()
-        # get the average price during the charge slots
-        avg_charge_price_today = sum(prices[idx] for idx in charge_today) / len(charge_today)
-        self.log(f"Avg price during charge slots will be     {avg_charge_price_today:.3f}", level="INFO")
-
-        # Get the average price for the rest of the day (not charging)
-        not_charge_today = [idx for idx in sorted_indices if idx not in charge_today]
-        avg_notcharge_price_today = sum(prices[idx] for idx in not_charge_today) / len(not_charge_today)
-        self.log(f"Avg price during non-charge slots will be {avg_notcharge_price_today:.3f}", level="INFO")
-
-        # Determine BEP
-        _bep = avg_charge_price_today / cs.AVG_RTE
-        self.log(f"Charging BEP is                           {_bep:.3f}\n  :", level="INFO")
-
-        if _bep >= avg_notcharge_price_today:
+        _slots = p2.price_slots(prices, self.price["stats"], self.soc, quarters=self.tibber_quarters)
+        self.log(f"I think I need to charge for {_slots['n_charge']} quarters today.\n  :", level="INFO")
+        self.log(f"Avg price during charge slots will be     {_slots['avg_charge']:.3f}", level="INFO")
+        self.log(f"Avg price during non-charge slots will be {_slots['avg_notcharge']:.3f}", level="INFO")
+        self.log(f"Charging BEP is                           {_slots['bep_charge']:.3f}\n  :", level="INFO")
+        if cs.STOCHASTIC["enabled"]:
+            _mc = self.stochastic_slots(prices)
+            self.log(
+                f"Monte Carlo proposes to charge in {len(_mc.cheap)} slots; "
+                f"expected cost {_mc.cost:.1f} cEUR, risk {_mc.risk:.1%}\n  :",
+                level="INFO",
+            )
+            _slots["cheap"] = _mc.cheap
+        if not _slots["cheap"]:
             self.log("Proposing to NOT charge today.", level="INFO")
-            charge_today = []
-        self.price["cheap_slot"] = charge_today
-
-        # ...do the same for discharging
-        _dslot = int(_dslot / _div)
-        # Get the N most expensive slots indices and filter to above average
-        all_expensive = self.price["stats"]["idx"]["Q4"][:_dslot]
-        # prices in Q4 are by definition above the average
-        discharge_today = all_expensive
-        discharge_today.sort()
-        # get the average price during Q4 slots
-        avg_discharge_price_today = sum(prices[idx] for idx in discharge_today) / len(discharge_today)
-        self.log(f"Avg price during discharge slots will be  {avg_discharge_price_today:.3f}", level="INFO")
-
-        # Determine BEP
-        _bep2 = avg_discharge_price_today * cs.AVG_RTE
-        self.log(f"Discharging BEP is                        {_bep2:.3f}\n  :", level="INFO")
-
-        # are they also above the BEP?
-        discharge_today = [idx for idx in all_expensive if prices[idx] > _bep2]
-        discharge_today.sort()
-        # get the average price during the filtered discharge slots
-        # avg_discharge_price_today = sum(prices[idx] for idx in discharge_today) / len(discharge_today)
-        # self.log(f"Avg price during f-discharge slots is     {avg_discharge_price_today:.3f}", level="INFO")
-        self.price["expen_slot"] = discharge_today
+        self.price["cheap_slot"] = _slots["cheap"]
+        self.log(f"Avg price during discharge slots will be  {_slots['avg_discharge']:.3f}", level="INFO")
+        self.log(f"Discharging BEP is                        {_slots['bep_discharge']:.3f}\n  :", level="INFO")
+        self.price["expen_slot"] = _slots["expen"]
+
+    def stochastic_slots(self, prices: list[float]) -> mc.MCResult:
+        """Plan the charge slots for the rest of the day over sampled load and PV scenarios (see mcplan2.py).
+
+        Args:
+            prices (list[float]): list of prices for today
+
+        Returns:
+            the chosen charge slots (counted from midnight) with their expected cost and risk
+        """
+        _start = self.get_slot()
+        _n = len(prices)
+        _hours = 0.25 if self.tibber_quarters else 1.0
+        _loc: dict = self.secrets.get_location()  # type: ignore[attr-defined]
+        _now = dt.datetime.now().astimezone()
+        _offset = (_now.utcoffset() or dt.timedelta(0)).total_seconds() / 3600
+        _profile = mc.pv_clear_sky(
+            self.datum["today"], _n, float(_loc["latitude"]), float(_loc["longitude"]), _offset
+        )
+        _median: Any = self.bus.get(cs.BUS_BASELOAD) if self.bus else None  # type: ignore[attr-defined]
+        if _median is None:
+            _median = self.get_state(cs.HOME_BASELOAD)
+        _stats: Any = self.bus.get(cs.BUS_BASELOAD_STATS) if self.bus else None  # type: ignore[attr-defined]
+        _load, _pv = mc.scenarios(
+            n=cs.STOCHASTIC["scenarios"],
+            slots=_n,
+            load=mc.baseload_quantiles(_stats, float(_median)),
+            pv_profile=_profile,
+            pv_wh=mc.pv_daily(self.datum["today"]),
+            sunny=self.datum["sunny"],
+            rng=np.random.default_rng(cs.STOCHASTIC["seed"]),
+        )
+        _res = mc.plan(
+            prices[_start:],
+            soc=self.get_soc(),
+            min_soc=self.get_min_soc(),
+            load=_load[:, _start:],
+            pv=_pv[:, _start:],
+            capacity=float(self.fleet.capacity.sum()),
+            max_charge=float(self.fleet.max_charge.sum()),
+            max_discharge=float(self.fleet.max_discharge.sum()),
+            hours=_hours,
+        )
+        return _res._replace(cheap=[_start + _s for _s in _res.cheap])
 
     def terminate(self) -> None:
         """Clean up app."""
         self.log("__Terminating BatMan2...", level="INFO")
+        if self.prices_app:
+            self.prices_app.unsubscribe(self.prices_cb)  # type: ignore[attr-defined]
+        if self.bus:
+            self.bus.unsubscribe(cs.BUS_MIN_SOC, self.min_soc_cb)  # type: ignore[attr-defined]
+            self.bus.unsubscribe(cs.BUS_GRID_POWER, self.grid_power_cb)  # type: ignore[attr-defined]
         # Cancel all registered callbacks
         for handle in self.callback_handles:
             self.cancel_listen_state(handle)
@@ -340,65 +438,134 @@ class BatMan2(hass.Hass):
 
     # CALLBACKS
 
+    def prices_cb(self, day: Any) -> None:
+        """Called by the price service when new prices are available; they are used in the next pass."""
+        if day.pricedict() != self.tibber_prices:
+            self.new_prices = True
+            self.lg.debug("New prices for %s from the price service.", day.date)
+
     def price_current_cb(self, **kwargs) -> None:
         """Callback for current price change."""
         # get current hour, quarter and slot
         _hr: int = dt.datetime.now().hour
         _qr: int = 0
         _slot: int = self.get_slot()
-        if _slot == 0 or self.starting:
-            # update info at midnight or when the app is starting up
-            self.datum = ut.get_these_days()
-            # get the prices for today
-            self.update_tibber_prices()
-            # get a list of hourly (or quarterly) prices and do some basic statistics
-            _p: list[float] = p2.total_price(self.tibber_prices)
-            self.price["today"] = _p
-            self.price["stats"] = p2.price_statistics(prices=_p)
-            self.update_price_slots(prices=_p)
-
-        if self.tibber_quarters:
-            # callback will be either on the hour or on the quarter
-            _qr = dt.datetime.now().minute
-        # get the price for the current timeslot
-        _pn = self.price["today"][_slot]
-        # lookup Tibber price for the current hour and quarter
-        # _pt = p2.get_price(self.tibber_prices, _hr, _qr)
-        self.price["now"] = _pn
-
-        # every time the current prices are updated, we update other stuff too:
-        self.update_states()
-
-        # calculate the distance to the minimum price
-        self.price_diff = _pn - self.price["stats"]["q1"]
-        # log the current price
-        if self.debug:
-            self.log(
-                f"Current Tibber price        = {_pn:+.3f} ({self.price_diff:.3f})",
-                level="DEBUG",
-            )
-            self.log(
-                "Current time slot           =  ",
-                level="DEBUG",
-            )
-            self.log(
-                f"Current price @ slot          = {_pn:+.3f} ({self.price_diff:.3f}) @ {_slot:.0f} ({_slot / 4:.2f})",
-                level="DEBUG",
-            )
-        if self.debug and ((_qr == 0 and _hr == 0) or self.starting):
-            self.log(
-                f"Today's pricelist =  {[f'{n:.3f}' for n in self.price['today']]}\n  : cheap slots  = [{
-                    ', '.join(f'{v / 4:.2f}' for v in self.price['cheap_slot'])
-                }]\n  : expensive slots  = [{
-                    ', '.join(f'{v / 4:.2f}' for v in self.price['expen_slot'])
-                }]\n  : STATISTICS : {self.price['stats']['text']}",
-                level="INFO",
+        with self.control_pass("price_current_cb"):
+            # after a reload today's prices are in the restored snapshot
+            _new_slots: bool = _slot == 0 or (self.starting and not self.restored) or self.new_prices
+            if _new_slots:
+                # update info at midnight, when the app is starting up or when the price service has new prices
+                self.datum = ut.get_these_days()
+                # get the prices for today
+                with self.prof.span("update_tibber_prices"):
+                    _stats = self.update_tibber_prices()
+                    self.new_prices = False
+                # get a list of hourly (or quarterly) prices and do some basic statistics
+                with self.prof.span("price_statistics"):
+                    _p: list[float] = p2.total_price(self.tibber_prices)
+                    self.price["today"] = _p
+                    self.price["stats"] = _stats or p2.price_statistics(prices=_p)
+                with self.prof.span("update_price_slots"):
+                    self.update_price_slots(prices=_p)
+
+            if self.tibber_quarters:
+                # callback will be either on the hour or on the quarter
+                _qr = dt.datetime.now().minute
+            # get the price for the current timeslot
+            _pn = self.price["today"][_slot]
+            # lookup Tibber price for the current hour and quarter
+            # _pt = p2.get_price(self.tibber_prices, _hr, _qr)
+            self.price["now"] = _pn
+
+            # every time the current prices are updated, we update other stuff too:
+            with self.prof.span("update_states"):
+                self.update_states()
+            # publish the plan once per update of the price slots; after a reload with the restored slots
+            if _new_slots or self.starting:
+                with self.prof.span("publish_plan"):
+                    self.publish_plan()
+
+            # calculate the distance to the minimum price
+            self.price_diff = _pn - self.price["stats"]["q1"]
+            # log the current price
+            self.lg.debug(
+                "Current price @ slot          = %+.3f (%.3f) @ %.0f (%.2f)",
+                _pn,
+                self.price_diff,
+                _slot,
+                _slot / 4,
             )
+            if self.debug and ((_qr == 0 and _hr == 0) or self.starting):
+                self.lg.info(
+                    "Today's pricelist =  %s\n  : cheap slots  = [%s]\n"
+                    "  : expensive slots  = [%s]\n  : STATISTICS : %s",
+                    lambda: [f"{n:.3f}" for n in self.price["today"]],
+                    lambda: ", ".join(f"{v / 4:.2f}" for v in self.price["cheap_slot"]),
+                    lambda: ", ".join(f"{v / 4:.2f}" for v in self.price["expen_slot"]),
+                    self.price["stats"]["text"],
+                )
 
-        # determine the new stance ...
-        self.calc_stance()
-        # ... and set it
-        self.set_stance()
+            # determine the new stance ...
+            with self.prof.span("calc_stance"):
+                self.calc_stance()
+            # ... and set it
+            with self.prof.span("set_stance"):
+                self.set_stance()
+        self.save_state()
+        self.record_quarter()
+
+    def publish_plan(self) -> None:
+        """Publish the planned stance and setpoint for the rest of the day as a sensor.
+
+        The plan is encoded compactly in the attributes:
+        - stance: run-length string of stance initials, e.g. '32N8C20N12D24N'
+        - setpoint: base64 encoded int8 array of the setpoint per battery in units of 'sp_scale' W
+        """
+        _slot = self.get_slot()
+        _prices = np.asarray(self.price["today"][_slot:], dtype=np.float64)
+        _slots = np.array([self.slot_class(_s) for _s in range(_slot, _slot + _prices.size)], dtype=np.int8)
+        _greedy = pl.greed(
+            _prices,
+            self.price["stats"]["q1"],
+            self.greedy_ll,
+            self.greedy_hh,
+            self.datum["sunny"] and not self.zomwin_override,
+        )
+        _hours = 0.25 if self.tibber_quarters else 1.0
+        # plan with the current SoC, then re-plan on the SoC trajectory that results from that plan
+        _soc = np.full(_prices.size, self.soc)
+        for _ in range(2):
+            _stance, _sp = pl.plan_day(
+                _soc,
+                self.bats_min_soc,
+                _slots,
+                _greedy,
+                False,
+                self.datum["sunny"],
+                self.zomwin_override,
+                self.low_pv,
+                self.new_stance,
+                int(self.fleet.setpoint.mean()),
+                len(self.fleet),
+                float(self.fleet.capacity.sum()),
+            )
+            _soc = pl.project_soc(self.soc, _sp, hours=_hours)
+        _attr = {
+            **cs.ATTR_PLAN,
+            "start": _slot,
+            "slots": int(_prices.size),
+            "minutes": int(_hours * 60),
+            "stance": pl.rle(_stance),
+            "setpoint": pl.b64_int8(_sp),
+            "sp_scale": 100,
+        }
+        try:
+            self.set_state(entity_id=cs.BAT_PLAN, state=self.datum["today"].isoformat(), attributes=_attr)
+        except Exception as her:
+            self.log(str(type(her)), level="ERROR")
+            self.log(str(her), level="ERROR")
+            self.log(traceback.format_exc(), level="ERROR")
+            self.log(f"Could not update {cs.BAT_PLAN}", level="ERROR")
 
     def watchdog_cb(self, entity, attribute, old, new, **kwargs):
         """Callback for changes to monitored automations."""
@@ -411,15 +578,182 @@ class BatMan2(hass.Hass):
         else:
             self.run_in(self.watchdog_runin_cb, 2, entity=entity, attribute=attribute, old=old, new=new)
 
+    def min_soc_cb(self, topic: str, old: Any, new: Any) -> None:
+        """Called by the bus when nxtmorning publishes a new minimum SoC."""
+        self.bats_min_soc = float(new)
+        self.check_min_soc(topic)
+
+    def soc_cb(self, entity, attribute, old, new, **kwargs):
+        """Callback for changes of the SoC of a battery."""
+        try:
+            self.fleet.soc[self.fleet.entities(cs.BAT_SOC).index(entity)] = float(new)
+        except (TypeError, ValueError):
+            return
+        self.check_min_soc(entity)
+
+    def check_min_soc(self, entity: str) -> None:
+        """Start a watchdog pass when the SoC of the fleet crosses the minimum SoC."""
+        _below = self.fleet.soc_avg() < self.bats_min_soc
+        if _below != self.below_min_soc:
+            self.below_min_soc = _below
+            _old, _new = ("off", "on") if _below else ("on", "off")
+            self.run_in(self.watchdog_runin_cb, 2, entity=entity, attribute="state", old=_old, new=_new)
+
     def watchdog_runin_cb(self, entity, attribute, old, new, **kwargs):
-        # Update the current state of the system
-        self.update_states()
-        # determine the new stance ...
-        self.calc_stance()
-        # ... and set it
-        self.set_stance()
+        with self.control_pass("watchdog_runin_cb"):
+            # Update the current state of the system
+            with self.prof.span("update_states"):
+                self.update_states()
+            # determine the new stance ...
+            with self.prof.span("calc_stance"):
+                self.calc_stance()
+            # ... and set it
+            with self.prof.span("set_stance"):
+                self.set_stance()
+        self.save_state()
         # Log the current stance
-        self.log(f"Current stance              =  {self.new_stance}", level="DEBUG")
+        self.lg.debug("Current stance              =  %s", self.new_stance)
+
+    def profile_cb(self, entity, attribute, old, new, **kwargs):
+        """Switch deep profiling on/off or dump the profiles of the last control passes."""
+        if entity == cs.PROFILE:
+            self.prof.set_deep(new == "on")
+            self.log(f"Deep profiling              =  {new}", level="INFO")
+            return
+        _file = os.path.join(str(self.config_dir), cs.PROFILE_FILE)
+        try:
+            _n = self.prof.dump(_file)
+            self.log(f"Dumped {_n} profiles to {_file}", level="INFO")
+        except OSError as her:
+            self.log(f"Could not dump profiles to {_file}: {her}", level="ERROR")
+        self.turn_off(cs.PROFILE_DUMP)
+
+    @contextmanager
+    def control_pass(self, name: str) -> Iterator[None]:
+        """Profile a control pass; it is finished even when the pass raises."""
+        self.prof.begin(name)
+        try:
+            yield
+        finally:
+            self.end_pass()
+
+    def end_pass(self) -> None:
+        """Finish profiling the current control pass and log the timing of its phases."""
+        _pass = self.prof.end()
+        if _pass is not None:
+            self.lg.debug("Pass timing                 =  %s", lambda: self.prof.text(_pass))
+
+    def pv_current_cb(self, entity, attribute, old, new, **kwargs):
+        """Fast path: correct the grid target when the PV current exceeds its limit.
+
+        Only the PV meter states are read; the stance is not re-evaluated.
+        """
+        try:
+            _amp = float(new)
+            _volt = float(self.get_state(cs.PV_VOLTAGE))  # type: ignore[arg-type]
+            _pwr = float(self.get_state(cs.PV_POWER))  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            return
+        self.pv_current = _amp
+        if self.recorder:
+            self.recorder.record("pv_current", _amp)  # type: ignore[attr-defined]
+        _target = self.grid.update(_amp, _volt, _pwr, time.monotonic())
+        if _target is not None and self.ctrl_by_me:
+            self.lg.info("PV current %.1f A; grid target correction %+.0f W", _amp, self.grid.correction)
+            self.set_grid_target(_target)
+
+    def grid_power_cb(self, topic: str, old: Any, new: Any) -> None:
+        """Fast path: called by the bus when tibberlive publishes a new grid power.
+
+        The bus calls us on the thread of tibberlive, so the grid target is sent from our own thread.
+        """
+        if self.limit_import(float(new)):
+            self.run_in(self.limit_runin_cb, 0)
+
+    def grid_sensor_cb(self, entity, attribute, old, new, **kwargs):
+        """Fast path: grid power from the P1 meter; only used when tibberlive is not publishing."""
+        _age: Any = self.bus.age(cs.BUS_GRID_POWER) if self.bus else None  # type: ignore[attr-defined]
+        if _age is not None and _age < cs.BUS_GRID_MAX_AGE:
+            return
+        try:
+            _pwr = float(new)
+        except (TypeError, ValueError):
+            return
+        if self.limit_import(_pwr):
+            self.limit_runin_cb()
+
+    def limit_import(self, power: float) -> bool:
+        """Update the grid import correction with a sample of the grid power [W].
+
+        Returns:
+            True if the grid target should be sent
+        """
+        if not self.limiter.update(power, time.monotonic()):
+            return False
+        self.grid.shave = self.limiter.correction
+        return self.ctrl_by_me and self.grid.due() is not None
+
+    def limit_runin_cb(self, **kwargs):
+        """Send the grid target with the new grid import correction."""
+        _target = self.grid.due()
+        if _target is not None:
+            self.lg.info(
+                "Grid import %.0f W; grid target correction %+.0f W", self.limiter.power, self.grid.shave
+            )
+            self.set_grid_target(_target)
+
+    def record_quarter(self) -> None:
+        """Hand the price, SoC, setpoints and stance of this quarter to the recorder."""
+        if not self.recorder:
+            return
+        self.recorder.record_quarter(  # type: ignore[attr-defined]
+            "batman2", price=self.price["now"], soc=self.soc, stance=self.new_stance, greedy=self.greedy
+        )
+        for _idx, _bat in enumerate(self.fleet.names):
+            self.recorder.record_quarter(  # type: ignore[attr-defined]
+                _bat, soc=float(self.fleet.soc[_idx]), setpoint=int(self.fleet.setpoint[_idx])
+            )
+
+    def save_state(self) -> None:
+        """Save the state needed to continue after a reload of the app."""
+        _state: dict[str, Any] = {
+            "date": self.datum["today"].isoformat(),
+            "stance": self.new_stance,
+            "greedy": self.greedy,
+            "price": self.price,
+            "tibber_prices": self.tibber_prices,
+            "tibber_quarters": self.tibber_quarters,
+            "pwr_sp_list": self.fleet.setpoint.tolist(),
+            "low_pv": self.low_pv,
+        }
+        try:
+            ut.save_snapshot(self.snapshot_file, _state, cs.SNAPSHOT["version"])
+        except (OSError, TypeError, ValueError) as her:
+            self.log(f"Could not save state to {self.snapshot_file}: {her}", level="WARNING")
+
+    def restore_state(self) -> bool:
+        """Restore the state saved by save_state() if it is recent and from today.
+
+        Returns:
+            bool: True if the state was restored
+        """
+        _state = ut.load_snapshot(self.snapshot_file, cs.SNAPSHOT["version"], cs.SNAPSHOT["max_age"])
+        if _state is None or _state.get("date") != self.datum["today"].isoformat():
+            return False
+        try:
+            self.price = {**self.price, **_state["price"]}
+            self.tibber_prices = _state["tibber_prices"]
+            self.tibber_quarters = bool(_state["tibber_quarters"])
+            self.new_stance = self.prv_stance = str(_state["stance"])
+            self.greedy = int(_state["greedy"])
+            if len(_state["pwr_sp_list"]) == len(self.fleet):
+                self.fleet.setpoint[:] = [int(_sp) for _sp in _state["pwr_sp_list"]]
+            self.low_pv = bool(_state["low_pv"])
+        except (KeyError, TypeError, ValueError) as her:
+            self.log(f"Ignoring snapshot {self.snapshot_file}: {her}", level="WARNING")
+            return False
+        self.log(f"Restored state from {self.snapshot_file} (stance {self.new_stance})", level="INFO")
+        return True
 
     def lowpv_runin_cb(self, entity, new, **kwargs):
         """Handle low PV condition changes."""
@@ -432,11 +766,13 @@ class BatMan2(hass.Hass):
                     self.low_pv = new_state
                     if self.ctrl_by_me:
                         # Set power based on state: 100W each when low PV, 0W when normal
-                        if abs(self.pwr_sp_list[0]) < 110:  # avoid overwriting a CHARGE or DISCHARGE stance
-                            self.pwr_sp_list = [100, 100] if self.low_pv else [0, 0]
+                        # avoid overwriting a CHARGE or DISCHARGE stance
+                        if np.all(np.abs(self.fleet.setpoint) < 110):
+                            self.fleet.setpoint[:] = 100 if self.low_pv else 0
                             self.adjust_pwr_sp()
                     else:
                         self.log("*** Activity canceled. App is not in control.", level="WARNING")
+                    self.save_state()
             case _:
                 self.log(f"*** Invalid value for {entity}: {new}. No action taken.", level="ERROR")
 
@@ -445,172 +781,148 @@ class BatMan2(hass.Hass):
     def calc_stance(self):
         """Choose the current stance based on the current price and battery state
         and determine the battery power setpoint."""
-        self.log("=========================== ! ========================", level="DEBUG")
-        stance: str = self.new_stance
+        self.lg.debug("=========================== ! ========================")
         self.prv_stance = self.new_stance  # Keep the current stance
-        self.log(f"Previous stance was: {self.prv_stance}", level="DEBUG")
+        self.lg.debug("Previous stance was: %s", self.prv_stance)
         if self.ctrl_by_me is False:
             # we are switched off
             self.log("*** Control by app is disabled. No stance change! ***", level="WARNING")
             return
 
-        # calculate the SoC needed to be able to discharge for at least a whole hour.
-        _min_soc: float = self.bats_min_soc + (1 * cs.MIN_DISCHARGE / 100)
-        # calculate the power needed to discharge to the minimum SoC in an hour
-        _min_pwr: float = (self.soc - _min_soc) * 100
-        if _min_pwr < cs.MIN_DISCHARGE:
-            _min_pwr = 0
-        # _q3 = self.price["stats"]["q3"]
         _slot = self.get_slot()
-
-        if self.ev_charging:
-            # automation will have switched the batteries to IDLE.
-            stance = cs.IDLE
-            # we overrule this only if ev_assist is true
-            #   and the price is above Q3
-            #   and the SoC is above bats_min_soc
-            # if self.ev_assist and self.soc > _min_soc:  # or p1_power < -200
-            #     # stance = cs.DISCHARGE
-            #     # EV assist is essentially not available for now.
-            #     self.log(
-            #         f"EV is charging and price is above Q3 ({_q3:.3f}), but proposing to keep stance ({
-            #             stance
-            #         }).",
-            #         level="DEBUG",
-            #     )
-        else:
-            stance = cs.NOM  # default stance is NOM
-
-        # if it is a sunny day, batteries will charge automatically
-        # and we don't want to discharge during the expensive timeslots
-        # because that would drain the batteries and negatively affect
-        # solar availability for the EV charger.
-        # zomwin_override flips behavior from a sunny to a non-sunny day or vv.
-        _sunny_day: bool = self.datum["sunny"] and not self.zomwin_override
-        _discharge_bool = _sunny_day and (  # in spring/summer and not overridden
-            self.is_expensive(self.get_slot()) and self.ev_charging == cs.EV_ASSIST
-        )  # expensive slot
-        # if _sunny_day and (self.soc > _min_soc) and (self.is_expensive(self.get_slot())):
-        if _discharge_bool:
-            # For now we use NOM to avoid locking out the EV charger during "Grid Rewards".
-            stance = cs.NOM
-            self.log(
-                f"Sunny day, expensive slot {(self.get_slot() / 4):.2f}, but requesting NOM stance.",
-                level="INFO",
-            )
-
-        # this is supposed to charge the battery during the cheap hours in winter mimicking the ECO-mode
-        # using ABC-concept (Always Be Charging) and ignore SoC or prv_stance,
-        #       and charging *always* during the cheap slots.
-        _charge_bool = (
-            (not self.datum["sunny"])  # not a sunny day
-            and (not self.zomwin_override)  # override switch is off
-            and (self.is_cheap(_slot))  # cheap slot
+        _inp = st.StanceInput(
+            soc=self.soc,
+            min_soc=self.bats_min_soc,
+            slot=self.slot_class(_slot),
+            greedy=self.greedy,
+            ev_charging=self.ev_charging,
+            sunny=self.datum["sunny"],
+            override=self.zomwin_override,
+            low_pv=self.low_pv,
+            prv_stance=self.prv_stance,
+            setpoint=int(self.fleet.setpoint.mean()),
+            units=len(self.fleet),
+            capacity=float(self.fleet.capacity.sum()),
         )
-        # if (not self.datum["sunny"]) and (not self.zomwin_override) and (self.is_cheap(_slot)):
-        if _charge_bool:
-            self.log(
-                f"Non-sunny day and cheap slot {(_slot / 4):.2f}, so requesting CHARGE stance.",
-                level="INFO",
+        self.new_stance, _sp = st.decide(_inp)
+        if self.new_stance == cs.NOM:
+            self.fleet.setpoint[:] = _sp
+        elif self.new_stance in (cs.CHARGE, cs.DISCHARGE):
+            # split the power of the fleet over the batteries by the room they have left
+            self.fleet.setpoint[:] = self.fleet.allocate(_sp * len(self.fleet), self.bats_min_soc)
+        # IDLE: keep the setpoints
+        self.log_stance(_inp)
+        self.lg.debug("======================================================")
+
+    def log_stance(self, inp: st.StanceInput):
+        """Explain the decision taken by calc_stance()."""
+        _sunny_day: bool = inp.sunny and not inp.override
+        if _sunny_day and inp.slot > 0 and self.new_stance == cs.NOM:
+            self.lg.info(
+                "Sunny day, expensive slot %.2f, but requesting NOM stance.", lambda: self.get_slot() / 4
             )
-            stance = cs.CHARGE
-
-        # if prices are extremely high or low, we get greedy and switch to resp. DISCHARGE on sunny days
-        # or CHARGE stance on non-sunny days. However we may have to we suppress the greedy feeling,
-        # knowing not what tomorrow might bring...
-        match self.greedy:
+        if not inp.sunny and not inp.override and inp.slot < 0 and self.new_stance == cs.CHARGE:
+            self.lg.info(
+                "Non-sunny day and cheap slot %.2f, so requesting CHARGE stance.", lambda: self.get_slot() / 4
+            )
+        match inp.greedy:
             case -1:
-                _l = f"Greedy for CHARGE. But too high SoC ({self.soc:.1f} %)."
-                c_greed: bool = (self.prv_stance == cs.CHARGE and self.soc < 99.9) or (self.soc < _min_soc)
-                if c_greed:
-                    _l = "Greedy for CHARGE. Requesting CHARGE stance."
-                    stance = cs.CHARGE
-                self.log(_l)
+                if self.new_stance == cs.CHARGE:
+                    self.lg.info("Greedy for CHARGE. Requesting CHARGE stance.")
+                else:
+                    self.lg.info("Greedy for CHARGE. But too high SoC (%.1f %%).", inp.soc)
             case 1:
-                _l = "Greedy for DISCHARGE. But unfavourable conditions."
-                d_greed: bool = (self.prv_stance == cs.DISCHARGE and self.soc > _min_soc) or (
-                    _min_pwr > cs.MIN_DISCHARGE
-                )
-                # or (self.soc > _min_soc)
-                if d_greed:
-                    _l = f"Greedy for DISCHARGE. Requesting DISCHARGE stance. {_min_pwr:.0f} Wh available."
-                    stance = cs.DISCHARGE
-                self.log(_l)
+                if self.new_stance == cs.DISCHARGE:
+                    self.lg.info(
+                        "Greedy for DISCHARGE. Requesting DISCHARGE stance. %.0f Wh available.",
+                        st.discharge_energy(inp.soc, inp.min_soc, inp.capacity),
+                    )
+                else:
+                    self.lg.info("Greedy for DISCHARGE. But unfavourable conditions.")
             case _:
                 pass  # not greedy, do nothing
-
-        self.new_stance = stance
-        self.calc_pwr_sp(self.new_stance)
-        self.log("======================================================", level="DEBUG")
-
-    def calc_pwr_sp(self, stance):
-        """Calculate the power setpoints for the current stance."""
-        match stance:
+        match self.new_stance:
             case cs.NOM:
-                self.pwr_sp_list = [0, 0]
-                self.log("SP: No action required. Unit is in control (NOM).", level="DEBUG")
-                if self.low_pv:
-                    self.pwr_sp_list = [100, 100]
-                    self.log("SP: Low PV detected, keeping setpoint.", level="INFO")
+                self.lg.debug("SP: No action required. Unit is in control (NOM).")
+                if inp.low_pv:
+                    self.lg.summary("low_pv", "SP: Low PV detected, keeping setpoint.")
             case cs.IDLE:
-                # self.pwr_sp_list = [0, 0]
-                self.log("SP: No power setpoints. Unit is IDLE. ", level="DEBUG")
-            case cs.CHARGE:
-                _cp = int((100 - self.soc) * 100 / -2) * 4  # 2 batteries; 4 quarters
-                _chrgpwr = max(cs.CHARGE_PWR, _cp)
-                self.pwr_sp_list = [_chrgpwr, _chrgpwr]
-                if self.ev_charging:
-                    # EV charges at 5200 W
-                    # limit battery charging to below 8000 W
-                    # (allows for 2kW loads in the house)
-                    # SP on P1 (grid target) = 5200 + 2690 = 7890 W
-                    # SP on each battery = (7890 / -2) -3945 W
-                    self.pwr_sp_list = [-3945, -3945]
-                    self.log("SP: Reduced power setpoints because EV is charging. ", level="INFO")
-                # self.step_cnt = self.steps
-                self.log(
-                    f"SP: Power setpoints calculated for {stance} stance: {self.pwr_sp_list} W",
-                    level="INFO",
+                self.lg.debug("SP: No power setpoints. Unit is IDLE. ")
+            case cs.CHARGE | cs.DISCHARGE:
+                if self.new_stance == cs.CHARGE and inp.ev_charging:
+                    self.lg.info("SP: EV is charging; grid target set to %d W. ", cs.GRID_IMPORT_LIM)
+                self.lg.info(
+                    "SP: Power setpoints calculated for %s stance: %s W",
+                    self.new_stance,
+                    self.fleet.setpoint.tolist,
                 )
-            case cs.DISCHARGE:
-                _dp = int((self.bats_min_soc - self.soc) * 100 / -2)  # * 4  # 2 batteries; 4 quarters
-                _discpwr = min(cs.DISCHARGE_PWR, _dp)
-                self.pwr_sp_list = [_discpwr, _discpwr]
-                # self.step_cnt = self.steps
-                self.log(
-                    f"SP: Power setpoints calculated for {stance} stance: {self.pwr_sp_list} W",
-                    level="INFO",
-                )
-            case _:
-                self.log(f"SP: No power setpoints calculated for unknown stance {stance}. ", level="ERROR")
 
     def adjust_pwr_sp(self):
         """Control each battery to the desired power setpoint."""
-        xom_sp: int = 0
-        for idx, (_n, _b) in enumerate(self.bat_ctrl.items()):
-            if _n != "p1":
-                _sp: int = int(self.pwr_sp_list[idx])
-                xom_sp += _sp * -1  # invert the setpoint for the P1 meter
-            # # not used when using XOM SP
-            # _api = _b["api"]
-            # try:
-            #     if (self.prv_stance in ["API+", "API-"]) or (self.new_stance in ["API+", "API-"]):
-            #         # NOM->API; IDLE->API; API->API; API->NOM; API->IDLE
-            #         # _s: dict | str = _api.set_setpoint(_sp)
-            #     else:
-            #         _s = "IGNORED"
-            # except Exception as her:
-            #     _s = f"UNSUCCESFULL: {her}"
-            if _n == "p1":
-                _api = _b["api"]
-                try:
-                    _s: dict | str = _api.set_xom_setpoint(xom_sp)
-                except Exception as her:
-                    _s = f"UNSUCCESFULL: {her}"
-                if xom_sp != 0:
-                    self.log(
-                        f"Set XOM SP to ............... {xom_sp:+.0f} W  {_s} / {self.new_stance}", level="INFO"
-                    )
+        xom_sp: int = -int(self.fleet.setpoint.sum())  # invert the setpoints for the P1 meter
+        if self.new_stance == cs.CHARGE and self.ev_charging:
+            # the grid target is the P1 import: charge with what the EV leaves of the allowed import.
+            # The ImportLimiter trims this from the measured import.
+            xom_sp = cs.GRID_IMPORT_LIM
+        # # not used when using XOM SP
+        # for _n, _b in self.bat_ctrl.items():
+        #     _api = _b["api"]
+        #     try:
+        #         if (self.prv_stance in ["API+", "API-"]) or (self.new_stance in ["API+", "API-"]):
+        #             # NOM->API; IDLE->API; API->API; API->NOM; API->IDLE
+        #             # _s: dict | str = _api.set_setpoint(_sp)
+        #         else:
+        #             _s = "IGNORED"
+        #     except Exception as her:
+        #         _s = f"UNSUCCESFULL: {her}"
+        # ramp to the new base grid target; the PV overcurrent correction is added by the guard
+        _s = self.ramp_to(xom_sp)
+        if xom_sp != 0:
+            self.log(f"Set XOM SP to ............... {xom_sp:+.0f} W  {_s} / {self.new_stance}", level="INFO")
+
+    def ramp_to(self, target: int) -> dict | str:
+        """(Re)start ramping the base grid target to `target`. The first step is taken right away."""
+        if self.ramp_handle is not None:
+            # new target while still ramping to the previous one
+            self.cancel_timer(self.ramp_handle)
+            self.ramp_handle = None
+        self.ramp.retarget(target)
+        return self.ramp_step()
+
+    def ramp_step(self) -> dict | str:
+        """Take a step on the ramp and schedule the next one."""
+        if self.ramp.active:
+            self.ramp.step()
+        self.grid.base = self.ramp.value
+        _target = self.grid.target()
+        _s: dict | str = "UNCHANGED"
+        if _target != self.grid.sent:
+            _s = self.set_grid_target(_target)
+        if self.ramp.active:
+            self.ramp_handle = self.run_in(self.ramp_cb, cs.RAMP_RATE[1])
+        return _s
+
+    def ramp_cb(self, **kwargs):
+        """Next step of the ramp."""
+        self.ramp_handle = None
+        _s = self.ramp_step()
+        self.lg.debug(
+            "Ramp step %d: grid target %+d W (-> %+d W)  %s",
+            self.ramp.step_cnt,
+            self.ramp.value,
+            self.ramp.target,
+            _s,
+        )
+
+    def set_grid_target(self, target: int) -> dict | str:
+        """Send the grid target to the P1 meter."""
+        _api = self.bat_ctrl["p1"]["api"]
+        try:
+            _s: dict | str = _api.set_xom_setpoint(target)
+            self.grid.sent = target
+        except Exception as her:
+            _s = f"UNSUCCESFULL: {her}"
+        return _s
 
     def set_stance(self):
         """Set the current stance based on the current state."""
@@ -618,12 +930,14 @@ class BatMan2(hass.Hass):
             case cs.NOM:
                 # with contextlib.suppress(Exception):
                 if self.ctrl_by_me:
-                    self.adjust_pwr_sp()
+                    with self.prof.span("adjust_pwr_sp"):
+                        self.adjust_pwr_sp()
                 self.start_nom()
             case cs.IDLE:
                 # with contextlib.suppress(Exception):
                 if self.ctrl_by_me:
-                    self.adjust_pwr_sp()
+                    with self.prof.span("adjust_pwr_sp"):
+                        self.adjust_pwr_sp()
                 self.start_idle()
             case cs.CHARGE:
                 self.start_charge()
@@ -644,7 +958,7 @@ class BatMan2(hass.Hass):
                 if bat != "p1":
                     _api = self.bat_ctrl[bat]["api"]
                     _s = _api.set_strategy(stance.lower())
-                    self.log(f"Sent {bat} to {stance:>4} ........... {_s}", level="DEBUG")
+                    self.lg.debug("Sent %s to %4s ........... %s", bat, stance, _s)
 
     def start_idle(self):
         """Start the IDLE stance."""
@@ -657,7 +971,7 @@ class BatMan2(hass.Hass):
                 if bat != "p1":
                     _api = self.bat_ctrl[bat]["api"]
                     _s = _api.set_strategy(stance.lower())
-                    self.log(f"Sent {bat} to {stance:>4} ........... {_s}", level="DEBUG")
+                    self.lg.debug("Sent %s to %4s ........... %s", bat, stance, _s)
 
     def start_charge(self, power: int = cs.CHARGE_PWR):
         """Start the API- stance."""
@@ -689,16 +1003,12 @@ class BatMan2(hass.Hass):
             self.adjust_pwr_sp()
 
     def get_slot(self) -> int:
-        """Get the current slot."""
-        _hr: int = dt.datetime.now().hour
-        _mn: int = dt.datetime.now().minute
-        _qrtr: int = 0
-        _mul: int = 1
+        """Get the current slot; counted in real time since midnight so DST days are handled too."""
+        _qrtr: int = ut.calculate_quarter()
         if self.tibber_quarters:
-            # callback will be either on the hour or on the quarter
-            _mul = 4
-            _qrtr = int(_mn // 15) * 15
-        return int((_hr + _qrtr / 60) * _mul)
+            return _qrtr
+        # hourly prices
+        return _qrtr // 4
 
     def is_expensive(self, slot: float) -> bool:
         """Check if the current slot is in the list of expensive slots."""
@@ -708,6 +1018,14 @@ class BatMan2(hass.Hass):
         """Check if the current slot is in the list of cheap slots."""
         return slot in self.price["cheap_slot"]
 
+    def slot_class(self, slot: int) -> int:
+        """Classify the slot: -1 = cheap, 0 = normal, 1 = expensive."""
+        if self.is_cheap(slot):
+            return -1
+        if self.is_expensive(slot):
+            return 1
+        return 0
+
     # SECRETS
 
     # def get_tibber(self) -> tuple[str, str]:
@@ -719,7 +1037,7 @@ class BatMan2(hass.Hass):
     def get_bats(self):
         """Get the battery credentials from the secrets."""
         _auth_dict = {}
-        for _b in ["bat1", "bat2", "p1"]:
+        for _b in [*cs.BATTALK["bats"], "p1"]:
             _auth_dict[_b] = self.secrets.get_sessy_secrets(_b)  # type: ignore[attr-defined]
         return _auth_dict
 
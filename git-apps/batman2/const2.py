@@ -4,8 +4,8 @@ from typing import Any
 
 # ### GENERAL SETTINGS ### #
 VERSION = "2.6.8"
-# debugging mode
-DEBUG = True
+# debugging mode; can be overruled by `debug: true` in the app's YAML
+DEBUG = False
 # timezone for the app
 TZ = "Europe/Amsterdam"
 # maximum rates per battery
@@ -27,6 +27,10 @@ DISCHARGE_PWR: int = 1700  # W
 CHARGE: str = "API-"  # (-)-ve power setting
 CHARGE_PWR: int = -2200  # W
 IDLE: str = "IDLE"  # no power setting
+# limit on the power imported from the grid (EV charger + house + batteries); see gridctl2.ImportLimiter
+GRID_IMPORT_MAX: int = 8000  # W
+# also the grid target in the CHARGE stance while the EV is charging (see BatMan2.adjust_pwr_sp())
+GRID_IMPORT_LIM: int = 7500  # W; correct to this import when GRID_IMPORT_MAX is exceeded
 DEFAULT_STANCE: str = NOM
 # EV assist
 # when True, the app will assist the EV charging, notably when prices are high (>Q3)
@@ -40,11 +44,23 @@ CTRL_BY_ME = "input_boolean.bat_ctrl_app"
 BAT_MIN_SOC = "sensor.bats_minimum_soc"
 # HA automation: watchdog to detect if SoC is below minimum state of charge
 BAT_MIN_SOC_WD = "input_boolean.bats_min_soc"
+# bus topic with the SoC required to reach the next morning (published by nxtmorning)
+BUS_MIN_SOC = "bats_minimum_soc"
+# HA automation: baseload of the home (median own usage of the past day)
+HOME_BASELOAD = "input_number.home_baseload"
+# bus topics with the baseload and its statistics (published by nxtmorning)
+BUS_BASELOAD = "home_baseload"
+BUS_BASELOAD_STATS = "baseload_stats"
+# power reading P1 meter; (+) import, (-) export. Only used when tibberlive doesn't publish the grid power
+GRID_POWER = "sensor.p1_meter_power"
+# bus topic with the grid power (published by tibberlive)
+BUS_GRID_POWER = "grid_power"
+BUS_GRID_MAX_AGE = 30  # s; fall back to GRID_POWER when the bus has not been updated for this long
 # current reading HomeWizard meter on PV
 PV_CURRENT = "sensor.pv_kwh_meter_current"
-# PV-current watch dog > 23.5 A
-PV_CURRENT_WD = "input_boolean.pvovercurrent"
+# PV-current is watched on every sample of PV_CURRENT (see gridctl2.py)
 PV_CURRENT_MAX = 23.5  # A;abs
+PV_CURRENT_LIM = 21.0  # A;abs; correct to this current when PV_CURRENT_MAX is exceeded
 # voltage reading HomeWizard meter on PV
 PV_VOLTAGE = "sensor.pv_kwh_meter_voltage"
 # power reading HomeWizard meter on PV
@@ -53,10 +69,35 @@ PV_POWER = "sensor.pv_kwh_meter_power"
 LOW_PV = "binary_sensor.lowpv"
 # power reading HomeWizard meter on PV
 PV_POWER = "sensor.pv_kwh_meter_power"
-BATTERIES = ["sensor.bat1_state_of_charge", "sensor.bat2_state_of_charge"]
-SETPOINTS = ["number.bat1_power_setpoint", "number.bat2_power_setpoint"]
+# entities of each battery; {bat} is replaced by the names in BATTALK["bats"]
+BAT_SOC = "sensor.{bat}_state_of_charge"
+BAT_SETPOINT = "number.{bat}_power_setpoint"
+BAT_STRATEGY = "select.{bat}_power_strategy"
 BAT_XOM_SP = "number.sessy_p1_grid_target"
-BAT_STANCE = ["select.bat1_power_strategy", "select.bat2_power_strategy"]
+XOM_DEADBAND = 25  # W; smaller changes of the grid target are not sent to the P1 meter
+BAT_CAPACITY = 5200  # Wh; per battery
+# day-ahead plan published once per price update
+BAT_PLAN = "sensor.batman_plan"
+ATTR_PLAN: dict = {"friendly_name": "batman_plan"}
+# per-phase profiling of the control passes
+PROFILE = "input_boolean.batman_profile"  # on: capture cProfile and tracemalloc
+PROFILE_DUMP = "input_boolean.batman_profile_dump"  # on: write the ring buffer to PROFILE_FILE
+PROFILE_FILE = "batman2_profile.txt"  # in AppDaemon's config directory
+# warm-restart snapshot of the app's state; written after every control pass
+SNAPSHOT: dict[str, Any] = {
+    "file": "batman2_state.json",  # in AppDaemon's config directory
+    "version": 2,  # increment when the contents change
+    "max_age": 1800,  # [s] ignore older snapshots
+}
+# stochastic planning of the charge slots (see mcplan2.py)
+STOCHASTIC: dict[str, Any] = {
+    "enabled": False,  # choose the charge slots with mcplan2 instead of prices2.price_slots()
+    "scenarios": 1000,  # number of load/PV scenarios
+    "risk": 0.05,  # maximum probability of the SoC dropping below bats_min_soc
+    "pv_kwh": (1.0, 16.0),  # [kWh] mean daily PV yield around 21 Dec and around 21 Jun
+    "clouds": {"sunny": (4.0, 2.0), "dark": (2.0, 3.0)},  # beta distribution of the clear-sky fraction
+    "seed": None,  # seed of the random generator; None for a random seed
+}
 # time between setpoint changes when ramping to a new setpoint
 RAMP_RATE = [0.4, 23]  # [growthrate, time between steps]
 ZOMWIN_OVERRIDE = "input_boolean.bat_winterstand"
@@ -77,8 +118,8 @@ PRICES: dict = {
     },
     "update_interval": 15 * 60,  # seconds
     "adjust": {"hike": 0.021, "extra": 2.0, "taxes": 10.15, "btw": 1.21},
-    "qry_now": "{viewer {homes {currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {today      { total energy tax startsAt } } } } } }",
-    "qry_nxt": "{viewer {homes {currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {tomorrow   { total energy tax startsAt } } } } } }",
+    "qry_now": "{viewer {homes {id currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {today      { total energy tax startsAt } } } } } }",
+    "qry_nxt": "{viewer {homes {id currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {tomorrow   { total energy tax startsAt } } } } } }",
 }
 
 # create translation table between battery strategies and battalk stances
@@ -107,6 +148,6 @@ BATTALK: dict[str, Any] = {
 # Due to some hardware configuration issues the sign of various sensors
 # may be confusing.
 # Care should be taken when interpreting values.
-# BATTERIES: DISCHARGING power is positive, CHARGING power is negative
+# BAT_SETPOINT: DISCHARGING power is positive, CHARGING power is negative
 # PV_POWER: negative when supplying power to the home/grid, positive when CHARGING the batteries
 # PV_CURRENT: is always positive regardless of the direction of the current
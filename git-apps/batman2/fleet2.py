@@ -0,0 +1,74 @@
+"""Fleet of Sessy batteries for the Batman2 app.
+
+The state of all batteries is kept in arrays with one element per unit (in the order of
+cs.BATTALK["bats"]), so adding a battery only requires adding its name to the configuration.
+Power is signed like the battery setpoints: (+) discharging, (-) charging.
+"""
+
+import const2 as cs
+import numpy as np
+
+
+class BatteryFleet:
+    """Array-backed SoC, limits and setpoints of a number of batteries."""
+
+    def __init__(
+        self,
+        names: list[str],
+        capacity: float = cs.BAT_CAPACITY,
+        max_charge: int = cs.MAX_CHARGE,
+        max_discharge: int = cs.MAX_DISCHARGE,
+    ) -> None:
+        """Initialize the fleet; the limits apply to each unit."""
+        self.names: list[str] = list(names)
+        _n = len(self.names)
+        self.soc = np.zeros(_n, dtype=np.float64)  # [%]
+        self.setpoint = np.zeros(_n, dtype=np.int64)  # [W]
+        self.capacity = np.full(_n, capacity, dtype=np.float64)  # [Wh]
+        self.max_charge = np.full(_n, abs(max_charge), dtype=np.float64)  # [W] magnitude
+        self.max_discharge = np.full(_n, abs(max_discharge), dtype=np.float64)  # [W]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def entities(self, template: str) -> list[str]:
+        """Return the entity of each unit, e.g. entities("sensor.{bat}_state_of_charge")."""
+        return [template.format(bat=_b) for _b in self.names]
+
+    def soc_avg(self) -> float:
+        """Return the SoC of the fleet as a whole [%]."""
+        if not len(self):
+            return 0.0
+        return float(np.average(self.soc, weights=self.capacity))
+
+    def headroom(self, discharge: bool, min_soc: float = 0.0, hours: float = 0.25) -> np.ndarray:
+        """Return the power [W] each unit can (dis)charge for `hours` without exceeding its limits.
+
+        Args:
+            discharge: True for the discharge headroom, False for the charge headroom
+            min_soc: [%] do not discharge below this SoC
+            hours: [h] period over which the power is to be sustained
+        """
+        if discharge:
+            _energy = (self.soc - min_soc) / 100 * self.capacity
+            _limit = self.max_discharge
+        else:
+            _energy = (100 - self.soc) / 100 * self.capacity
+            _limit = self.max_charge
+        return np.clip(_energy / hours, 0.0, _limit)
+
+    def allocate(self, target: float, min_soc: float = 0.0, hours: float = 0.25) -> np.ndarray:
+        """Split a fleet power target [W] over the units in proportion to their headroom.
+
+        Units with more room to (dis)charge get a larger share. The result is limited to the
+        total headroom of the fleet.
+
+        Returns:
+            the setpoint per unit [W]
+        """
+        _room = self.headroom(target > 0, min_soc, hours)
+        _total = _room.sum()
+        if target == 0 or _total <= 0:
+            return np.zeros(len(self), dtype=np.int64)
+        _power = min(abs(target), _total) * _room / _total
+        return (np.sign(target) * np.rint(_power)).astype(np.int64)
@@ -0,0 +1,228 @@
+"""Control of the P1 grid target for the Batman2 app.
+
+The batteries and the PV panels share the circuit that is metered by the HomeWizard PV meter.
+The OvercurrentGuard watches the current in that circuit on every new sample and corrects the
+grid target of the P1 meter (XOM) so the current stays below cs.PV_CURRENT_MAX.
+The ImportLimiter does the same for the power imported from the grid, e.g. while the EV is
+charging, so the import stays below cs.GRID_IMPORT_MAX.
+
+The grid target that is sent is composed of:
+    base        the grid target required by the current stance (see BatMan2.adjust_pwr_sp())
+    correction  the correction needed to limit the PV circuit current
+    shave       the correction needed to limit the grid import (see ImportLimiter)
+
+Changes of the base are ramped (see Ramp) to avoid spikes on the grid; the correction is not.
+"""
+
+import const2 as cs
+import utils2 as ut
+
+
+class OvercurrentGuard:
+    """Correct the grid target when the PV circuit current exceeds its limit.
+
+    The batteries take a few samples to follow a new grid target, so the correction is not deepened
+    again until the current has risen or `settle` seconds have passed (anti-windup).
+    """
+
+    def __init__(
+        self,
+        i_max: float = cs.PV_CURRENT_MAX,
+        i_lim: float = cs.PV_CURRENT_LIM,
+        release: float = cs.RAMP_RATE[0],
+        hold: float = cs.RAMP_RATE[1],
+        deadband: int = cs.XOM_DEADBAND,
+        limit: float = len(cs.BATTALK["bats"]) * (cs.MAX_DISCHARGE - cs.MAX_CHARGE),
+        settle: float = cs.RAMP_RATE[1],
+    ) -> None:
+        """Initialize the guard.
+
+        Args:
+            i_max: [A] current at which the correction kicks in
+            i_lim: [A] current to correct to; the correction is released below this current
+            release: fraction of the correction that is released per step
+            hold: [s] minimum time between release steps
+            deadband: [W] changes of the grid target smaller than this are not sent
+            limit: [W] largest correction either way; from charging at full power to discharging at full power
+            settle: [s] time after which a correction that had no effect may be deepened again
+        """
+        self.i_max = i_max
+        self.i_lim = i_lim
+        self.release = release
+        self.hold = hold
+        self.deadband = deadband
+        self.limit = limit
+        self.settle = settle
+        self.base: int = 0  # [W] grid target for the current stance
+        self.correction: float = 0.0  # [W] (+) less export / more import; (-) less import
+        self.shave: float = 0.0  # [W] correction of the ImportLimiter; (-) less import
+        self.sent: int | None = None  # [W] last grid target that was accepted by the P1 meter
+        self._t_release: float = 0.0
+        self._i_deepen: float | None = None  # [A] current when the correction was last deepened
+
+    def target(self) -> int:
+        """Return the grid target: the base plus the corrections."""
+        return int(round(self.base + self.correction + self.shave))
+
+    def update(self, current: float, volt: float, power: float, now: float) -> int | None:
+        """Process a sample of the PV meter.
+
+        Args:
+            current: [A] PV circuit current (always positive)
+            volt: [V] PV circuit voltage
+            power: [W] PV circuit power; (-) supplying power to the home/grid, (+) charging the batteries
+            now: [s] monotonic time of the sample
+
+        Returns:
+            the new grid target if it should be sent, otherwise None
+        """
+        current = abs(current)
+        if current > self.i_max:
+            _excess = 0.0
+            if self._i_deepen is None or now - self._t_release >= self.settle:
+                # correct to i_lim in one go
+                _excess = (current - self.i_lim) * max(volt, 1.0)
+            elif current > self._i_deepen:
+                # the previous correction is still taking effect; only add the rise of the current
+                _excess = (current - self._i_deepen) * max(volt, 1.0)
+            if _excess:
+                # the direction depends on which way the current flows
+                _correction = self.correction + (_excess if power < 0 else -_excess)
+                self.correction = min(max(_correction, -self.limit), self.limit)
+                self._i_deepen = current
+                self._t_release = now
+            return self.due()
+        # the current is within its limit; the correction has taken effect
+        self._i_deepen = None
+        if current < self.i_lim and self.correction and now - self._t_release >= self.hold:
+            # release the correction geometrically
+            self.correction *= 1 - self.release
+            if abs(self.correction) < self.deadband:
+                self.correction = 0.0
+            self._t_release = now
+        return self.due()
+
+    def due(self) -> int | None:
+        """Return the grid target if it differs enough from the last one that was sent, otherwise None."""
+        _target = self.target()
+        if self.sent is None or abs(_target - self.sent) >= self.deadband:
+            return _target
+        if self.correction == 0.0 and self.shave == 0.0 and _target != self.sent:
+            # always restore the exact base once the correction is released
+            return _target
+        return None
+
+
+class ImportLimiter:
+    """Correct the grid target when the power imported from the grid exceeds its limit.
+
+    The correction is never positive: it only reduces the charging of the batteries or makes them
+    discharge. It is applied in one go and released geometrically, like the OvercurrentGuard.
+    The batteries take a few samples to follow a new grid target, so the correction is not deepened
+    again until the import has fallen or `settle` seconds have passed (anti-windup).
+    """
+
+    def __init__(
+        self,
+        p_max: float = cs.GRID_IMPORT_MAX,
+        p_lim: float = cs.GRID_IMPORT_LIM,
+        release: float = cs.RAMP_RATE[0],
+        hold: float = cs.RAMP_RATE[1],
+        deadband: int = cs.XOM_DEADBAND,
+        floor: float = -len(cs.BATTALK["bats"]) * (cs.MAX_DISCHARGE - cs.MAX_CHARGE),
+        settle: float = cs.RAMP_RATE[1],
+    ) -> None:
+        """Initialize the limiter.
+
+        Args:
+            p_max: [W] import at which the correction kicks in
+            p_lim: [W] import to correct to; the correction is released below this import
+            release: fraction of the correction that is released per step
+            hold: [s] minimum time between release steps
+            deadband: [W] smaller corrections are dropped
+            floor: [W] largest correction; from charging at full power to discharging at full power
+            settle: [s] time after which a correction that had no effect may be deepened again
+        """
+        self.p_max = p_max
+        self.p_lim = p_lim
+        self.release = release
+        self.hold = hold
+        self.deadband = deadband
+        self.floor = floor
+        self.settle = settle
+        self.correction: float = 0.0  # [W] (-) less import
+        self.power: float = 0.0  # [W] last sample of the grid power
+        self._t_release: float = 0.0
+        self._p_deepen: float | None = None  # [W] import when the correction was last deepened
+
+    def update(self, power: float, now: float) -> bool:
+        """Process a sample of the grid power.
+
+        The sample already includes the effect of the current correction, so only the remaining
+        excess is added; but not before the previous correction has taken effect.
+
+        Args:
+            power: [W] grid power; (+) import, (-) export
+            now: [s] monotonic time of the sample
+
+        Returns:
+            True if the correction changed
+        """
+        self.power = power
+        _prev = self.correction
+        if power > self.p_max:
+            if self._p_deepen is None or power < self._p_deepen or now - self._t_release >= self.settle:
+                self.correction = max(self.correction - (power - self.p_lim), self.floor)
+                self._p_deepen = power
+                self._t_release = now
+            return self.correction != _prev
+        # the import is within its limit; the correction has taken effect
+        self._p_deepen = None
+        if power < self.p_lim and self.correction and now - self._t_release >= self.hold:
+            # release no more than the room that is left below p_lim, so the import doesn't overshoot
+            _step = min(-self.correction * self.release, self.p_lim - power)
+            self.correction += _step
+            if abs(self.correction) < self.deadband:
+                self.correction = 0.0
+            self._t_release = now
+        return self.correction != _prev
+
+
+class Ramp:
+    """Approach a target geometrically, e.g. the base grid target after a change of stance.
+
+    Every step covers a fraction `rate` of the remaining distance. The ramp ends on the target when the
+    remaining distance is within the deadband or after `max_steps` steps.
+    """
+
+    def __init__(
+        self, rate: float = cs.RAMP_RATE[0], deadband: int = cs.XOM_DEADBAND, max_steps: int | None = None
+    ) -> None:
+        self.rate = rate
+        self.deadband = deadband
+        self.max_steps: int = max_steps or ut.get_steps(rate)
+        self.value: int = 0
+        self.target: int = 0
+        self.step_cnt: int = 0  # number of steps taken since the last retarget()
+
+    @property
+    def active(self) -> bool:
+        """True while the target has not been reached."""
+        return self.value != self.target
+
+    def retarget(self, target: int) -> None:
+        """Start ramping from the current value to a new target."""
+        self.target = int(target)
+        self.step_cnt = 0
+        if abs(self.target - self.value) < self.deadband:
+            # not worth ramping
+            self.value = self.target
+
+    def step(self) -> int:
+        """Take the next step and return the new value."""
+        self.step_cnt += 1
+        _next = self.value + (self.target - self.value) * self.rate
+        if abs(self.target - _next) < self.deadband or self.step_cnt >= self.max_steps:
+            _next = self.target
+        self.value = int(round(_next))
+        return self.value
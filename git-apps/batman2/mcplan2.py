@@ -0,0 +1,167 @@
+"""Stochastic (Monte Carlo) planning of the charge slots for the Batman2 app.
+
+The deterministic planner (prices2.price_slots()) treats the baseload and the sunny/non-sunny
+season as certain. Here N scenarios of the home load and the PV yield are sampled:
+
+    load    per scenario a level drawn from the baseload quantiles that nxtmorning computes,
+            with noise per quarter
+    PV      a clear-sky profile for the date and location, scaled by a seasonal daily yield
+            and a cloudiness factor per scenario
+
+Candidate schedules charge the batteries from the grid in the k cheapest slots (k = 0, 1, ...)
+and leave them on NOM otherwise. All candidates are simulated against all scenarios at once as
+arrays of shape (candidates, scenarios); only the slots are iterated. The candidate with the lowest
+expected cost whose probability of ending the day below bats_min_soc stays within the risk limit
+is chosen.
+"""
+
+import datetime as dt
+from typing import Any, NamedTuple
+
+import const2 as cs
+import numpy as np
+
+
+class MCResult(NamedTuple):
+    """Outcome of plan()."""
+
+    cheap: list[int]  # charge slots, as the 'cheap' slots of prices2.price_slots()
+    cost: float  # [cEUR] expected cost of the chosen schedule
+    risk: float  # probability of ending below the minimum SoC
+    costs: np.ndarray  # [cEUR] expected cost of each candidate
+    risks: np.ndarray  # risk of each candidate
+
+
+def baseload_quantiles(stats: dict[str, Any] | None, median: float) -> tuple[float, float, float]:
+    """Return the (q1, median, q3) of the baseload [W].
+
+    Args:
+        stats: the usage statistics of nxtmorning (see NextMorning.calc_stats()); may be None
+        median: the baseload to use when there are no statistics
+    """
+    if stats and all(_k in stats for _k in ("q1", "med", "q3")):
+        return float(stats["q1"]), float(stats["med"]), float(stats["q3"])
+    # assume the same spread as a typical day
+    return 0.75 * median, median, 1.5 * median
+
+
+def pv_clear_sky(
+    datum: dt.date, slots: int, latitude: float, longitude: float, utc_offset: float
+) -> np.ndarray:
+    """Return the relative PV yield per slot for a clear day; sums to 1.
+
+    Args:
+        datum: date
+        slots: number of slots in the day (24 or 96; 92/100 on DST days are close enough)
+        latitude, longitude: [deg] location
+        utc_offset: [h] offset of local time to UTC on that date
+    """
+    _doy = datum.timetuple().tm_yday
+    _decl = np.radians(23.44) * np.sin(2 * np.pi * (284 + _doy) / 365)
+    _lat = np.radians(latitude)
+    _daylen = 24 / np.pi * np.arccos(np.clip(-np.tan(_lat) * np.tan(_decl), -1.0, 1.0))  # [h]
+    _noon = 12.0 + utc_offset - longitude / 15  # [h] local time of solar noon
+    _t = (np.arange(slots) + 0.5) * 24 / slots  # [h] middle of each slot
+    _shape = np.clip(np.sin(np.pi * (_t - _noon + _daylen / 2) / _daylen), 0.0, None)
+    return _shape / max(float(_shape.sum()), 1e-9)
+
+
+def pv_daily(datum: dt.date, kwh: tuple[float, float] = cs.STOCHASTIC["pv_kwh"]) -> float:
+    """Return the seasonal mean PV yield [Wh] of a day; lowest around 21 Dec and highest around 21 Jun."""
+    _doy = datum.timetuple().tm_yday
+    _season = (1 - np.cos(2 * np.pi * (_doy + 10) / 365)) / 2  # 0 on 21 Dec; 1 on 21 Jun
+    return 1000 * (kwh[0] + (kwh[1] - kwh[0]) * _season)
+
+
+def scenarios(
+    n: int,
+    slots: int,
+    load: tuple[float, float, float],
+    pv_profile: np.ndarray,
+    pv_wh: float,
+    sunny: bool,
+    rng: np.random.Generator,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sample load and PV scenarios.
+
+    Returns:
+        the load and the PV power [W] per scenario per slot; both of shape (n, slots)
+    """
+    _q1, _med, _q3 = load
+    _sigma = max(_q3 - _q1, 1.0) / 1.349  # IQR of a normal distribution
+    _level = np.clip(rng.normal(_med, _sigma, (n, 1)), 0.5 * _q1, None)
+    _load = _level * rng.lognormal(0.0, 0.25, (n, slots))
+    # cloudiness; brighter on average in the sunny season
+    _a, _b = cs.STOCHASTIC["clouds"]["sunny" if sunny else "dark"]
+    _clear = rng.beta(_a, _b, (n, 1)) * rng.lognormal(0.0, 0.2, (n, slots))
+    _pv = pv_wh * pv_profile[None, :] * slots / 24 * _clear  # [Wh] per slot -> [W]
+    return _load, _pv
+
+
+def plan(
+    prices: np.ndarray | list[float],
+    soc: float,
+    min_soc: float,
+    load: np.ndarray,
+    pv: np.ndarray,
+    capacity: float,
+    max_charge: float,
+    max_discharge: float,
+    hours: float = 0.25,
+    risk: float = cs.STOCHASTIC["risk"],
+    rte: float = cs.AVG_RTE,
+) -> MCResult:
+    """Choose the charge slots with the best expected cost under a risk limit.
+
+    Args:
+        prices: [cEUR/kWh] price per slot
+        soc: [%] current SoC of the fleet
+        min_soc: [%] bats_minimum_soc
+        load, pv: [W] scenarios, as returned by scenarios(); shape (scenarios, slots)
+        capacity: [Wh] capacity of the fleet
+        max_charge, max_discharge: [W] power limits of the fleet (magnitudes)
+        hours: [h] duration of a slot
+        risk: maximum accepted probability of ending below min_soc, i.e. not making it to the next morning
+        rte: round-trip efficiency of the batteries
+
+    Returns:
+        the chosen schedule and the expected cost and risk of all candidates
+    """
+    _p = np.asarray(prices, dtype=np.float64)
+    _n_slots = _p.size
+    _eta = np.sqrt(rte)  # one-way efficiency
+    # candidates: charge in the k cheapest slots; no point in more slots than it takes to fill up from empty
+    _order = np.argsort(_p, kind="stable")
+    _k_max = int(np.ceil(capacity / (max_charge * hours * _eta)))
+    _k = np.arange(min(_k_max, _n_slots) + 1)
+    _rank = np.empty(_n_slots, dtype=np.int64)
+    _rank[_order] = np.arange(_n_slots)
+    _charge = _rank[None, :] < _k[:, None]  # (candidates, slots)
+
+    _net = (load - pv).astype(np.float64)  # (scenarios, slots) [W]; (+) the home needs power
+    _shape = (_k.size, _net.shape[0])
+    _soc = np.full(_shape, soc / 100 * capacity)  # [Wh]
+    _floor = min_soc / 100 * capacity
+    _cost = np.zeros(_shape)
+    for _t in range(_n_slots):
+        # NOM: the batteries follow the net load within their limits; charge slots charge at full power
+        _pwr = np.where(
+            _charge[:, _t, None], -max_charge, np.clip(_net[None, :, _t], -max_charge, max_discharge)
+        )
+        _out = np.minimum(np.maximum(_pwr, 0.0) * hours / _eta, _soc)  # [Wh] taken from the batteries
+        _in = np.minimum(np.maximum(-_pwr, 0.0) * hours * _eta, capacity - _soc)  # [Wh] stored
+        _soc += _in - _out
+        _grid = _net[None, :, _t] * hours - _out * _eta + _in / _eta  # [Wh] (+) import
+        _cost += _grid * _p[_t] / 1000
+    _costs = _cost.mean(axis=1)
+    _risks = (_soc < _floor).mean(axis=1)
+    _ok = np.flatnonzero(_risks <= risk)
+    # within the risk limit take the cheapest; otherwise the safest
+    _best = int(_ok[np.argmin(_costs[_ok])]) if _ok.size else int(np.argmin(_risks))
+    return MCResult(
+        cheap=sorted(_order[: _k[_best]].tolist()),
+        cost=float(_costs[_best]),
+        risk=float(_risks[_best]),
+        costs=_costs,
+        risks=_risks,
+    )
@@ -0,0 +1,140 @@
+"""Vectorised stance planning for the Batman2 app.
+
+Evaluates the rules of stance2.decide() for all quarters of a day at once using NumPy.
+The only sequential dependency in those rules is the greed hysteresis on the previous stance;
+it is resolved with a set/keep latch computed with cumulative maxima instead of a loop.
+"""
+
+import base64
+import itertools
+
+import const2 as cs
+import numpy as np
+
+# stance codes used in the plan arrays
+STANCES: tuple[str, ...] = (cs.NOM, cs.IDLE, cs.CHARGE, cs.DISCHARGE)
+NOM, IDLE, CHARGE, DISCHARGE = range(len(STANCES))
+_LETTERS: str = "NICD"  # one letter per stance code for the run-length encoding
+_LOW_PV_PWR: int = 100  # [W] setpoint per battery when low PV is detected in NOM
+
+
+def _latch(set_: np.ndarray, keep: np.ndarray, init: bool) -> np.ndarray:
+    """Return out[t] = set_[t] | (keep[t] & out[t-1]) with out[-1] = init, without a loop."""
+    _idx = np.arange(set_.size)
+    _last_set = np.maximum.accumulate(np.where(set_, _idx, -1))
+    _last_reset = np.maximum.accumulate(np.where(~set_ & ~keep, _idx, -1))
+    _untouched = (_last_set < 0) & (_last_reset < 0)
+    return (_last_set > _last_reset) | (_untouched & init)
+
+
+def greed(price: np.ndarray, q1: float, greed_ll: float, greed_hh: float, sunny: bool) -> np.ndarray:
+    """Vectorised utils2.get_greedy() for a list of prices."""
+    _hh = greed_hh if sunny else 2 * greed_hh  # be less greedy on non-sunny days
+    _g = np.where(price <= greed_ll, -1, 0)
+    return np.where(price - q1 >= _hh, 1, _g).astype(np.int8)
+
+
+def plan_day(
+    soc: np.ndarray,
+    min_soc: np.ndarray | float,
+    slot: np.ndarray,
+    greedy: np.ndarray,
+    ev_charging: np.ndarray | bool,
+    sunny: bool,
+    override: bool,
+    low_pv: np.ndarray | bool = False,
+    prv_stance: str = cs.DEFAULT_STANCE,
+    setpoint: int = 0,
+    units: int = len(cs.BATTALK["bats"]),
+    capacity: float = len(cs.BATTALK["bats"]) * cs.BAT_CAPACITY,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Plan the stance and the power setpoint per battery for every quarter.
+
+    The arrays may hold a single day or several days back-to-back (e.g. for backtesting);
+    for a single day the fixed overhead of the NumPy calls dominates.
+
+    Args:
+        soc: [%] average state of charge of the batteries per quarter
+        min_soc: [%] sensor.bats_minimum_soc (per quarter or fixed)
+        slot: -1 = cheap slot, 0 = normal slot, 1 = expensive slot
+        greedy: greediness per quarter (see greed())
+        ev_charging: EV is charging (per quarter or fixed)
+        sunny: sunny season as determined by utils2.is_sunny_day()
+        override: zomer/winter override switch
+        low_pv: low PV export/import detected (per quarter or fixed)
+        prv_stance: stance before the first quarter
+        setpoint: [W] setpoint per battery before the first quarter
+        units: number of batteries
+        capacity: [Wh] capacity of all batteries together
+
+    Returns:
+        the stance codes (index into STANCES) and the power setpoints per battery [W]
+    """
+    soc = np.asarray(soc, dtype=np.float64)
+    _n = soc.size
+    slot = np.asarray(slot)
+    greedy = np.asarray(greedy)
+    ev = np.broadcast_to(np.asarray(ev_charging, dtype=bool), (_n,))
+    low_pv = np.broadcast_to(np.asarray(low_pv, dtype=bool), (_n,))
+    min_soc = np.broadcast_to(np.asarray(min_soc, dtype=np.float64), (_n,))
+    _min_soc = min_soc + 1 * cs.MIN_DISCHARGE / 100
+
+    # stance without greed
+    base = np.where(ev, IDLE, NOM)
+    if sunny and not override:
+        base = np.where((slot > 0) & (ev == cs.EV_ASSIST), NOM, base)
+    base_charge = np.zeros(_n, dtype=bool)
+    if not sunny and not override:
+        base_charge = slot < 0
+
+    # greed with hysteresis on the previous stance
+    _g_lo = greedy < 0
+    _g_hi = greedy > 0
+    _set_d = _g_hi & ((soc - _min_soc) / 100 * capacity > cs.MIN_DISCHARGE)
+    discharge = _latch(_set_d, _g_hi & (soc > _min_soc), prv_stance == cs.DISCHARGE)
+    _set_c = (base_charge & ~discharge) | (_g_lo & (soc < _min_soc))
+    charge = _latch(_set_c, _g_lo & (soc < 99.9), prv_stance == cs.CHARGE)
+    stance = np.where(discharge, DISCHARGE, np.where(charge, CHARGE, base)).astype(np.int8)
+
+    # setpoints per stance
+    _chrg = np.maximum(cs.CHARGE_PWR, np.trunc((100 - soc) / -100 * capacity / units) * 4)  # in a quarter
+    _dchrg = np.minimum(cs.DISCHARGE_PWR, np.trunc((min_soc - soc) / -100 * capacity / units))  # in an hour
+    _nom = np.where(low_pv, _LOW_PV_PWR, 0)
+    sp = np.select([stance == CHARGE, stance == DISCHARGE, stance == NOM], [_chrg, _dchrg, _nom], 0)
+    # IDLE keeps the setpoint of the previous quarter
+    _idx = np.maximum.accumulate(np.where(stance != IDLE, np.arange(_n), -1))
+    sp = np.where(_idx >= 0, sp[np.maximum(_idx, 0)], setpoint)
+    return stance, sp.astype(np.int32)
+
+
+def project_soc(soc: float, setpoint: np.ndarray, hours: float = 0.25) -> np.ndarray:
+    """Project the average SoC at the start of each slot assuming the setpoints are met.
+
+    Args:
+        soc: [%] current average state of charge
+        setpoint: [W] setpoint per battery per slot; (+) discharging, (-) charging
+        hours: [h] duration of a slot
+
+    Returns:
+        [%] projected SoC per slot
+    """
+    _delta = -np.asarray(setpoint, dtype=np.float64)[:-1] * hours / cs.BAT_CAPACITY * 100
+    # the batteries saturate at 0 % and 100 %; so this can't be a plain cumsum
+    _soc = itertools.accumulate(_delta.tolist(), lambda _s, _d: min(100.0, max(0.0, _s + _d)), initial=soc)
+    return np.fromiter(_soc, dtype=np.float64, count=len(setpoint))
+
+
+def rle(codes: np.ndarray) -> str:
+    """Encode stance codes as a run-length string, e.g. '32N8C20N12D24N'."""
+    codes = np.asarray(codes)
+    if codes.size == 0:
+        return ""
+    _starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    _lengths = np.diff(np.append(_starts, codes.size))
+    return "".join(f"{_l}{_LETTERS[_c]}" for _l, _c in zip(_lengths, codes[_starts], strict=True))
+
+
+def b64_int8(values: np.ndarray, scale: int = 100) -> str:
+    """Encode values as base64 of an int8 array after dividing by scale."""
+    _v = np.clip(np.rint(np.asarray(values, dtype=np.float64) / scale), -128, 127).astype(np.int8)
+    return base64.b64encode(_v.tobytes()).decode("ascii")
@@ -5,6 +5,7 @@ from statistics import quantiles as stqu
 from typing import Any
 
 import const2 as cs
+import numpy as np
 import requests
 import utils2 as ut
 from dateutil import parser
@@ -36,6 +37,12 @@ class Tibber:
         data = convert(resp_data)
         return data
 
+    def get_pricedicts(self) -> dict[str, dict[str, float]]:
+        """Get the price lists of all homes of the account from the API, keyed by home ID."""
+        payload: dict = {"query": self.qry_now}
+        now_data: dict = post_request(_url=self.api_url, _headers=self.headers_post, _payload=payload)
+        return {_home: convert(_data) for _home, _data in unpeel_homes(_data=now_data, _key="today").items()}
+
 
 def post_request(_url: str, _headers: dict[str, str], _payload: dict[str, str]) -> dict:
     """Make a POST request to the given URL with the specified headers and payload.
@@ -63,18 +70,8 @@ def post_request(_url: str, _headers: dict[str, str], _payload: dict[str, str])
 
 
 def unpeel(_data: dict[str, dict], _key: str) -> list[dict]:
-    """Unpeel the data from the given key."""
-    _lkey: list = []
-    try:
-        _ldata: dict = _data["data"]
-        _lviewer: dict = _ldata["viewer"]
-        _lhomes: list = _lviewer["homes"]
-        _lhome: dict = _lhomes[0]
-        _lcurSub: dict = _lhome["currentSubscription"]
-        _lpriceInfo: dict = _lcurSub["priceInfo"]
-        _lkey = _lpriceInfo[_key]
-    except KeyError:
-        pass
+    """Unpeel the data from the given key of the first home with a subscription."""
+    _lkey: list = next(iter(unpeel_homes(_data, _key).values()), [])
     # fmt: off
     # _lkey is a list of dicts with the following structure:
     # [{'total': 0.277, 'energy': 0.1069, 'tax': 0.1701, 'startsAt': '2025-06-22T00:00:00.000+02:00'},
@@ -85,22 +82,48 @@ def unpeel(_data: dict[str, dict], _key: str) -> list[dict]:
     return _lkey
 
 
+def unpeel_homes(_data: dict[str, dict], _key: str) -> dict[str, list[dict]]:
+    """Unpeel the data from the given key for every home, keyed by home ID.
+
+    Homes without a (current) subscription are left out.
+    """
+    _ret: dict[str, list[dict]] = {}
+    try:
+        _lhomes: list = _data["data"]["viewer"]["homes"]
+    except (KeyError, TypeError):
+        return _ret
+    for _idx, _lhome in enumerate(_lhomes):
+        try:
+            _lkey: list[dict] = _lhome["currentSubscription"]["priceInfo"][_key]
+        except (KeyError, TypeError):
+            continue
+        if _lkey:
+            # the ID is missing when the query doesn't ask for it
+            _ret[str(_lhome.get("id", _idx))] = _lkey
+    return _ret
+
+
 def convert(_data: list[dict]) -> dict[str, float]:
     _ret: dict[str, float] = {}
+    _utc: dict[str, float] = {}
     for item in _data:
-        sample_time = parser.isoparse(item["startsAt"]).strftime("%Y-%m-%d %H:%M:%S")
+        _start = parser.isoparse(item["startsAt"])
+        # keep the UTC offset; the hour after the switch to wintertime occurs twice
+        sample_time = _start.strftime("%Y-%m-%d %H:%M:%S%z")
         price = float(item["total"]) * 100  # float cEUR/kWh
         _ret[sample_time] = price
+        _utc[sample_time] = _start.timestamp()
 
     # fmt: off
     # _ret is a dict with the following structure:
-    # {'2025-06-22 00:00:00': 27.700000000000003,
-    #  '2025-06-22 01:00:00': 27.0,
-    #  '2025-06-22 02:00:00': 26.75,
-    #  '2025-06-22 03:00:00': 25.729999999999997,
+    # {'2025-06-22 00:00:00+0200': 27.700000000000003,
+    #  '2025-06-22 01:00:00+0200': 27.0,
+    #  '2025-06-22 02:00:00+0200': 26.75,
+    #  '2025-06-22 03:00:00+0200': 25.729999999999997,
     #  }
     # fmt: on
-    return dict(sorted(_ret.items()))
+    # sort in real time; sorting the strings would put 02:00+0100 before 02:00+0200
+    return dict(sorted(_ret.items(), key=lambda _kv: _utc[_kv[0]]))
 
 
 def get_pricedict(token: str, url: str) -> dict[str, float]:
@@ -110,6 +133,11 @@ def get_pricedict(token: str, url: str) -> dict[str, float]:
     return _a
 
 
+def get_pricedicts(token: str, url: str) -> dict[str, dict[str, float]]:
+    """Get the price lists of all homes from the API, keyed by home ID."""
+    return Tibber(token, url).get_pricedicts()
+
+
 def get_price(price_dict: dict[str, float], hour: int, min: int) -> float:
     _price: float = 0.0
     # Round the minutes to the nearest 15 minutes to get the quarter
@@ -202,3 +230,115 @@ def price_statistics(prices: list[float]) -> dict:
         f"iqr: {price_stats.get('iqr', 'N/A'):.3f}"
     )
     return price_stats
+
+
+def price_statistics_table(prices: np.ndarray) -> list[dict]:
+    """Calculate the price statistics of a number of price lists of equal length in one pass.
+
+    Args:
+        prices: one row of prices per home
+
+    Returns:
+        list[dict]: the statistics of each row, as price_statistics() returns them
+    """
+    # numpy's default ('linear') quantiles are the 'inclusive' quantiles of the statistics module
+    _q = np.quantile(prices, [0.25, 0.5, 0.75], axis=1)
+    _min = prices.min(axis=1)
+    _max = prices.max(axis=1)
+    _avg = prices.mean(axis=1)
+    # a stable sort, like utils2.sort_index()
+    _order = np.argsort(prices, axis=1, kind="stable")
+    _ret: list[dict] = []
+    for _r in range(prices.shape[0]):
+        _sorted = prices[_r, _order[_r]]
+        # slots with a price below q1, the median and q3 are at the start of the sorted row
+        _n1, _n2, _n3 = np.searchsorted(_sorted, _q[:, _r], side="left")
+        _si: list[int] = _order[_r].tolist()
+        _stats: dict[str, Any] = {
+            "min": round(float(_min[_r]), 3),
+            "q1": round(float(_q[0, _r]), 3),
+            "med": round(float(_q[1, _r]), 3),
+            "avg": round(float(_avg[_r]), 3),
+            "q3": round(float(_q[2, _r]), 3),
+            "max": round(float(_max[_r]), 3),
+            "range": round(float(_max[_r] - _min[_r]), 3),
+            "iqr": round(float(_q[2, _r] - _q[0, _r]), 3),
+            "idx": {"Q1": _si[:_n1], "Q2": _si[_n1:_n2], "Q3": _si[_n2:_n3], "Q4": _si[_n3:], "ALL": _si},
+        }
+        _stats["text"] = (
+            f"min: {_stats['min']:.3f}, "
+            f"q1 : {_stats['q1']:.3f}, "
+            f"med: {_stats['med']:.3f}, "
+            f"avg: {_stats['avg']:.3f}, "
+            f"q3 : {_stats['q3']:.3f}, "
+            f"max: {_stats['max']:.3f}, "
+            f"range: {_stats['range']:.3f}, "
+            f"iqr: {_stats['iqr']:.3f}"
+        )
+        _ret.append(_stats)
+    return _ret
+
+
+def price_slots(
+    prices: list[float],
+    stats: dict,
+    soc: float,
+    quarters: bool = True,
+    slots: list[int] = cs.SLOTS,
+    rte: float = cs.AVG_RTE,
+) -> dict[str, Any]:
+    """Determine the cheap (charge) and expensive (discharge) slots for the given prices.
+
+    Args:
+        prices (list[float]): list of prices for today
+        stats (dict): price statistics as returned by price_statistics()
+        soc (float): current average state of charge [%]
+        quarters (bool): whether the prices are quarterly (True) or hourly (False)
+        slots (list[int]): maximum number of charge and discharge slots
+        rte (float): average round-trip efficiency of the batteries
+
+    Returns:
+        dict: the charge ('cheap') and discharge ('expen') slots and the figures used to select them
+    """
+    # Attempt to predict the number of charge slots we need
+    # (100 [%] - soc [%] )
+    # / ( (cs.MAX_CHARGE [W/h.bat] / 100 [W/%] )
+    #     ) * 4 [qrt/hr] = [qrt]
+    _cqrtrs: int = int((100 - soc) / (abs(cs.MAX_CHARGE) / 100) * 4)
+    _ret: dict[str, Any] = {"n_charge": _cqrtrs}
+    _cqrtrs = min(_cqrtrs, slots[0])
+    _cslot: int = -1 * _cqrtrs
+    _dslot: int = slots[1]
+    # allow for hourly prices
+    _div = 1 if quarters else 4
+    # in case of hourly prices we need to make sure we get int(hours)
+    _cslot = int(_cslot / _div)
+
+    # Get sorted indices of the price list
+    sorted_indices = stats["idx"]["ALL"]
+
+    # Get the N cheapest slots indices in Q1
+    charge_today = sorted(stats["idx"]["Q1"][_cslot:])
+    # get the average price during the charge slots
+    _ret["avg_charge"] = sum(prices[idx] for idx in charge_today) / max(1, len(charge_today))
+    # Get the average price for the rest of the day (not charging)
+    not_charge_today = [idx for idx in sorted_indices if idx not in charge_today]
+    _ret["avg_notcharge"] = sum(prices[idx] for idx in not_charge_today) / max(1, len(not_charge_today))
+    # Determine BEP
+    _ret["bep_charge"] = _ret["avg_charge"] / rte
+    if _ret["bep_charge"] >= _ret["avg_notcharge"]:
+        charge_today = []
+    _ret["cheap"] = charge_today
+
+    # ...do the same for discharging
+    _dslot = int(_dslot / _div)
+    # Get the N most expensive slots indices
+    # prices in Q4 are by definition above the average
+    all_expensive = sorted(stats["idx"]["Q4"][:_dslot])
+    # get the average price during Q4 slots
+    _ret["avg_discharge"] = sum(prices[idx] for idx in all_expensive) / max(1, len(all_expensive))
+    # Determine BEP
+    _ret["bep_discharge"] = _ret["avg_discharge"] * rte
+    # are they also above the BEP?
+    _ret["expen"] = [idx for idx in all_expensive if prices[idx] > _ret["bep_discharge"]]
+    return _ret
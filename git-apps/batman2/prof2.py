@@ -0,0 +1,111 @@
+"""Per-phase profiling of the control passes of the Batman2 app.
+
+Each pass (a callback that runs the control pipeline) is timed per named phase. When deep
+profiling is switched on, the pass is also captured with cProfile and tracemalloc.
+The last passes are kept in a ring buffer that can be dumped to a file.
+"""
+
+import cProfile
+import datetime as dt
+import io
+import pstats
+import time
+import tracemalloc
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+
+class PassProfiler:
+    """Collect timing spans per control pass."""
+
+    def __init__(self, keep: int = 16, top: int = 25) -> None:
+        """Keep the last `keep` passes; deep profiles list the `top` functions and allocations."""
+        self.passes: deque[dict[str, Any]] = deque(maxlen=keep)
+        self.top: int = top
+        self.deep: bool = False
+        self.current: dict[str, Any] | None = None
+        self._t0: float = 0.0
+        self._profile: cProfile.Profile | None = None
+
+    def set_deep(self, deep: bool) -> None:
+        """Switch the cProfile/tracemalloc capture on or off."""
+        self.deep = deep
+        if deep and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if not deep and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def begin(self, name: str) -> None:
+        """Start timing a pass."""
+        if self._profile is not None:
+            # the previous pass was never ended; don't leave its profiler running
+            self._profile.disable()
+            self._profile = None
+        self.current = {
+            "pass": name,
+            "start": dt.datetime.now().isoformat(timespec="seconds"),
+            "spans": {},
+            "total": 0.0,
+        }
+        if self.deep:
+            tracemalloc.reset_peak()
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # another profiler is already active
+                self._profile = None
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time a phase of the current pass."""
+        _t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.current is not None:
+                _spans = self.current["spans"]
+                _spans[name] = _spans.get(name, 0.0) + (time.perf_counter() - _t0) * 1000
+
+    def end(self) -> dict[str, Any] | None:
+        """Finish the current pass and store it in the ring buffer."""
+        _pass = self.current
+        if _pass is None:
+            return None
+        _pass["total"] = (time.perf_counter() - self._t0) * 1000
+        if self._profile is not None:
+            self._profile.disable()
+        # take the snapshot before formatting the cProfile stats, so these don't show up in it
+        if self.deep and tracemalloc.is_tracing():
+            _pass["mem_peak"] = tracemalloc.get_traced_memory()[1]
+            _snap = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__)])
+            _top = _snap.statistics("lineno")[: self.top]
+            _pass["tracemalloc"] = "\n".join(str(_stat) for _stat in _top)
+        if self._profile is not None:
+            _s = io.StringIO()
+            pstats.Stats(self._profile, stream=_s).sort_stats("cumulative").print_stats(self.top)
+            _pass["cprofile"] = _s.getvalue()
+            self._profile = None
+        self.passes.append(_pass)
+        self.current = None
+        return _pass
+
+    @staticmethod
+    def text(_pass: dict[str, Any]) -> str:
+        """Return a one-line summary of a pass."""
+        _spans = ", ".join(f"{_k}: {_v:.1f}" for _k, _v in _pass["spans"].items())
+        return f"{_pass['pass']} {_pass['total']:.1f} ms  [ {_spans} ]"
+
+    def dump(self, filename: str) -> int:
+        """Write all passes in the ring buffer to a file. Returns the number of passes written."""
+        with open(filename, "w", encoding="utf-8") as _f:
+            for _pass in self.passes:
+                _f.write(f"=== {_pass['start']} {self.text(_pass)}\n")
+                if "mem_peak" in _pass:
+                    _f.write(f"--- tracemalloc peak: {_pass['mem_peak']} bytes\n{_pass['tracemalloc']}\n")
+                if "cprofile" in _pass:
+                    _f.write(f"--- cProfile:\n{_pass['cprofile']}\n")
+        return len(self.passes)
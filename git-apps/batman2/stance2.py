@@ -0,0 +1,105 @@
+"""Pure stance decision kernel for the Batman2 app.
+
+The rules of BatMan2.calc_stance() without any side-effects: no wall-clock, no logging and no
+instance state. The app, the simulators and the tests feed it an immutable StanceInput and get
+back the new stance and the power setpoint per battery. The energies are those of the whole
+fleet, so the setpoint per battery depends on the number of batteries and their capacity.
+"""
+
+from typing import NamedTuple
+
+import const2 as cs
+
+# bind the constants locally; decide() is called in tight loops by the simulators
+_NOM: str = cs.NOM
+_IDLE: str = cs.IDLE
+_CHARGE: str = cs.CHARGE
+_DISCHARGE: str = cs.DISCHARGE
+_EV_ASSIST: bool = cs.EV_ASSIST
+_CHARGE_PWR: int = cs.CHARGE_PWR
+_DISCHARGE_PWR: int = cs.DISCHARGE_PWR
+_MIN_DISCHARGE: int = cs.MIN_DISCHARGE
+# SoC needed on top of the minimum SoC to be able to discharge for at least a whole hour.
+_MIN_SOC_MARGIN: float = 1 * cs.MIN_DISCHARGE / 100
+_LOW_PV_PWR: int = 100  # [W] setpoint per battery when low PV is detected in NOM
+_UNITS: int = len(cs.BATTALK["bats"])
+
+
+class StanceInput(NamedTuple):
+    """Everything the stance decision depends on."""
+
+    soc: float  # [%] average state of charge of the batteries
+    min_soc: float  # [%] sensor.bats_minimum_soc
+    slot: int  # -1 = cheap slot, 0 = normal slot, 1 = expensive slot
+    greedy: int  # greediness as determined by utils2.get_greedy()
+    ev_charging: bool  # EV is charging
+    sunny: bool  # sunny season as determined by utils2.is_sunny_day()
+    override: bool  # zomer/winter override switch
+    low_pv: bool  # low PV export/import detected
+    prv_stance: str  # stance during the previous pass
+    setpoint: int  # [W] current power setpoint per battery (kept when IDLE)
+    units: int = _UNITS  # number of batteries
+    capacity: float = _UNITS * cs.BAT_CAPACITY  # [Wh] capacity of all batteries together
+
+
+def discharge_energy(soc: float, min_soc: float, capacity: float = _UNITS * cs.BAT_CAPACITY) -> float:
+    """Return the energy [Wh] the fleet can discharge in an hour before reaching the minimum SoC.
+
+    Below MIN_DISCHARGE it is not worth the effort and 0 is returned.
+    """
+    _energy = (soc - min_soc - _MIN_SOC_MARGIN) / 100 * capacity
+    return _energy if _energy > _MIN_DISCHARGE else 0.0
+
+
+def decide(inp: StanceInput) -> tuple[str, int]:
+    """Choose the stance and the power setpoint per battery.
+
+    Args:
+        inp (StanceInput): the current state of the system
+
+    Returns:
+        tuple: the new stance and the power setpoint per battery [W]
+    """
+    soc, min_soc, slot, greedy, ev_charging, sunny, override, low_pv, prv_stance, setpoint, units, capacity = (
+        inp
+    )
+    _min_soc = min_soc + _MIN_SOC_MARGIN
+
+    # automation will have switched the batteries to IDLE when the EV is charging.
+    stance = _IDLE if ev_charging else _NOM
+
+    # if it is a sunny day, batteries will charge automatically
+    # and we don't want to discharge during the expensive timeslots
+    # because that would drain the batteries and negatively affect
+    # solar availability for the EV charger.
+    # For now we use NOM to avoid locking out the EV charger during "Grid Rewards".
+    if sunny and not override and slot > 0 and ev_charging == _EV_ASSIST:
+        stance = _NOM
+
+    # this is supposed to charge the battery during the cheap hours in winter mimicking the ECO-mode
+    # using ABC-concept (Always Be Charging) and ignore SoC or prv_stance.
+    if not sunny and not override and slot < 0:
+        stance = _CHARGE
+
+    # if prices are extremely high or low, we get greedy. However we may have to suppress
+    # the greedy feeling, knowing not what tomorrow might bring...
+    if greedy < 0:
+        if (prv_stance == _CHARGE and soc < 99.9) or (soc < _min_soc):
+            stance = _CHARGE
+    elif greedy > 0 and (
+        (prv_stance == _DISCHARGE and soc > _min_soc) or discharge_energy(soc, min_soc, capacity)
+    ):
+        # the power needed to discharge to the minimum SoC in an hour must be worth the effort
+        stance = _DISCHARGE
+
+    if stance == _NOM:
+        return stance, (_LOW_PV_PWR if low_pv else 0)
+    if stance == _CHARGE:
+        # while the EV is charging BatMan2 sends GRID_IMPORT_LIM as the grid target instead (see adjust_pwr_sp())
+        # fill the batteries in a quarter
+        return stance, max(_CHARGE_PWR, int((100 - soc) / -100 * capacity / units) * 4)
+    if stance == _DISCHARGE:
+        # empty the batteries to the minimum SoC in an hour
+        return stance, min(_DISCHARGE_PWR, int((min_soc - soc) / -100 * capacity / units))
+    # IDLE: keep the current setpoint
+    return stance, setpoint
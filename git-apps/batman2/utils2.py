@@ -1,5 +1,10 @@
+import contextlib
 import datetime as dt
+import json
 import math
+import os
+import tempfile
+import time
 
 import const2 as cs
 import pytz
@@ -74,6 +79,32 @@ def is_sunny_day(datum: dt.date) -> bool:
     return spring_equinox <= datum <= autumn_equinox
 
 
+def calculate_quarter(datim: dt.datetime | None = None) -> int:
+    """Return the serial index of the 15-minute interval (quarter) in the day for the given datetime object.
+
+    The index is counted in real time since local midnight, so on DST transition days it runs
+    from 0 to 91 (spring) or 0 to 99 (autumn) and always points at the matching price.
+    Naive datetimes are taken to be local time (cs.TZ); the default is the current time.
+    """
+    _tz = pytz.timezone(cs.TZ)
+    if datim is None:
+        datim = dt.datetime.now(_tz)
+    elif datim.tzinfo is None:
+        datim = _tz.localize(datim)
+    else:
+        datim = datim.astimezone(_tz)
+    _midnight = _tz.localize(dt.datetime.combine(datim.date(), dt.time()))
+    return int((datim.timestamp() - _midnight.timestamp()) // 900)
+
+
+def quarters_in_day(datum: dt.date) -> int:
+    """Return the number of quarters in the given local day (92, 96 or 100)."""
+    _tz = pytz.timezone(cs.TZ)
+    _start = _tz.localize(dt.datetime.combine(datum, dt.time()))
+    _end = _tz.localize(dt.datetime.combine(datum + dt.timedelta(days=1), dt.time()))
+    return int((_end.timestamp() - _start.timestamp()) // 900)
+
+
 def get_these_days() -> dict:
     """Get today's date, tomorrow's date, and whether today is a sunny day.
 
@@ -122,3 +153,40 @@ def get_greedy(price: float, diff: float, lo_price: float, hi_diff: float, sunny
 def get_steps(stepsize: float, deadband: float = 0.1):
     """Calculate the number of steps required to get from 0 to 100% given a stepsize."""
     return math.ceil(math.log(deadband) / math.log(1 - stepsize))
+
+
+def save_snapshot(filename: str, state: dict, version: int) -> None:
+    """Write a versioned snapshot of the state to a JSON file.
+
+    The snapshot is written to a temporary file in the same directory which then replaces the
+    previous snapshot, so a crash or reload halfway never leaves a truncated file behind.
+    """
+    _data = {"version": version, "saved": time.time(), "state": state}
+    _fd, _tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(_fd, "w", encoding="utf-8") as _f:
+            json.dump(_data, _f, separators=(",", ":"))
+        os.replace(_tmp, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(_tmp)
+        raise
+
+
+def load_snapshot(filename: str, version: int, max_age: float) -> dict | None:
+    """Return the state from a snapshot file.
+
+    Returns None when there is no (readable) snapshot, when it has a different version
+    or when it is older than `max_age` seconds.
+    """
+    try:
+        with open(filename, encoding="utf-8") as _f:
+            _data = json.load(_f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(_data, dict) or _data.get("version") != version:
+        return None
+    if time.time() - float(_data.get("saved", 0)) > max_age:
+        return None
+    _state: dict | None = _data.get("state")
+    return _state
@@ -4,38 +4,74 @@ High-level Home Electricity Monitoring & Management System.
 """
 
 import datetime as dt
+import os
 from typing import Any
 
 import appdaemon.plugins.hass.hassapi as hass
 import battalk3 as bt3
 import const3 as cs
+import lazylog3 as lz
 import prices3 as pr
 import utils3 as ut
 
 
 class BatMan3(hass.Hass):
+    # clients of the batteries and Tibber; BatMan3a uses the asyncio versions
+    SESSY: type = bt3.Sessy
+    TIBBER: type = pr.Tibber
+    # entities read by get_monitor_states()
+    MONITORS: tuple[str, ...] = (
+        cs.BAT_MIN_SOC,
+        cs.CTRL_BY_ME,
+        cs.EV_REQ_PWR,
+        cs.LOW_PV,
+        cs.ZOMWIN_OVERRIDE,
+        cs.PV_CURRENT,
+        cs.PV_VOLTAGE,
+        cs.PV_POWER,
+    )
+
     def initialize(self):
         """Initialize the app."""
-        self.debug: bool = cs.DEBUG
+        self.debug: bool = bool(self.args.get("debug", cs.DEBUG))
+        if self.debug:
+            self.set_log_level("DEBUG")
+        self.lg = lz.LazyLog(self)
         self.log(f"===================================== BatMan3 v{cs.VERSION} ====", level="INFO")
         # Keep track of active callbacks
         self.starting = True
+        self.ready = False  # prices and battery status have been fetched
         self.callback_handles: list[Any] = []
         self.callback_time = dt.datetime.now()
 
         # create internal references
         self.secrets = self.get_app("scrts")
         self.battalk = self.get_app("battalk")
+        # time our callbacks
+        self.perf = self.get_app("perf")
+        if self.perf:
+            self.perf.instrument(  # type: ignore[attr-defined]
+                self, ["quarter_started_cb", "watchdog_cb", "watchdog_runin_cb", "lowpv_runin_cb"]
+            )
 
         # initialize date/time info
         self.datum: dict = ut.get_these_days()
 
-        # initialize Tibber API
+        # initialize Tibber API; prices are fetched by warmup_cb()
         self.tibber_sensor: str = self.secrets.get_tibber_sensor()  # type: ignore[attr-defined]
-        self.tibber = pr.Tibber(
+        self.tibber = self.TIBBER(
             token=self.secrets.get_tibber_token(),  # type: ignore[attr-defined]
             url=self.secrets.get_tibber_url(),  # type: ignore[attr-defined]
+            fetch=False,
+            home=self.args.get("home_id"),
         )
+        # shared price service; when it is not running we fetch the prices ourselves
+        self.prices_app = self.get_app("prices")
+        # derived values of other apps (e.g. the minimum SoC); when not running we read them from HA
+        self.bus = self.get_app("bus")
+        self.new_prices: bool = False  # the price service has new prices for today
+        if self.prices_app:
+            self.prices_app.subscribe(self.prices_cb, home=self.tibber.home)  # type: ignore[attr-defined]
 
         # initialize store for price related info
         self.price: dict = {
@@ -51,15 +87,16 @@ class BatMan3(hass.Hass):
             "stats": {},  # prices statistics
         }
 
-        # initialize the battery API
+        # initialize the battery API; the batteries are contacted by warmup_cb()
         self.bats: list = cs.BATTALK["bats"]
         self.bat_ctrl: dict[str, Any] = self.get_bats(devices=self.bats)
         for _b in self.bat_ctrl:
-            self.bat_ctrl[_b]["api"] = bt3.Sessy(
+            self.bat_ctrl[_b]["api"] = self.SESSY(
                 url=self.bat_ctrl[_b]["url"],
                 username=self.bat_ctrl[_b]["username"],
                 password=self.bat_ctrl[_b]["password"],
             )
+            self.bat_ctrl[_b]["state"] = self.bat_ctrl[_b]["api"].status
         # initialize the P1 API
         # self.p1s: list = ["p1"]
         # self.p1_ctrl: dict = self.get_bats(devices=self.p1s)
@@ -69,30 +106,33 @@ class BatMan3(hass.Hass):
         #         username=self.p1_ctrl[_b]["username"],
         #         password=self.p1_ctrl[_b]["password"],
         #     )
-        self.get_bats_status()
 
         # Initialize various monitors with safe defaults ...
         self.bats_min_soc: float = 0.0  # [%]
         self.ctrl_by_me: bool = False  # whether the app is allowed to control the batteries
         self.ev_charging: bool = True  # whether the EV is charging
         self.low_pv: bool = False  # wether solarpanels or batteries are supplying electricity
+        self.sw_override: bool = False  # zomer/winter override
+        # continue where we left off when the app was reloaded
+        self.snapshot_file: str = os.path.join(str(self.config_dir), cs.SNAPSHOT["file"])
+        self.restored: bool = self.restore_state()
         # These are for the overcurrent detection:
         self.pv_current: float = 0.0  # [A]; used to monitor PV overcurrent
         self.pv_power: int = 0  # [W]; used to control PV power
         self.pv_volt: float = 0.0  # [V]; used to control PV current
         # ... and make sure we get updates when these change ...
         self.set_call_backs()
-        # ... then get their actual state
-        self.get_monitor_states()
+        # ... then get their actual state and the prices as soon as AppDaemon has finished
+        # initialising the apps; the network I/O doesn't hold up the other apps.
+        self.run_in(self.warmup_cb, 0)
 
         self.log("BatMan3 is running...", level="INFO")
-        self.log_pricelist()
-        self.log_status(caller="INIT")
-        self.starting = False
 
     def terminate(self):
         """Clean up app."""
         self.log("__Terminating BatMan3...")
+        if self.prices_app:
+            self.prices_app.unsubscribe(self.prices_cb)  # type: ignore[attr-defined]
         # Cancel all registered callbacks
         for handle in self.callback_handles:
             self.cancel_listen_state(handle)
@@ -101,73 +141,93 @@ class BatMan3(hass.Hass):
 
     def update_tibber_prices(self) -> None:
         """Update the tibber price list a midnight otherwise just update the current price."""
-        if ut.is_midnight(dt.datetime.now()):
-            self.tibber.update_prices()
+        if ut.is_midnight(dt.datetime.now()) or not self.tibber.pricelist or self.new_prices:
+            self.fetch_prices()
             self.log_pricelist()
         else:
             self.tibber.update_current_price()
 
+    def fetch_prices(self) -> None:
+        """Get today's prices from the price service, or from Tibber when the service is not running."""
+        _day = None
+        if self.prices_app:
+            _day = self.prices_app.get_day(fetch=True, home=self.tibber.home)  # type: ignore[attr-defined]
+        self.new_prices = False
+        if _day is not None:
+            self.tibber.set_prices(_day.pricedict())
+        else:
+            self.tibber.update_prices()
+
     def log_pricelist(self, _len=10):
-        self.log(f"*** {len(self.tibber.prices)} TIBBER prices available ***")
+        self.lg.info("*** %d TIBBER prices available ***", len(self.tibber.prices))
+        self.lg.info("[ \n%s ]\n%s", lambda: self.format_pricelist(_len), self.tibber.statstext)
+        self.lg.info("%s", self.tibber.greed_c)
+        self.lg.info("%s", self.tibber.cheap)
+        self.lg.info("%s", self.tibber.expen)
+        self.lg.info("%s", self.tibber.greed_d)
+
+    def format_pricelist(self, _len=10) -> str:
+        """Format the pricelist in rows of `_len` prices."""
         # convert to a list of formatted strings
         _fstrl = [f"{i:+06.2f}" for i in self.tibber.pricelist]
-        _f = "\n".join([", ".join(_fstrl[i : i + _len]) for i in range(0, len(_fstrl), _len)])
-        self.log(f"[ \n{_f} ]\n{self.tibber.statstext}", level="INFO")
-        self.log(f"{self.tibber.greed_c}", level="INFO")
-        self.log(f"{self.tibber.cheap}", level="INFO")
-        self.log(f"{self.tibber.expen}", level="INFO")
-        self.log(f"{self.tibber.greed_d}", level="INFO")
+        return "\n".join([", ".join(_fstrl[i : i + _len]) for i in range(0, len(_fstrl), _len)])
 
     def get_monitor_states(self, caller: str = ""):
         """Get the state of all monitored entities."""
+        self.set_monitor_states({_e: self.get_state(_e) for _e in self.MONITORS})
+        self.get_bats_status()
+
+    def set_monitor_states(self, states: dict[str, Any]) -> None:
+        """Update the monitors from the states of the MONITORS entities."""
         # update the calendar/season info
         self.datum = ut.get_these_days()
         try:
             # minimum SoC required to provide power until next morning
-            _bms: Any = self.get_state(cs.BAT_MIN_SOC)
+            _bms: Any = self.bus.get(cs.BUS_MIN_SOC) if self.bus else None  # type: ignore[attr-defined]
+            if _bms is None:
+                _bms = states[cs.BAT_MIN_SOC]
             self.bats_min_soc = float(_bms)
         except BaseException:
             self.log("*** BAT_MIN_SOC state update failed")
 
         try:
             # check if we are allowed to control the batteries
-            _ctrl: Any = self.get_state(cs.CTRL_BY_ME)
+            _ctrl: Any = states[cs.CTRL_BY_ME]
             self.ctrl_by_me = str(_ctrl) == "on"
         except BaseException:
             self.log("*** CTRL_BY_ME state update failed")
 
         try:
             # check whether the EV is currently charging
-            _evc: Any = self.get_state(cs.EV_REQ_PWR)
+            _evc: Any = states[cs.EV_REQ_PWR]
             self.ev_charging = str(_evc) == "on"
         except BaseException:
             self.log("*** EV_REQ_PWR state update failed")
 
         try:
             # check if PV/BAT is delivering electricity
-            _lpv: Any = self.get_state(cs.LOW_PV)
+            _lpv: Any = states[cs.LOW_PV]
             self.low_pv = str(_lpv) == "on"
         except BaseException:
             self.log("*** LOW_PV state update failed")
 
         try:
             # check if PV/BAT is delivering electricity
-            _swo: Any = self.get_state(cs.ZOMWIN_OVERRIDE)
+            _swo: Any = states[cs.ZOMWIN_OVERRIDE]
             self.sw_override = str(_swo) == "on"
         except BaseException:
             self.log("*** ZOMWIN_OVERRIDE state update failed")
 
         try:
             # get PV/BAT current and power values
-            _pvc: Any = self.get_state(cs.PV_CURRENT)
+            _pvc: Any = states[cs.PV_CURRENT]
             self.pv_current = float(_pvc)  # [A]
-            _pvv: Any = self.get_state(cs.PV_VOLTAGE)
+            _pvv: Any = states[cs.PV_VOLTAGE]
             self.pv_volt = int(float(_pvv))  # [V]
-            _pvp: Any = self.get_state(cs.PV_POWER)
+            _pvp: Any = states[cs.PV_POWER]
             self.pv_power = int(float(_pvp))  # [W]
         except BaseException:
             self.log("*** PV meter state update failed")
-        self.get_bats_status()
 
     def set_call_backs(self) -> None:
         """Set-up callbacks for price changes and watchdogs."""
@@ -210,12 +270,33 @@ class BatMan3(hass.Hass):
 
     # CALLBACKS
 
+    def prices_cb(self, day) -> None:
+        """Called by the price service when new prices are available; they are used in the next quarter."""
+        if day.pricedict() != self.tibber.prices:
+            self.new_prices = True
+
+    def warmup_cb(self, **kwargs) -> None:
+        """Fetch the prices and the state of the batteries after initialize() has returned."""
+        self.callback_time = dt.datetime.now()
+        if not self.restored:
+            self.fetch_prices()
+        if not self.tibber.pricelist:
+            # quarter_started_cb() will try again
+            self.log("*** Tibber prices unavailable", level="WARNING")
+        self.get_monitor_states()
+        self.ready = True
+        self.starting = False
+        self.log_pricelist()
+        self.log_status(caller="INIT")
+        self.save_state()
+
     def quarter_started_cb(self, **kwargs) -> None:
         """Callback for current price change."""
         self.callback_time = dt.datetime.now()
         self.update_tibber_prices()
         self.get_monitor_states()
         self.log_status(caller="qrtStart")
+        self.save_state()
 
     def watchdog_cb(self, entity, attribute, old, new, **kwargs):
         """Callback for changes to monitored automations."""
@@ -236,15 +317,52 @@ class BatMan3(hass.Hass):
         self.callback_time = dt.datetime.now()
         self.get_monitor_states()
         self.log_status(caller="WD_runin_cb")
+        self.save_state()
 
     def lowpv_runin_cb(self, entity, new, **kwargs):
         """Handle low PV condition changes."""
         self.callback_time = dt.datetime.now()
         self.get_monitor_states()
         self.log_status(caller="lowpv_runin_cb")
+        self.save_state()
 
     # CONTROL LOGIC
 
+    # SNAPSHOT
+
+    def save_state(self) -> None:
+        """Save the state needed to continue after a reload of the app."""
+        _state: dict[str, Any] = {
+            "date": self.datum["today"].isoformat(),
+            "prices": self.tibber.prices,
+            "bats": {_b: self.bat_ctrl[_b]["state"] for _b in self.bat_ctrl},
+        }
+        try:
+            ut.save_snapshot(self.snapshot_file, _state, cs.SNAPSHOT["version"])
+        except (OSError, TypeError, ValueError) as her:
+            self.log(f"Could not save state to {self.snapshot_file}: {her}", level="WARNING")
+
+    def restore_state(self) -> bool:
+        """Restore the prices and battery status saved by save_state() if recent and from today.
+
+        Returns:
+            bool: True if the state was restored
+        """
+        _state = ut.load_snapshot(self.snapshot_file, cs.SNAPSHOT["version"], cs.SNAPSHOT["max_age"])
+        if _state is None or _state.get("date") != self.datum["today"].isoformat():
+            return False
+        try:
+            if _state["prices"]:
+                self.tibber.set_prices(_state["prices"])
+            for _b, _s in _state["bats"].items():
+                if _b in self.bat_ctrl:
+                    self.bat_ctrl[_b]["state"] = _s
+        except (KeyError, TypeError, ValueError, AttributeError) as her:
+            self.log(f"Ignoring snapshot {self.snapshot_file}: {her}", level="WARNING")
+            return False
+        self.log(f"Restored state from {self.snapshot_file}", level="INFO")
+        return bool(self.tibber.pricelist)
+
     # SECRETS
 
     def get_bats(self, devices) -> dict:
@@ -255,9 +373,12 @@ class BatMan3(hass.Hass):
         return _auth_dict
 
     def get_bats_status(self) -> None:
-        """Get the battery status."""
+        """Get the battery status. Keeps the last known status of batteries that don't respond."""
         for _b in self.bat_ctrl:
-            self.bat_ctrl[_b]["state"] = self.bat_ctrl[_b]["api"].get_status()
+            try:
+                self.bat_ctrl[_b]["state"] = self.bat_ctrl[_b]["api"].get_status()
+            except Exception as her:
+                self.log(f"*** {_b} status update failed: {her}", level="WARNING")
         """example: >
         {
           "status": "ok",
@@ -292,6 +413,13 @@ class BatMan3(hass.Hass):
 
     def log_status(self, caller: str):
         """Construct a status message and log it."""
+        if not self.ready:
+            # nothing to report until warmup_cb() has finished
+            return
+        self.lg.info("%s", lambda: self.status_text(caller))
+
+    def status_text(self, caller: str) -> str:
+        """Construct a status message."""
         _C = "C" if self.ctrl_by_me else "c"
         _E = "E" if self.ev_charging else "e"
         _L = "L" if self.low_pv else "l"
@@ -303,7 +431,7 @@ class BatMan3(hass.Hass):
             _S = _S.lower()
 
         _pn = self.tibber.price_now  # current price
-        _pd = _pn - self.tibber.stats["q1"]  # difference with price at Q1
+        _pd = _pn - self.tibber.stats.get("q1", _pn)  # difference with price at Q1
         _p = f" p={_pn:+06.2f}/{_pd:+06.2f}"
         _qn = self.tibber.quarter_now  # current quarter
         _q = f"{_p}@{_qn:02d}/{_qn / 4:05.2f}"
@@ -325,8 +453,8 @@ class BatMan3(hass.Hass):
             _str.append( ">".join(_strl))
             #_str+=_bst
 
-        _bts = f" | 1:{_str[0]} | 2:{_str[1]}"
+        _bts = "".join(f" | {_i}:{_s}" for _i, _s in enumerate(_str, start=1))
 
         _time = (dt.datetime.now() - self.callback_time).total_seconds()
         self.status = "".join([_O, _C, _E, _L, _S, _q, _bts, f" <{caller}@{_time:.3f}"])
-        self.log(self.status, level="INFO")
+        return self.status
@@ -0,0 +1,127 @@
+"""BatMan3a
+
+BatMan3 with asyncio callbacks. The batteries and Tibber are contacted with aiohttp through a
+single connection pool and all I/O of a pass is gathered, so a pass takes as long as its slowest
+device and doesn't occupy one of AppDaemon's worker threads while waiting.
+"""
+
+import asyncio
+import datetime as dt
+from typing import Any
+
+import aiohttp
+import batman3
+import battalk3 as bt3
+import const3 as cs
+import prices3 as pr
+import utils3 as ut
+
+
+class BatMan3a(batman3.BatMan3):
+    SESSY: type = bt3.AsyncSessy
+    TIBBER: type = pr.AsyncTibber
+
+    def initialize(self):
+        """Initialize the app; the aiohttp session is opened by the first callback."""
+        self.session: aiohttp.ClientSession | None = None
+        super().initialize()
+
+    async def terminate(self):
+        """Clean up app."""
+        if self.session is not None:
+            await self.session.close()
+        await self.run_in_executor(super().terminate)
+
+    def open_session(self) -> None:
+        """Open the aiohttp session shared by the batteries and Tibber; must be called from the event loop."""
+        if self.session is not None and not self.session.closed:
+            return
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=cs.ASYNC_HTTP["limit"], ssl=False),
+            timeout=aiohttp.ClientTimeout(total=cs.ASYNC_HTTP["timeout"]),
+        )
+        for _b in self.bat_ctrl:
+            self.bat_ctrl[_b]["api"].session = self.session
+        self.tibber.session = self.session
+
+    async def update_tibber_prices(self) -> None:  # type: ignore[override]
+        """Update the tibber price list a midnight otherwise just update the current price."""
+        if ut.is_midnight(dt.datetime.now()) or not self.tibber.pricelist or self.new_prices:
+            await self.fetch_prices()
+            self.log_pricelist()
+        else:
+            self.tibber.update_current_price()
+
+    async def fetch_prices(self) -> None:  # type: ignore[override]
+        """Get today's prices from the price service, or from Tibber when the service is not running."""
+        _day = None
+        if self.prices_app:
+            # the price service may have to fetch them (blocking)
+            _get_day = self.prices_app.get_day  # type: ignore[attr-defined]
+            _day = await self.run_in_executor(_get_day, True, self.tibber.home)
+        self.new_prices = False
+        if _day is not None:
+            self.tibber.set_prices(_day.pricedict())
+        else:
+            await self.tibber.update_prices()
+
+    async def get_monitor_states(self, caller: str = ""):  # type: ignore[override]
+        """Get the state of all monitored entities and the status of the batteries."""
+        _states = await asyncio.gather(*(self.get_state(_e) for _e in self.MONITORS))
+        self.set_monitor_states(dict(zip(self.MONITORS, _states, strict=True)))
+        await self.get_bats_status()
+
+    async def get_bats_status(self) -> None:  # type: ignore[override]
+        """Get the status of all batteries at once; batteries that don't respond keep their last status."""
+        _bats = list(self.bat_ctrl)
+        _results: list[Any] = await asyncio.gather(
+            *(self.bat_ctrl[_b]["api"].get_status() for _b in _bats), return_exceptions=True
+        )
+        for _b, _res in zip(_bats, _results, strict=True):
+            if isinstance(_res, BaseException):
+                self.log(f"*** {_b} status update failed: {_res}", level="WARNING")
+            else:
+                self.bat_ctrl[_b]["state"] = _res
+
+    # CALLBACKS
+
+    async def warmup_cb(self, **kwargs) -> None:  # type: ignore[override]
+        """Fetch the prices and the state of the batteries after initialize() has returned."""
+        self.callback_time = dt.datetime.now()
+        self.open_session()
+        if self.restored:
+            await self.get_monitor_states()
+        else:
+            await asyncio.gather(self.fetch_prices(), self.get_monitor_states())
+        if not self.tibber.pricelist:
+            # quarter_started_cb() will try again
+            self.log("*** Tibber prices unavailable", level="WARNING")
+        self.ready = True
+        self.starting = False
+        self.log_pricelist()
+        self.log_status(caller="INIT")
+        await self.run_in_executor(self.save_state)
+
+    async def quarter_started_cb(self, **kwargs) -> None:  # type: ignore[override]
+        """Callback for current price change."""
+        self.callback_time = dt.datetime.now()
+        self.open_session()
+        await asyncio.gather(self.update_tibber_prices(), self.get_monitor_states())
+        self.log_status(caller="qrtStart")
+        await self.run_in_executor(self.save_state)
+
+    async def watchdog_runin_cb(self, entity, attribute, old, new, **kwargs):  # type: ignore[override]
+        """Delayed callback for watchdogs."""
+        self.callback_time = dt.datetime.now()
+        self.open_session()
+        await self.get_monitor_states()
+        self.log_status(caller="WD_runin_cb")
+        await self.run_in_executor(self.save_state)
+
+    async def lowpv_runin_cb(self, entity, new, **kwargs):  # type: ignore[override]
+        """Handle low PV condition changes."""
+        self.callback_time = dt.datetime.now()
+        self.open_session()
+        await self.get_monitor_states()
+        self.log_status(caller="lowpv_runin_cb")
+        await self.run_in_executor(self.save_state)
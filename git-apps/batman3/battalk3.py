@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 """Control the Sessy Battery"""
 
+import copy
 from typing import Any
 
+import aiohttp
 import const3 as cs
 import requests
 
@@ -20,7 +22,8 @@ class Sessy:
         self.api_call: dict[str, str] = cs.BATTALK["api_calls"]
         self.strat: dict[str, str] = cs.BATTALK["api_strats"]
         self.headers: dict[str, str] = {"accept": "application/json"}
-        self.status: dict[str, Any] = self.get_status()
+        # the battery is not contacted until the first call to get_status()
+        self.status: dict[str, Any] = copy.deepcopy(cs.SESSY_STATUS)
 
     def set_strategy(self, stance: str) -> dict:
         """Set strategy on battery"""
@@ -71,4 +74,70 @@ class Sessy:
         response = self.session.get(_url, headers=self.headers, auth=self.session.auth)
         response.raise_for_status()
         ret: dict[str, Any] = response.json()
+        self.status = ret
+        return ret
+
+
+class AsyncSessy:
+    """asyncio version of Sessy; the requests go through a shared aiohttp session.
+
+    The session must be set (see BatMan3a.open_session()) before any of the methods is awaited.
+    """
+
+    def __init__(self, url: str, username, password, session: aiohttp.ClientSession | None = None) -> None:
+        """Initialize the AsyncSessy class."""
+        self.session = session
+        self.auth = aiohttp.BasicAuth(username, password)
+        self.bat_ip: str = url
+        self.api_call: dict[str, str] = cs.BATTALK["api_calls"]
+        self.strat: dict[str, str] = cs.BATTALK["api_strats"]
+        self.headers: dict[str, str] = {"accept": "application/json"}
+        # the battery is not contacted until the first call to get_status()
+        self.status: dict[str, Any] = copy.deepcopy(cs.SESSY_STATUS)
+
+    async def _get(self, call: str) -> Any:
+        _url = f"{self.bat_ip}/{self.api_call[call]}"
+        async with self.session.get(  # type: ignore[union-attr]
+            _url, headers=self.headers, auth=self.auth
+        ) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def _post(self, call: str, cmd: dict[str, Any]) -> Any:
+        _url = f"{self.bat_ip}/{self.api_call[call]}"
+        async with self.session.post(  # type: ignore[union-attr]
+            _url, headers=self.headers, json=cmd, auth=self.auth
+        ) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def set_strategy(self, stance: str) -> dict:
+        """Set strategy on battery"""
+        ret: dict = await self._post("strategy", {"strategy": self.strat[stance]})
+        return ret
+
+    async def get_strategy(self) -> str:
+        """Get current battery strategy"""
+        ret: str = (await self._get("strategy"))["strategy"]
+        return ret
+
+    async def set_setpoint(self, setpoint: int) -> dict:
+        """Set setpoint on the battery"""
+        ret: dict = await self._post("setpoint", {"setpoint": setpoint})
+        return ret
+
+    async def get_setpoint(self) -> str:
+        """Get current battery setpoint"""
+        ret: str = (await self._get("status"))["sessy"]["power_setpoint"]
+        return ret
+
+    async def set_xom_setpoint(self, setpoint: int) -> dict:
+        """Set XOM setpoint on the P1 meter"""
+        ret: dict = await self._post("grid_target", {"grid_target": setpoint})
+        return ret
+
+    async def get_status(self) -> dict[str, Any]:
+        """Get current battery status"""
+        ret: dict[str, Any] = await self._get("status")
+        self.status = ret
         return ret
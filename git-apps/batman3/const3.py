@@ -4,7 +4,7 @@ from typing import Any
 
 # ### GENERAL SETTINGS ### #
 VERSION: str = "3.0.3"
-DEBUG: bool = True  # debugging mode
+DEBUG: bool = False  # debugging mode; can be overruled by `debug: true` in the app's YAML
 
 # --- datetime and timezone related settings
 AUTUMN_EQUINOX_OFFSET: int = -7  # [days] offset to the start of winter
@@ -22,8 +22,8 @@ PRICES: dict = {
     },
     "update_interval": 15 * 60,  # seconds
     "adjust": {"hike": 0.021, "extra": 2.0, "taxes": 11.15, "btw": 1.21},
-    "qry_now": "{viewer {homes {currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {today      { total energy tax startsAt } } } } } }",
-    "qry_nxt": "{viewer {homes {currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {tomorrow   { total energy tax startsAt } } } } } }",
+    "qry_now": "{viewer {homes {id currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {today      { total energy tax startsAt } } } } } }",
+    "qry_nxt": "{viewer {homes {id currentSubscription { priceInfo(resolution: QUARTER_HOURLY) {tomorrow   { total energy tax startsAt } } } } } }",
 }
 
 # ### HA WATCHDOG ENTITIES ### #
@@ -39,6 +39,7 @@ GREED_D: str = "input_number.greed_hh"  # setting for greed (diff)
 
 # HA AUTOMATION SENSORS ### #
 BAT_MIN_SOC: str = "sensor.bats_minimum_soc"  # SoC required to reach next 10AM on avg baseload
+BUS_MIN_SOC: str = "bats_minimum_soc"  # bus topic with the same value, published by nxtmorning
 LOW_PV: str = "binary_sensor.lowpv"  # detector for low PV export/import values
 PV_CURRENT: str = "sensor.pv_kwh_meter_current"  # current reading HomeWizard meter on PV
 PV_POWER: str = "sensor.pv_kwh_meter_power"  # power reading HomeWizard meter on PV
@@ -68,6 +69,27 @@ BATTALK: dict[str, Any] = {
     "api_strats": __short2long_strategy,
     "bat_stances": __long2short_strategy,
 }
+# status served until the first status of a battery has been received
+SESSY_STATUS: dict[str, Any] = {
+    "status": "unknown",
+    "sessy": {
+        "state_of_charge": 0.0,
+        "power": 0,
+        "power_setpoint": 0,
+        "system_state": "SYSTEM_STATE_UNKNOWN",
+    },
+}
+# warm-restart snapshot of the app's state; written after every pass
+SNAPSHOT: dict[str, Any] = {
+    "file": "batman3_state.json",  # in AppDaemon's config directory
+    "version": 2,  # increment when the contents change
+    "max_age": 1800,  # [s] ignore older snapshots
+}
+# aiohttp client of BatMan3a; one connection pool for the batteries and Tibber
+ASYNC_HTTP: dict[str, Any] = {
+    "limit": 10,  # maximum number of connections
+    "timeout": 30.0,  # [s] total timeout of a request
+}
 
 # # maximum rates per battery
 # MAX_CHARGE = -2200
@@ -0,0 +1,71 @@
+"""Lazy, level-gated logging for the Batman3 app.
+
+Messages use %-style placeholders and are only formatted when their level is enabled.
+Arguments that are expensive to produce can be passed as a callable; these are only called
+when the message is actually logged:
+
+    self.lg.debug("Today's prices = %s", lambda: [f"{n:.3f}" for n in self.price["today"]])
+"""
+
+import logging
+import time
+from typing import Any
+
+_LEVELS: dict[str, int] = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+}
+
+
+class LazyLog:
+    """Logging facade for an AppDaemon app."""
+
+    def __init__(self, hass: Any) -> None:
+        """Initialize the facade for the given app."""
+        self.hass = hass
+        self.logger: logging.Logger = hass.get_main_log()
+        # key -> [time of last message, number of suppressed messages]
+        self.summaries: dict[str, list] = {}
+
+    def enabled(self, level: str) -> bool:
+        """Return True when messages of the given level will be logged."""
+        return self.logger.isEnabledFor(_LEVELS[level])
+
+    def log(self, level: str, msg: str, *args: Any) -> None:
+        """Format and log the message, but only when the level is enabled."""
+        if not self.logger.isEnabledFor(_LEVELS[level]):
+            return
+        if args:
+            msg = msg % tuple(_a() if callable(_a) else _a for _a in args)
+        self.hass.log(msg, level=level)
+
+    def debug(self, msg: str, *args: Any) -> None:
+        self.log("DEBUG", msg, *args)
+
+    def info(self, msg: str, *args: Any) -> None:
+        self.log("INFO", msg, *args)
+
+    def warning(self, msg: str, *args: Any) -> None:
+        self.log("WARNING", msg, *args)
+
+    def error(self, msg: str, *args: Any) -> None:
+        self.log("ERROR", msg, *args)
+
+    def summary(self, key: str, msg: str, *args: Any, every: float = 300.0, level: str = "INFO") -> None:
+        """Log the message at most once every `every` seconds per key.
+
+        Suppressed messages are counted and the count is appended to the next message that is logged.
+        """
+        if not self.logger.isEnabledFor(_LEVELS[level]):
+            return
+        _now = time.monotonic()
+        _last = self.summaries.setdefault(key, [-every, 0])
+        if _now - _last[0] < every:
+            _last[1] += 1
+            return
+        if _last[1]:
+            msg = f"{msg}  (+{_last[1]} suppressed)"
+        self.summaries[key] = [_now, 0]
+        self.log(level, msg, *args)
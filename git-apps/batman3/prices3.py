@@ -1,9 +1,9 @@
 """Fetch price info from Tibber API instead of from HA."""
 
-import datetime as dt
 from statistics import quantiles as stqu
 from typing import Any
 
+import aiohttp
 import const3 as cs
 import requests
 import utils3 as ut
@@ -15,8 +15,13 @@ requests.packages.urllib3.disable_warnings()  # type: ignore[attr-defined]
 class Tibber:
     """Class to interact with the Tibber API."""
 
-    def __init__(self, token: str, url: str) -> None:
-        """Initialize the Tibber class with the API token and URL."""
+    def __init__(self, token: str, url: str, fetch: bool = True, home: str | None = None) -> None:
+        """Initialize the Tibber class with the API token and URL.
+
+        When `fetch` is False the prices are not fetched until update_prices() is called.
+        `home` is the ID of the home to get the prices for; default is the first home of the account.
+        """
+        self.home = home
         self.api_key = token
         self.api_url = url
         self.qry_now: str = cs.PRICES["qry_now"]
@@ -32,10 +37,15 @@ class Tibber:
         self.quarter_now: int = 0
         self.stats: dict[str, Any] = {}
         self.statstext: str = "statistics unavailable"
+        self.greed_d: list[int] = []
+        self.cheap: list[int] = []
+        self.expen: list[int] = []
+        self.greed_c: list[int] = []
 
         # self.charge: list[int] = []
         # self.discharge: list[int] = []
-        self.update_prices()
+        if fetch:
+            self.update_prices()
 
     def _fetch_pricedict(self) -> dict[str, float]:
         """Get the price list from the API."""
@@ -43,10 +53,16 @@ class Tibber:
         data: dict = {"error": "no data returned"}
         payload: dict = {"query": self.qry_now}
         now_data = self._post_request(payload)
-        resp_data: list[dict] = self._unpeel(_data=now_data, _key="today")
+        resp_data: list[dict] = self._select_home(now_data)
         data = self._convert(resp_data)
         return data
 
+    def _select_home(self, _data: dict[str, dict]) -> list[dict]:
+        """Return today's prices of our home from the query result."""
+        if not self.home:
+            return self._unpeel(_data=_data, _key="today")
+        return self._unpeel_homes(_data=_data, _key="today").get(self.home, [])
+
     def _post_request(self, _payload: dict[str, str]) -> dict:
         """Make a POST request to the given URL with the specified headers and payload.
 
@@ -70,19 +86,30 @@ class Tibber:
             return {"error": f"An error occurred: {her}"}
 
     @staticmethod
-    def _unpeel(_data: dict[str, dict], _key: str) -> list[dict]:
-        """Unpeel the data from the given key."""
-        _lkey: list = []
+    def _unpeel_homes(_data: dict[str, dict], _key: str) -> dict[str, list[dict]]:
+        """Unpeel the data from the given key for every home, keyed by home ID.
+
+        Homes without a (current) subscription are left out.
+        """
+        _ret: dict[str, list[dict]] = {}
         try:
-            _ldata: dict = _data["data"]
-            _lviewer: dict = _ldata["viewer"]
-            _lhomes: list = _lviewer["homes"]
-            _lhome: dict = _lhomes[0]
-            _lcurSub: dict = _lhome["currentSubscription"]
-            _lpriceInfo: dict = _lcurSub["priceInfo"]
-            _lkey = _lpriceInfo[_key]
-        except KeyError:
-            pass
+            _lhomes: list = _data["data"]["viewer"]["homes"]
+        except (KeyError, TypeError):
+            return _ret
+        for _idx, _lhome in enumerate(_lhomes):
+            try:
+                _lkey: list[dict] = _lhome["currentSubscription"]["priceInfo"][_key]
+            except (KeyError, TypeError):
+                continue
+            if _lkey:
+                # the ID is missing when the query doesn't ask for it
+                _ret[str(_lhome.get("id", _idx))] = _lkey
+        return _ret
+
+    @staticmethod
+    def _unpeel(_data: dict[str, dict], _key: str) -> list[dict]:
+        """Unpeel the data from the given key of the first home with a subscription."""
+        _lkey: list = next(iter(Tibber._unpeel_homes(_data, _key).values()), [])
         # fmt: off
         # _lkey is a list of dicts with the following structure:
         # [{'total': 0.277, 'energy': 0.1069, 'tax': 0.1701, 'startsAt': '2025-06-22T00:00:00.000+02:00'},
@@ -95,23 +122,36 @@ class Tibber:
     @staticmethod
     def _convert(_data: list[dict]) -> dict[str, float]:
         _ret: dict[str, float] = {}
+        _utc: dict[str, float] = {}
         for item in _data:
-            sample_time = parser.isoparse(item["startsAt"]).strftime("%Y-%m-%d %H:%M:%S")
+            _start = parser.isoparse(item["startsAt"])
+            # keep the UTC offset; the hour after the switch to wintertime occurs twice
+            sample_time = _start.strftime("%Y-%m-%d %H:%M:%S%z")
             price = float(item["total"]) * 100  # float cEUR/kWh
             _ret[sample_time] = price
+            _utc[sample_time] = _start.timestamp()
 
         # fmt: off
         # _ret is a dict with the following structure:
-        # {'2025-06-22 00:00:00': 27.700000000000003,
-        #  '2025-06-22 01:00:00': 27.0,
-        #  '2025-06-22 02:00:00': 26.75,
-        #  '2025-06-22 03:00:00': 25.729999999999997,
+        # {'2025-06-22 00:00:00+0200': 27.700000000000003,
+        #  '2025-06-22 01:00:00+0200': 27.0,
+        #  '2025-06-22 02:00:00+0200': 26.75,
+        #  '2025-06-22 03:00:00+0200': 25.729999999999997,
         #  }
         # fmt: on
-        return dict(sorted(_ret.items()))
+        # sort in real time; sorting the strings would put 02:00+0100 before 02:00+0200
+        return dict(sorted(_ret.items(), key=lambda _kv: _utc[_kv[0]]))
 
     def update_prices(self) -> None:
-        self.prices = self._fetch_pricedict()  # get the prices from the API
+        _prices = self._fetch_pricedict()  # get the prices from the API
+        if not _prices:
+            # API unavailable; keep the cached prices (or the defaults)
+            return
+        self.set_prices(_prices)
+
+    def set_prices(self, prices: dict[str, float]) -> None:
+        """Use the given prices, e.g. restored from a snapshot, and update the derived info."""
+        self.prices = prices
         self.pricelist = list(self.prices.values())  # convert the prices to a list
         self.price_statistics()
         self.create_lists()
@@ -122,7 +162,7 @@ class Tibber:
         self.price_now = self.get_price_qrter(self.quarter_now)
 
     def update_current_quarter(self):
-        self.quarter_now = ut.calculate_quarter(dt.datetime.now())
+        self.quarter_now = ut.calculate_quarter()
 
     def get_price_hm(self, hour: int, min: int) -> float:
         """Return the price for a given hour and minute."""
@@ -135,6 +175,9 @@ class Tibber:
         #     sample_time: dt.datetime = parser.isoparse(_dt)
         #     if sample_time.hour == hour and sample_time.minute == _qrtr:
         #         break
+        if quarter >= len(self.pricelist):
+            # no prices (yet); keep the default or last known price
+            return self.price_now
         _price: float = self.pricelist[quarter]
         return _price
 
@@ -229,3 +272,38 @@ class Tibber:
         # self.discharge_greed = "indices of prices > (Q1avg + HH) or (?)"
         self.greed_c = [i for i,_ in enumerate(self.pricelist) if self.pricelist[i] > _q3hh]
         pass
+
+
+class AsyncTibber(Tibber):
+    """asyncio version of Tibber; the request goes through a shared aiohttp session.
+
+    The session must be set (see BatMan3a.open_session()) before update_prices() is awaited.
+    """
+
+    def __init__(self, token: str, url: str, fetch: bool = False, home: str | None = None) -> None:
+        """Initialize the AsyncTibber class; the prices are not fetched until update_prices() is awaited."""
+        self.session: aiohttp.ClientSession | None = None
+        super().__init__(token, url, fetch=False, home=home)
+
+    async def update_prices(self) -> None:  # type: ignore[override]
+        _prices = await self._fetch_pricedict()  # get the prices from the API
+        if not _prices:
+            # API unavailable; keep the cached prices (or the defaults)
+            return
+        self.set_prices(_prices)
+
+    async def _fetch_pricedict(self) -> dict[str, float]:  # type: ignore[override]
+        """Get the price list from the API."""
+        now_data: dict = await self._post_request({"query": self.qry_now})
+        return self._convert(self._select_home(now_data))
+
+    async def _post_request(self, _payload: dict[str, str]) -> dict:  # type: ignore[override]
+        """Make a POST request to the API with the given payload; see Tibber._post_request()."""
+        try:
+            async with self.session.post(  # type: ignore[union-attr]
+                self.api_url, headers=self.headers_post, json=_payload
+            ) as response:
+                response.raise_for_status()  # Raise an exception for HTTP errors
+                return dict(await response.json())
+        except (aiohttp.ClientError, TimeoutError) as her:
+            return {"error": f"An error occurred: {her}"}
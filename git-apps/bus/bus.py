@@ -0,0 +1,117 @@
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from typing import Any
+
+import appdaemon.plugins.hass.hassapi as hass
+
+"""In-process topic bus for values that are derived by one app and used by others.
+
+Publishers and consumers live in the same AppDaemon process, so there is no need for a round trip
+through Home Assistant. Every topic has a type; published values are converted to it. Subscribers
+are called with (topic, old, new) whenever the value of a topic changes:
+
+    bus = self.get_app("bus")
+    bus.subscribe("bats_minimum_soc", self.min_soc_cb)
+    bus.publish("bats_minimum_soc", 23.4)
+    bus.get("bats_minimum_soc")
+
+HA entities that show the same values are only a mirror for display.
+"""
+
+VERSION: str = "1.0.0"
+# known topics and their types; other topics get the type of the first value that is published
+TOPICS: dict[str, type] = {
+    "bats_minimum_soc": float,  # [%] nxtmorning; SoC required to reach the next morning
+    "home_baseload": float,  # [W] nxtmorning
+    "baseload_stats": object,  # nxtmorning; min, q1, med, avg, q3, max, iqr [W] of the past day
+    "next_sun_on_panels": float,  # [h] nxtmorning
+    "prices": object,  # prices; DayPrices of today
+    "grid_power": float,  # [W] tibberlive; (+) import, (-) export
+}
+
+
+class Topic:
+    """Value, type and subscribers of a topic."""
+
+    def __init__(self, name: str, kind: type | None = None) -> None:
+        self.name = name
+        self.kind = kind  # None until the topic is declared or first published
+        self.value: Any = None
+        self.updated: float = 0.0  # [s] UNIX time of the last publish
+        self.subscribers: list[Callable[[str, Any, Any], Any]] = []
+
+
+class Bus(hass.Hass):
+    def initialize(self):
+        """Initialize the app."""
+        self.log(f"====================================== Bus v{VERSION} ====")
+        self.lock = threading.Lock()
+        self.topics: dict[str, Topic] = {_name: Topic(_name, _kind) for _name, _kind in TOPICS.items()}
+
+    def declare(self, topic: str, kind: type) -> None:
+        """Declare the type of a topic. Raises TypeError when it was declared with another type."""
+        with self.lock:
+            _t = self.topics.setdefault(topic, Topic(topic))
+            if _t.kind is None:
+                _t.kind = kind
+            elif _t.kind is not kind:
+                raise TypeError(f"Topic {topic} is of type {_t.kind.__name__}, not {kind.__name__}")
+
+    def publish(self, topic: str, value: Any) -> bool:
+        """Set the value of a topic and notify the subscribers when it changed.
+
+        The value is converted to the type of the topic; this raises ValueError or TypeError for
+        values that do not fit.
+
+        Returns:
+            True when the value changed
+        """
+        with self.lock:
+            _t = self.topics.setdefault(topic, Topic(topic))
+            if _t.kind is None:
+                _t.kind = type(value)
+            if _t.kind is not object and not isinstance(value, _t.kind):
+                value = _t.kind(value)
+            _old = _t.value
+            _t.value = value
+            _t.updated = time.time()
+            if _old == value:
+                return False
+            _subscribers = list(_t.subscribers)
+        for _cb in _subscribers:
+            try:
+                _cb(topic, _old, value)
+            except Exception as her:
+                self.log(f"*** Subscriber of {topic} failed: {her}", level="ERROR")
+                self.log(traceback.format_exc(), level="ERROR")
+        return True
+
+    def get(self, topic: str, default: Any = None) -> Any:
+        """Return the value of a topic, or `default` when nothing has been published yet."""
+        _t = self.topics.get(topic)
+        if _t is None or _t.value is None:
+            return default
+        return _t.value
+
+    def age(self, topic: str) -> float | None:
+        """Return the number of seconds since the topic was published, or None if it never was."""
+        _t = self.topics.get(topic)
+        if _t is None or not _t.updated:
+            return None
+        return time.time() - _t.updated
+
+    def subscribe(self, topic: str, callback: Callable[[str, Any, Any], Any]) -> None:
+        """Call `callback(topic, old, new)` when the value of the topic changes.
+
+        The callback runs on the thread of the publisher; it should return quickly.
+        """
+        with self.lock:
+            self.topics.setdefault(topic, Topic(topic)).subscribers.append(callback)
+
+    def unsubscribe(self, topic: str, callback: Callable[[str, Any, Any], Any]) -> None:
+        with self.lock:
+            _t = self.topics.get(topic)
+            if _t is not None and callback in _t.subscribers:
+                _t.subscribers.remove(callback)
@@ -18,6 +18,11 @@ class EigenBedrijf_Avg(hass.Hass):
         self.avg_sensor = "sensor.eigen_bedrijf_avg"
         self.values: deque[float] = deque(maxlen=QLEN)
 
+        # time our callbacks
+        self.perf = self.get_app("perf")
+        if self.perf:
+            self.perf.instrument(self, ["collect_value", "calculate_average"])  # type: ignore[attr-defined]
+
         # intialise callbacks
         self.callback_handles: list = []
         self.callback_handles.append(self.listen_state(self.collect_value, self.sensor))
@@ -8,6 +8,7 @@ import statistics as stat
 import traceback
 from functools import partial
 from statistics import quantiles as stqu
+from typing import Any
 from zoneinfo import ZoneInfo
 
 import appdaemon.plugins.hass.hassapi as hass
@@ -32,13 +33,18 @@ CONVERSION: float = 2 * 5200 / 100
 HISTORY_HOURS: float = 24.0  # hours of historical data to fetch from 'sensor.eigen_bedrijf'
 ENTITY_BASELOAD: str = "input_number.home_baseload"  # entity to update with the calculated baseload
 ENTITY_EB: str = "sensor.eigen_bedrijf"  # entity from which to fetch historical data
+# topics on the bus app; the HA entities are only updated for display
+TOPIC_NSOP: str = "next_sun_on_panels"
+TOPIC_BMS: str = "bats_minimum_soc"
+TOPIC_BL: str = "home_baseload"
+TOPIC_BLS: str = "baseload_stats"
 ATTR_NSOP: dict = {"unit_of_measurement": "h", "friendly_name": "next_sun_on_panels"}
 ATTR_BMS: dict = {"unit_of_measurement": "%", "friendly_name": "bats_minimum_soc"}
 ATTR_BL: dict = {"unit_of_measurement": "W", "friendly_name": "home_baseload"}
 EPS: float = 0.0001
 
 
-VERSION: str = "1.4.1"
+VERSION: str = "1.5.0"
 
 
 class NextMorning(hass.Hass):
@@ -48,6 +54,14 @@ class NextMorning(hass.Hass):
         self.callback_handles: list = []
         self.callback_active: bool = False
         self.secrets = self.get_app("scrts")
+        # time our callbacks
+        self.perf = self.get_app("perf")
+        if self.perf:
+            self.perf.instrument(  # type: ignore[attr-defined]
+                self, ["update_sunonpanels_sensor", "get_eigen_bedrijf_history_cb"]
+            )
+        # publish derived values to the other apps
+        self.bus = self.get_app("bus")
         cfg: dict = self.secrets.get_location()  # type: ignore[attr-defined]
         # Define our location
         self.location = LocationInfo(
@@ -61,6 +75,7 @@ class NextMorning(hass.Hass):
         # Initial run at startup
         _eb_median: str = str(self.get_state(entity_id=ENTITY_BASELOAD, attribute="state", default="234.5"))
         self.eb_median: float = float(_eb_median)
+        self.publish(TOPIC_BL, self.eb_median)
         self.update_sunonpanels_sensor(None)
         # to prevent updating the value we ask for a bit more data
         self.get_eigen_bedrijf_history(hours=HISTORY_HOURS + 0.1)
@@ -99,6 +114,7 @@ class NextMorning(hass.Hass):
         if self.starting or _t_sec < 360:
             self.log(f"Time until next sun_on_panels : {self.next_sun_on_panels:.2f} hours")
 
+        self.publish(TOPIC_NSOP, self.next_sun_on_panels)
         # Update the prediction in HA
         try:
             self.set_state(
@@ -128,6 +144,7 @@ class NextMorning(hass.Hass):
         minimum_soc: float = max(EPS, abs(round((self.next_sun_on_panels * self.eb_median / CONVERSION), 1)))
         if self.starting:
             self.log(f"Calculated minimum SoC        : {minimum_soc:.2f} %")
+        self.publish(TOPIC_BMS, minimum_soc)
         try:
             self.set_state(entity_id="sensor.bats_minimum_soc", state=minimum_soc, attributes=ATTR_BMS)
         except Exception as her:
@@ -142,6 +159,7 @@ class NextMorning(hass.Hass):
         try:
             if abs(value) < EPS:
                 value = EPS
+            self.publish(TOPIC_BL, value)
             self.set_state(entity_id=ENTITY_BASELOAD, state=value, attributes=ATTR_BL)
         except Exception as her:
             self.log(str(type(her)), level="ERROR")
@@ -149,6 +167,11 @@ class NextMorning(hass.Hass):
             self.log(traceback.format_exc(), level="ERROR")
             self.log(f"Could not update {ENTITY_BASELOAD} with {value} W", level="ERROR")
 
+    def publish(self, topic: str, value: Any) -> None:
+        """Publish a value to the other apps, if the bus app is running."""
+        if self.bus:
+            self.bus.publish(topic, value)  # type: ignore[attr-defined]
+
     def get_eigen_bedrijf_history(self, hours: float) -> None:
         """Request X hours of historical data from 'sensor.eigen_bedrijf'."""
         end_time = dt.datetime.now()
@@ -172,6 +195,7 @@ class NextMorning(hass.Hass):
         hours: float = kwargs["hours"]
         history: list = kwargs["result"]
         _res = self.calc_stats(history[0], hours)
+        self.publish(TOPIC_BLS, self.usage_stats)
 
         if hours == HISTORY_HOURS:
             self.set_baseload(_res)
@@ -0,0 +1,121 @@
+import functools
+import inspect
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections.abc import Callable
+from typing import Any
+
+import appdaemon.plugins.hass.hassapi as hass
+
+"""Callback latency instrumentation for the other apps.
+
+Apps hand their callbacks to `instrument()` before registering them. The latency of every call is
+recorded in a fixed-bucket histogram per callback and the p50/p95/max and counts of the last
+interval are published as attributes of sensor.appdaemon_apps_perf.
+"""
+
+VERSION: str = "1.0.0"
+BUCKETS: tuple[float, ...] = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)  # [ms]
+PUBLISH_INTERVAL: int = 5 * 60  # [s]
+ENTITY_PERF: str = "sensor.appdaemon_apps_perf"
+ATTR_PERF: dict = {"unit_of_measurement": "ms", "friendly_name": "appdaemon_apps_perf"}
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    def __init__(self) -> None:
+        self.counts: list[int] = [0] * (len(BUCKETS) + 1)
+        self.n: int = 0
+        self.max: float = 0.0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect_left(BUCKETS, ms)] += 1
+        self.n += 1
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket that contains the q-th quantile."""
+        _target = q * self.n
+        _cum = 0
+        for _i, _c in enumerate(self.counts):
+            _cum += _c
+            if _cum >= _target and _c:
+                return min(BUCKETS[_i], self.max) if _i < len(BUCKETS) else self.max
+        return self.max
+
+
+class Perf(hass.Hass):
+    def initialize(self):
+        """Initialize the app."""
+        self.log(f"==================================== Perf v{VERSION} ====")
+        self.lock = threading.Lock()
+        self.histograms: dict[str, Histogram] = {}
+        self.totals: dict[str, int] = {}
+        self.run_every(self.publish_cb, f"now+{PUBLISH_INTERVAL}", PUBLISH_INTERVAL)
+
+    def instrument(self, app: Any, names: list[str]) -> None:
+        """Replace the named callbacks of the app by timed versions."""
+        for _name in names:
+            setattr(app, _name, self.wrap(f"{app.name}.{_name}", getattr(app, _name)))
+
+    def wrap(self, key: str, func: Callable) -> Callable:
+        """Return a version of func that records its latency under the given key."""
+
+        if inspect.iscoroutinefunction(func):
+            # keep async callbacks async, so AppDaemon still runs them in its event loop
+
+            @functools.wraps(func)
+            async def _atimed(*args, **kwargs):
+                _t0 = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.record(key, (time.perf_counter() - _t0) * 1000)
+
+            return _atimed
+
+        @functools.wraps(func)
+        def _timed(*args, **kwargs):
+            _t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(key, (time.perf_counter() - _t0) * 1000)
+
+        return _timed
+
+    def record(self, key: str, ms: float) -> None:
+        """Record the latency of a single call."""
+        with self.lock:
+            _h = self.histograms.get(key)
+            if _h is None:
+                _h = self.histograms[key] = Histogram()
+            _h.add(ms)
+
+    def publish_cb(self, **kwargs) -> None:
+        """Publish the statistics of the last interval and start a new one."""
+        with self.lock:
+            _hists = self.histograms
+            self.histograms = {}
+        _attr: dict[str, Any] = {}
+        for _key, _h in sorted(_hists.items()):
+            self.totals[_key] = self.totals.get(_key, 0) + _h.n
+            _attr[_key] = {
+                "n": _h.n,
+                "total": self.totals[_key],
+                "p50": round(_h.quantile(0.50), 1),
+                "p95": round(_h.quantile(0.95), 1),
+                "max": round(_h.max, 1),
+            }
+        # the state is the worst p95 of all callbacks
+        _state = max((_a["p95"] for _a in _attr.values()), default=0.0)
+        try:
+            self.set_state(entity_id=ENTITY_PERF, state=_state, attributes={**ATTR_PERF, **_attr})
+        except Exception as her:
+            self.log(str(type(her)), level="ERROR")
+            self.log(str(her), level="ERROR")
+            self.log(traceback.format_exc(), level="ERROR")
+            self.log(f"Could not update {ENTITY_PERF}", level="ERROR")
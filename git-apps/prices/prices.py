@@ -0,0 +1,205 @@
+import datetime as dt
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from types import MappingProxyType
+from typing import Any, NamedTuple
+
+import appdaemon.plugins.hass.hassapi as hass
+import numpy as np
+import prices2 as p2
+
+"""Price service for the other apps.
+
+Fetches today's Tibber prices of all homes of the account once (after midnight, or until a fetch
+succeeds) with a single query and computes the statistics once. Apps get the result as an immutable
+DayPrices per home through `self.get_app("prices").get_day(home=...)` and can `subscribe()` to be
+told when a new day is available. Homes with the same time slots share a PriceTable, so their
+statistics are computed in one pass. The prices of the default home are also published on the
+"prices" topic of the bus app.
+The Tibber client, the query and the statistics are those of prices2, a global module (see batman2.yaml).
+"""
+
+VERSION: str = "1.1.0"
+RETRY_INTERVAL: int = 5 * 60  # [s] retry a failed fetch after this time
+
+
+class DayPrices(NamedTuple):
+    """Prices of a day of one home. Do not modify; all consumers share the same object."""
+
+    home: str  # Tibber home ID
+    date: dt.date
+    starts: tuple[str, ...]  # start of each slot incl. UTC offset, e.g. '2025-06-22 00:15:00+0200'
+    prices: tuple[float, ...]  # [cEUR/kWh] total price of each slot
+    quarters: bool  # True for quarterly prices, False for hourly prices
+    stats: MappingProxyType  # see prices2.price_statistics()
+    fetched: float  # UNIX timestamp of the fetch
+
+    def pricedict(self) -> dict[str, float]:
+        """Return the prices as prices2.convert() does."""
+        return dict(zip(self.starts, self.prices, strict=True))
+
+    def stats_dict(self) -> dict[str, Any]:
+        """Return a copy of the statistics that may be modified (or stored as JSON)."""
+        return {**self.stats, "idx": {_k: list(_v) for _k, _v in self.stats["idx"].items()}}
+
+
+class PriceTable(NamedTuple):
+    """Prices of a day of the homes that have the same time slots; one (read-only) row per home."""
+
+    date: dt.date
+    homes: tuple[str, ...]  # Tibber home ID of each row
+    starts: tuple[str, ...]  # start of each slot (column)
+    prices: np.ndarray  # [cEUR/kWh] shape (homes, slots)
+
+    def row(self, home: str) -> np.ndarray:
+        return self.prices[self.homes.index(home)]
+
+
+def _freeze(stats: dict[str, Any]) -> MappingProxyType:
+    """Make the price statistics read-only."""
+    _idx = MappingProxyType({_k: tuple(_v) for _k, _v in stats["idx"].items()})
+    return MappingProxyType({**stats, "idx": _idx})
+
+
+class Prices(hass.Hass):
+    def initialize(self):
+        """Initialize the app."""
+        self.log(f"================================== Prices v{VERSION} ====")
+        self.lock = threading.Lock()  # protects the subscribers
+        self.fetch_lock = threading.Lock()  # one fetch at a time, also when called by other apps
+        self.home: str = self.args.get("home_id", "")  # default home; set by the first fetch if empty
+        self.date: dt.date | None = None  # date of the prices
+        self.days: dict[str, DayPrices] = {}
+        self.tables: tuple[PriceTable, ...] = ()
+        self.subscribers: list[tuple[Callable[[DayPrices], Any], str | None]] = []
+        # fetch as soon as all apps are initialised; the secrets app may not be available yet
+        self.run_in(self.fetch_cb, 0)
+        self.run_daily(self.fetch_cb, "00:00:05")
+        self.run_every(self.retry_cb, f"now+{RETRY_INTERVAL}", RETRY_INTERVAL)
+
+    # API for the other apps
+
+    def get_day(self, fetch: bool = False, home: str | None = None) -> DayPrices | None:
+        """Return today's prices of a home, or None if they are not available (yet).
+
+        Args:
+            fetch: fetch the prices now if they are not available, instead of waiting for the
+                   next scheduled fetch. Concurrent callers wait for the same fetch.
+            home: Tibber home ID; default is the home set in the YAML or the first home of the account
+        """
+        if not self._fresh() and fetch:
+            self.ensure()
+        if not self._fresh():
+            return None
+        return self.days.get(home or self.home)
+
+    def get_days(self) -> dict[str, DayPrices]:
+        """Return today's prices of all homes, keyed by home ID."""
+        return dict(self.days) if self._fresh() else {}
+
+    def get_table(self, home: str | None = None) -> PriceTable | None:
+        """Return today's price table that contains the home."""
+        _home = home or self.home
+        if not self._fresh():
+            return None
+        return next((_t for _t in self.tables if _home in _t.homes), None)
+
+    def subscribe(self, callback: Callable[[DayPrices], Any], home: str | None = None) -> None:
+        """Call `callback(day)` with the prices of the home whenever those of a new day are available.
+
+        The callback runs on the thread of this app; it should return quickly.
+        """
+        with self.lock:
+            self.subscribers.append((callback, home))
+
+    def unsubscribe(self, callback: Callable[[DayPrices], Any]) -> None:
+        with self.lock:
+            self.subscribers = [_s for _s in self.subscribers if _s[0] != callback]
+
+    # CALLBACKS
+
+    def fetch_cb(self, **kwargs) -> None:
+        """Fetch today's prices, unless another app already caused them to be fetched."""
+        self.ensure()
+
+    def retry_cb(self, **kwargs) -> None:
+        """Fetch again when the prices of today are not available."""
+        if not self._fresh():
+            self.ensure()
+
+    def _fresh(self) -> bool:
+        """Return True when we have today's prices."""
+        return self.date == dt.date.today()
+
+    def ensure(self) -> None:
+        """Fetch today's prices if we don't have them yet."""
+        with self.fetch_lock:
+            if not self._fresh():
+                self.fetch()
+
+    def fetch(self) -> bool:
+        """Fetch the prices of all homes, compute the statistics and notify the subscribers.
+
+        Returns:
+            True when prices were received
+        """
+        _secrets = self.get_app("scrts")
+        _date = dt.date.today()
+        _now = time.time()
+        _dicts = p2.get_pricedicts(
+            token=_secrets.get_tibber_token(),  # type: ignore[attr-defined]
+            url=_secrets.get_tibber_url(),  # type: ignore[attr-defined]
+        )
+        _dicts = {_home: _prices for _home, _prices in _dicts.items() if len(_prices) >= 2}
+        if not _dicts:
+            self.log(f"*** No Tibber prices for {_date}; retrying in {RETRY_INTERVAL} s", level="WARNING")
+            return False
+        # homes with the same time slots share a table, so their statistics are computed in one pass
+        _groups: dict[tuple[str, ...], list[str]] = {}
+        for _home, _prices in _dicts.items():
+            _groups.setdefault(tuple(_prices), []).append(_home)
+        _days: dict[str, DayPrices] = {}
+        _tables: list[PriceTable] = []
+        for _starts, _homes in _groups.items():
+            _arr = np.array([list(_dicts[_h].values()) for _h in _homes], dtype=np.float64)
+            _arr.setflags(write=False)
+            _tables.append(PriceTable(date=_date, homes=tuple(_homes), starts=_starts, prices=_arr))
+            for _home, _row, _stats in zip(_homes, _arr, p2.price_statistics_table(_arr), strict=True):
+                _days[_home] = DayPrices(
+                    home=_home,
+                    date=_date,
+                    starts=_starts,
+                    prices=tuple(_row.tolist()),
+                    quarters=len(_starts) > 25,
+                    stats=_freeze(_stats),
+                    fetched=_now,
+                )
+        with self.lock:
+            if self.home not in _days:
+                if self.home:
+                    self.log(f"*** No prices for home {self.home}; using the first home", level="WARNING")
+                self.home = next(iter(_days))
+            self.days = _days
+            self.tables = tuple(_tables)
+            self.date = _date
+            _subscribers = list(self.subscribers)
+        self.log(
+            f"Fetched {sum(len(_d.prices) for _d in _days.values())} Tibber prices of {len(_days)} home(s)"
+            f" for {_date}",
+            level="INFO",
+        )
+        _bus = self.get_app("bus")
+        if _bus:
+            _bus.publish("prices", _days[self.home])  # type: ignore[attr-defined]
+        for _cb, _home in _subscribers:
+            _day = _days.get(_home or self.home)
+            if _day is None:
+                continue
+            try:
+                _cb(_day)
+            except Exception as her:
+                self.log(f"*** Price subscriber failed: {her}", level="ERROR")
+                self.log(traceback.format_exc(), level="ERROR")
+        return True
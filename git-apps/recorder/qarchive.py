@@ -0,0 +1,86 @@
+"""Columnar archive of quarter-hour history.
+
+Every series (e.g. 'bat1.soc') is a raw float32 file with one value per quarter, where the
+position in the file is the number of quarters since EPOCH. Quarters without data are NaN.
+Files are only ever extended, so readers can open them with mmap while the recorder appends:
+
+    arc = QuarterArchive("/config/archive")
+    soc = arc.read("bat1.soc", arc.quarter(dt.datetime(2025, 1, 1, tzinfo=dt.UTC)))
+
+A year of one series is 35,040 quarters, i.e. 140 kB.
+"""
+
+import datetime as dt
+import os
+
+import numpy as np
+
+EPOCH: dt.datetime = dt.datetime(2020, 1, 1, tzinfo=dt.UTC)
+QUARTER: int = 15 * 60  # [s]
+EPOCH_Q: int = int(EPOCH.timestamp()) // QUARTER
+_DTYPE = np.dtype("<f4")
+_SUFFIX: str = ".f32"
+
+
+class QuarterArchive:
+    """Fixed-stride float32 files, one per series, indexed by quarter since EPOCH."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._maps: dict[str, np.memmap] = {}
+
+    @staticmethod
+    def quarter(stamp: dt.datetime | float) -> int:
+        """Return the index of the quarter that contains the datetime or UNIX timestamp."""
+        _ts = stamp.timestamp() if isinstance(stamp, dt.datetime) else stamp
+        return int(_ts // QUARTER) - EPOCH_Q
+
+    @staticmethod
+    def stamp(index: int) -> dt.datetime:
+        """Return the start (UTC) of the quarter with the given index."""
+        return EPOCH + dt.timedelta(seconds=index * QUARTER)
+
+    def filename(self, series: str) -> str:
+        return os.path.join(self.path, f"{series}{_SUFFIX}")
+
+    def series(self) -> list[str]:
+        """Return the names of all series in the archive."""
+        return sorted(_f.removesuffix(_SUFFIX) for _f in os.listdir(self.path) if _f.endswith(_SUFFIX))
+
+    def length(self, series: str) -> int:
+        """Return the number of quarters in the file, i.e. the index after the last value."""
+        try:
+            return os.path.getsize(self.filename(series)) // _DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def write(self, series: str, index: int, values: np.ndarray | list[float] | float) -> None:
+        """Write values starting at the quarter index; the file is padded with NaN when needed."""
+        _v = np.atleast_1d(np.asarray(values, dtype=_DTYPE))
+        if index < 0:
+            raise ValueError(f"Quarter {index} is before {EPOCH.isoformat()}")
+        _file = self.filename(series)
+        _len = self.length(series)
+        with open(_file, "r+b" if _len else "wb") as _f:
+            if index > _len:
+                _f.seek(_len * _DTYPE.itemsize)
+                np.full(index - _len, np.nan, dtype=_DTYPE).tofile(_f)
+            _f.seek(index * _DTYPE.itemsize)
+            _v.tofile(_f)
+
+    def read(self, series: str, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Return the values of quarters start..stop-1 as a read-only view on the file.
+
+        The view is not copied and is clipped to the data that is available.
+        """
+        _len = self.length(series)
+        stop = _len if stop is None else min(stop, _len)
+        start = max(0, start)
+        if stop <= start:
+            return np.empty(0, dtype=_DTYPE)
+        _map = self._maps.get(series)
+        if _map is None or _map.size < stop:
+            # (re)map the file; it has grown since it was mapped
+            _map = self._maps[series] = np.memmap(self.filename(series), dtype=_DTYPE, mode="r", shape=(_len,))
+        return _map[start:stop]
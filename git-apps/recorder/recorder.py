@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any
+
+import appdaemon.plugins.hass.hassapi as hass
+import qarchive as qa
+
+"""Time-series recorder for the other apps.
+
+Apps hand their samples to `record()` (raw samples, e.g. every second) or `record_quarter()`
+(one row per quarter per device). Both only append to an in-memory buffer; the buffer is
+flushed to a SQLite database (WAL mode) in one transaction every FLUSH_INTERVAL seconds.
+Once a day raw samples older than RAW_RETENTION are downsampled to quarterly min/avg/max
+and deleted; quarterly data older than QUARTER_RETENTION is deleted.
+
+Quarters are numbered since the Unix epoch (q = UTC timestamp // 900), so DST days need no
+special treatment.
+
+The numeric quarter values are also appended to a QuarterArchive (see qarchive.py) for
+analysis of multi-year history.
+"""
+
+VERSION: str = "1.0.0"
+FLUSH_INTERVAL: int = 30  # [s]
+RAW_RETENTION: int = 2 * 24 * 3600  # [s] keep raw samples for 2 days
+QUARTER_RETENTION: int = 10 * 365 * 24 * 3600  # [s] keep quarterly data for 10 years
+MAX_BUFFER: int = 100_000  # samples; drop the oldest when the database can't keep up
+QUARTER: int = 15 * 60  # [s]
+# columns of the quarter table
+QUARTER_COLS: tuple[str, ...] = ("price", "soc", "setpoint", "stance", "greedy")
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS quarter (
+    q        INTEGER NOT NULL,
+    device   TEXT    NOT NULL,
+    price    REAL,
+    soc      REAL,
+    setpoint REAL,
+    stance   TEXT,
+    greedy   INTEGER,
+    PRIMARY KEY (q, device)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sample (
+    ts     REAL NOT NULL,
+    series TEXT NOT NULL,
+    value  REAL
+);
+CREATE INDEX IF NOT EXISTS sample_ts ON sample (ts);
+CREATE TABLE IF NOT EXISTS sample_q (
+    q      INTEGER NOT NULL,
+    series TEXT    NOT NULL,
+    n      INTEGER,
+    min    REAL,
+    avg    REAL,
+    max    REAL,
+    PRIMARY KEY (q, series)
+) WITHOUT ROWID;
+"""
+
+
+class Recorder(hass.Hass):
+    def initialize(self):
+        """Initialize the app."""
+        self.log(f"==================================== Recorder v{VERSION} ====")
+        self.lock = threading.Lock()
+        self.samples: deque[tuple[float, str, float]] = deque(maxlen=MAX_BUFFER)
+        self.quarters: dict[tuple[int, str], dict[str, Any]] = {}
+        self.dropped: int = 0
+        self.database: str = os.path.join(str(self.config_dir), self.args.get("database", "recorder.db"))
+        self.db = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None)
+        self.db_lock = threading.Lock()
+        with self.db_lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+        _archive = os.path.join(str(self.config_dir), self.args.get("archive", "archive"))
+        self.archive = qa.QuarterArchive(_archive)
+        self.run_every(self.flush_cb, f"now+{FLUSH_INTERVAL}", FLUSH_INTERVAL)
+        self.run_daily(self.retention_cb, "03:33:00")
+
+    def terminate(self):
+        """Flush what is left and close the database."""
+        self.flush()
+        with self.db_lock:
+            self.db.close()
+
+    # API for the other apps
+
+    def record(self, series: str, value: float, ts: float | None = None) -> None:
+        """Buffer a raw sample."""
+        with self.lock:
+            if len(self.samples) == MAX_BUFFER:
+                self.dropped += 1
+            self.samples.append((ts or time.time(), series, value))
+
+    def record_quarter(self, device: str, ts: float | None = None, **values: Any) -> None:
+        """Buffer the values of a device for the quarter that contains `ts` (default: now).
+
+        Values for the same quarter and device are merged; the last value wins.
+        """
+        _unknown = set(values) - set(QUARTER_COLS)
+        if _unknown:
+            raise ValueError(f"Unknown quarter columns: {sorted(_unknown)}")
+        _q = int((ts or time.time()) // QUARTER)
+        with self.lock:
+            self.quarters.setdefault((_q, device), {}).update(values)
+
+    # CALLBACKS
+
+    def flush_cb(self, **kwargs) -> None:
+        """Write the buffered samples to the database."""
+        self.flush()
+
+    def retention_cb(self, **kwargs) -> None:
+        """Downsample old raw samples and delete expired data."""
+        _now = time.time()
+        _raw_end = (int(_now - RAW_RETENTION) // QUARTER) * QUARTER
+        try:
+            with self.db_lock:
+                self.db.execute("BEGIN")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sample_q (q, series, n, min, avg, max) "
+                    "SELECT CAST(ts / ? AS INTEGER), series, COUNT(value), MIN(value), AVG(value), MAX(value) "
+                    "FROM sample WHERE ts < ? GROUP BY 1, 2",
+                    (QUARTER, _raw_end),
+                )
+                self.db.execute("DELETE FROM sample WHERE ts < ?", (_raw_end,))
+                _q_end = int(_now - QUARTER_RETENTION) // QUARTER
+                self.db.execute("DELETE FROM quarter WHERE q < ?", (_q_end,))
+                self.db.execute("DELETE FROM sample_q WHERE q < ?", (_q_end,))
+                self.db.execute("COMMIT")
+                self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as her:
+            self.log(f"Retention failed: {her}", level="ERROR")
+            self.log(traceback.format_exc(), level="ERROR")
+            with self.db_lock:
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+
+    def flush(self) -> None:
+        """Write the buffered samples and quarters in a single transaction."""
+        with self.lock:
+            _samples, self.samples = self.samples, deque(maxlen=MAX_BUFFER)
+            _quarters, self.quarters = self.quarters, {}
+            _dropped, self.dropped = self.dropped, 0
+        if _dropped:
+            self.log(f"Dropped {_dropped} samples; the database can't keep up", level="WARNING")
+        if not _samples and not _quarters:
+            return
+        _rows = [(_q, _d, *(_v.get(_c) for _c in QUARTER_COLS)) for (_q, _d), _v in _quarters.items()]
+        # merge with what is already stored for the quarter; NULL means 'not recorded'
+        _cols = ", ".join(QUARTER_COLS)
+        _upd = ", ".join(f"{_c} = COALESCE(excluded.{_c}, {_c})" for _c in QUARTER_COLS)
+        try:
+            with self.db_lock:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT INTO sample (ts, series, value) VALUES (?, ?, ?)", _samples)
+                self.db.executemany(
+                    f"INSERT INTO quarter (q, device, {_cols}) VALUES (?, ?{', ?' * len(QUARTER_COLS)}) "
+                    f"ON CONFLICT (q, device) DO UPDATE SET {_upd}",
+                    _rows,
+                )
+                self.db.execute("COMMIT")
+        except sqlite3.Error as her:
+            self.log(f"Flush of {len(_samples)} samples and {len(_rows)} quarters failed: {her}", level="ERROR")
+            with self.db_lock:
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+        self.archive_quarters(_quarters)
+
+    def archive_quarters(self, quarters: dict[tuple[int, str], dict[str, Any]]) -> None:
+        """Append the numeric quarter values to the archive as series '<device>.<column>'."""
+        try:
+            for (_q, _d), _values in sorted(quarters.items()):
+                for _c, _v in _values.items():
+                    if isinstance(_v, int | float) and not isinstance(_v, bool):
+                        self.archive.write(f"{_d}.{_c}", _q - qa.EPOCH_Q, _v)
+        except (OSError, ValueError) as her:
+            self.log(f"Archiving of {len(quarters)} quarters failed: {her}", level="ERROR")
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Run a read-only query, e.g. for backtests or dashboards."""
+        with self.db_lock:
+            return self.db.execute(sql, params).fetchall()
@@ -0,0 +1,217 @@
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import random
+import traceback
+from typing import Any
+
+import aiohttp
+import appdaemon.plugins.hass.hassapi as hass
+import numpy as np
+
+"""Live measurements of the Tibber Pulse.
+
+Subscribes to the `liveMeasurement` GraphQL subscription of Tibber (graphql-transport-ws protocol)
+and keeps the samples in a ring buffer. Every sample is published on the "grid_power" topic of
+the bus app and recorded by the recorder app, so the other apps get the grid power at meter
+cadence (approx. every 2 s) without polling HA sensors.
+
+The connection is restored with exponential back-off. Set `ws_url` in the app's YAML to test
+against a local websocket stand-in.
+"""
+
+VERSION: str = "1.0.0"
+BUFFER_SIZE: int = 3600  # samples; 2 hours at a 2 s cadence
+BACKOFF: tuple[float, float] = (2.0, 300.0)  # [s] first and maximum delay before reconnecting
+TIMEOUT: float = 60.0  # [s] reconnect when nothing is received for this long
+PROTOCOL: str = "graphql-transport-ws"
+TOPIC_GRID: str = "grid_power"  # [W] (+) import, (-) export
+QRY_INFO: str = "{viewer {websocketSubscriptionUrl homes {id features {realTimeConsumptionEnabled}}}}"
+QRY_LIVE: str = (
+    'subscription {liveMeasurement(homeId: "%s") '
+    "{timestamp power powerProduction currentL1 currentL2 currentL3}}"
+)
+# one sample; power and production are the import and export [W] as reported by the meter
+SAMPLE: np.dtype = np.dtype(
+    [
+        ("ts", "<f8"),  # UNIX timestamp of the measurement
+        ("power", "<f4"),  # [W]
+        ("production", "<f4"),  # [W]
+        ("l1", "<f4"),  # [A]
+        ("l2", "<f4"),  # [A]
+        ("l3", "<f4"),  # [A]
+    ]
+)
+
+
+class LiveBuffer:
+    """Fixed-size ring buffer of samples."""
+
+    def __init__(self, size: int = BUFFER_SIZE) -> None:
+        self.data = np.zeros(size, dtype=SAMPLE)
+        self.count: int = 0  # number of samples appended since the start
+
+    def __len__(self) -> int:
+        return min(self.count, len(self.data))
+
+    def append(self, sample: tuple) -> None:
+        self.data[self.count % len(self.data)] = sample
+        self.count += 1
+
+    def last(self, seconds: float | None = None) -> np.ndarray:
+        """Return (a copy of) the samples of the last `seconds`, oldest first."""
+        _n = len(self)
+        _size = len(self.data)
+        _idx = (np.arange(self.count - _n, self.count)) % _size
+        _samples = self.data[_idx]
+        if seconds is not None and _n:
+            _samples = _samples[_samples["ts"] >= _samples["ts"][-1] - seconds]
+        return _samples
+
+    def grid(self, seconds: float | None = None) -> np.ndarray:
+        """Return the grid power [W] of the last `seconds`; (+) import, (-) export."""
+        _s = self.last(seconds)
+        return (_s["power"] - _s["production"]).astype(np.float64)
+
+
+def parse_frame(frame: dict[str, Any]) -> tuple | None:
+    """Return the sample in a `next` message of the subscription, or None if it has none."""
+    try:
+        _lm = frame["payload"]["data"]["liveMeasurement"]
+        _ts = dt.datetime.fromisoformat(_lm["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    def _f(key: str) -> float:
+        _v = _lm.get(key)
+        return float("nan") if _v is None else float(_v)
+
+    return (_ts, _f("power"), _f("powerProduction"), _f("currentL1"), _f("currentL2"), _f("currentL3"))
+
+
+class TibberLive(hass.Hass):
+    async def initialize(self):
+        """Initialize the app."""
+        self.log(f"=============================== TibberLive v{VERSION} ====")
+        self.secrets = self.get_app("scrts")
+        self.bus = self.get_app("bus")
+        self.recorder = self.get_app("recorder")
+        self.buffer = LiveBuffer()
+        self.connected: bool = False
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def terminate(self):
+        """Clean up app."""
+        self.log("__Terminating TibberLive...")
+        self.task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.task
+        self.log("__...terminated TibberLive.")
+
+    def stats(self, seconds: float = 300.0) -> dict[str, float]:
+        """Return statistics of the grid power [W] over the last `seconds`."""
+        _p = self.buffer.grid(seconds)
+        _p = _p[~np.isnan(_p)]
+        if not _p.size:
+            return {}
+        _q = np.quantile(_p, [0.0, 0.25, 0.5, 0.75, 1.0])
+        return {
+            "n": int(_p.size),
+            "min": float(_q[0]),
+            "q1": float(_q[1]),
+            "med": float(_q[2]),
+            "avg": float(_p.mean()),
+            "q3": float(_q[3]),
+            "max": float(_q[4]),
+        }
+
+    async def run(self) -> None:
+        """Keep the subscription alive; reconnect with exponential back-off."""
+        _delay = BACKOFF[0]
+        async with aiohttp.ClientSession() as _session:
+            while True:
+                _count = self.buffer.count
+                try:
+                    _url, _home = await self.get_info(_session)
+                    await self.subscribe(_session, _url, _home)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as her:
+                    # a stalled connection ends here with a TimeoutError
+                    self.log(f"*** Tibber live measurement failed: {her}", level="WARNING")
+                    self.log(traceback.format_exc(), level="DEBUG")
+                finally:
+                    if self.buffer.count > _count:
+                        # the connection worked, however it ended; start over with a short delay
+                        _delay = BACKOFF[0]
+                self.connected = False
+                _wait = _delay * random.uniform(0.8, 1.2)  # nosec B311
+                self.log(f"Reconnecting to Tibber in {_wait:.0f} s", level="INFO")
+                await asyncio.sleep(_wait)
+                _delay = min(_delay * 2, BACKOFF[1])
+
+    async def get_info(self, session: aiohttp.ClientSession) -> tuple[str, str]:
+        """Return the websocket URL and the home ID; from the YAML or the Tibber API."""
+        _url = self.args.get("ws_url", "")
+        _home = self.args.get("home_id", "")
+        if _url and _home:
+            return _url, _home
+        _token = self.secrets.get_tibber_token()  # type: ignore[attr-defined]
+        async with session.post(
+            self.secrets.get_tibber_url(),  # type: ignore[attr-defined]
+            headers={"Authorization": f"Bearer {_token}"},
+            json={"query": QRY_INFO},
+            timeout=aiohttp.ClientTimeout(total=30.0),
+        ) as _resp:
+            _resp.raise_for_status()
+            _viewer = (await _resp.json())["data"]["viewer"]
+        if not _home:
+            _live = [_h for _h in _viewer["homes"] if _h["features"]["realTimeConsumptionEnabled"]]
+            _home = (_live or _viewer["homes"])[0]["id"]
+        return _url or _viewer["websocketSubscriptionUrl"], _home
+
+    async def subscribe(self, session: aiohttp.ClientSession, url: str, home: str) -> int:
+        """Subscribe to the live measurements of the home until the connection is lost.
+
+        Returns:
+            the number of samples received
+        """
+        _received = 0
+        _headers = {"User-Agent": f"appdaemon-tibberlive/{VERSION}"}
+        async with session.ws_connect(url, protocols=(PROTOCOL,), headers=_headers, heartbeat=30) as _ws:
+            _token = self.secrets.get_tibber_token()  # type: ignore[attr-defined]
+            await _ws.send_json({"type": "connection_init", "payload": {"token": _token}})
+            while True:
+                _msg = await _ws.receive(timeout=TIMEOUT)
+                if _msg.type != aiohttp.WSMsgType.TEXT:
+                    # closed or error
+                    self.log(f"Tibber websocket closed: {_msg.type.name} {_msg.data}", level="INFO")
+                    return _received
+                _frame = json.loads(_msg.data)
+                _type = _frame.get("type")
+                if _type == "next":
+                    _sample = parse_frame(_frame)
+                    if _sample is not None:
+                        _received += 1
+                        self.process(_sample)
+                elif _type == "ping":
+                    await _ws.send_json({"type": "pong"})
+                elif _type == "connection_ack":
+                    self.connected = True
+                    await _ws.send_json({"id": "1", "type": "subscribe", "payload": {"query": QRY_LIVE % home}})
+                    self.log(f"Subscribed to live measurements of home {home}", level="INFO")
+                elif _type in ("error", "complete"):
+                    self.log(f"*** Tibber subscription ended: {_frame}", level="WARNING")
+                    return _received
+
+    def process(self, sample: tuple) -> None:
+        """Store the sample and hand the grid power to the other apps."""
+        self.buffer.append(sample)
+        _grid = sample[1] - sample[2]
+        if np.isnan(_grid):
+            return
+        if self.bus:
+            self.bus.publish(TOPIC_GRID, float(_grid))  # type: ignore[attr-defined]
+        if self.recorder:
+            self.recorder.record(TOPIC_GRID, float(_grid), ts=sample[0])  # type: ignore[attr-defined]
@@ -0,0 +1,9 @@
+"""Put the directories of the apps on sys.path, as AppDaemon does."""
+
+import os
+import sys
+
+_APPS: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "git-apps")
+
+for _app in ("batman2", "batman3"):
+    sys.path.insert(0, os.path.join(_APPS, _app))
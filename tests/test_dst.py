@@ -0,0 +1,111 @@
+"""Quarter indices on the days that the clocks change."""
+
+import datetime as dt
+import random
+from types import SimpleNamespace
+
+import prices2 as p2
+import prices3 as p3
+import pytest
+import pytz
+import utils2
+import utils3
+
+TZ = pytz.timezone(utils2.cs.TZ)  # Europe/Amsterdam
+DAYS: dict[dt.date, int] = {
+    dt.date(2025, 3, 30): 92,  # summertime starts; 02:00-03:00 is skipped
+    dt.date(2025, 6, 22): 96,
+    dt.date(2025, 10, 26): 100,  # wintertime starts; 02:00-03:00 occurs twice
+}
+UTILS = [utils2, utils3]
+
+
+def instants(datum: dt.date) -> list[dt.datetime]:
+    """Return the start of every quarter of the local day, in real time."""
+    _start = TZ.localize(dt.datetime.combine(datum, dt.time()))
+    _end = TZ.localize(dt.datetime.combine(datum + dt.timedelta(days=1), dt.time()))
+    _utc = _start.astimezone(pytz.utc)
+    _ret = []
+    while _utc < _end:
+        _ret.append(_utc.astimezone(TZ))
+        _utc += dt.timedelta(minutes=15)
+    return _ret
+
+
+def tibber_prices(datum: dt.date) -> list[dict]:
+    """Return the quarterly prices of a day as the Tibber API does, but in random order."""
+    _data = [
+        {"total": round(0.2 + _i / 1000, 4), "startsAt": _t.isoformat(timespec="milliseconds")}
+        for _i, _t in enumerate(instants(datum))
+    ]
+    random.Random(datum.toordinal()).shuffle(_data)
+    return _data
+
+
+@pytest.mark.parametrize("ut", UTILS)
+@pytest.mark.parametrize(("datum", "quarters"), DAYS.items())
+def test_quarters_in_day(ut, datum, quarters):
+    assert ut.quarters_in_day(datum) == quarters
+    assert len(instants(datum)) == quarters
+
+
+@pytest.mark.parametrize("ut", UTILS)
+@pytest.mark.parametrize("datum", DAYS)
+def test_calculate_quarter(ut, datum):
+    _instants = instants(datum)
+    assert [ut.calculate_quarter(_t) for _t in _instants] == list(range(len(_instants)))
+    # the last second of each quarter and the same instants in UTC
+    assert [ut.calculate_quarter(_t + dt.timedelta(seconds=899)) for _t in _instants] == list(
+        range(len(_instants))
+    )
+    assert [ut.calculate_quarter(_t.astimezone(pytz.utc)) for _t in _instants] == list(range(len(_instants)))
+
+
+def test_calculate_quarter_repeated_hour():
+    _first = TZ.localize(dt.datetime(2025, 10, 26, 2, 30), is_dst=True)
+    _second = TZ.localize(dt.datetime(2025, 10, 26, 2, 30), is_dst=False)
+    for _ut in UTILS:
+        assert _ut.calculate_quarter(_first) == 10
+        assert _ut.calculate_quarter(_second) == 14
+        assert _ut.calculate_quarter(TZ.localize(dt.datetime(2025, 10, 26, 23, 45))) == 99
+        assert _ut.calculate_quarter(TZ.localize(dt.datetime(2025, 3, 30, 3, 0))) == 8
+
+
+@pytest.mark.parametrize("ut", UTILS)
+def test_calculate_quarter_naive(ut):
+    # naive datetimes are local time
+    assert ut.calculate_quarter(dt.datetime(2025, 6, 22, 0, 0)) == 0
+    assert ut.calculate_quarter(dt.datetime(2025, 6, 22, 14, 7)) == 56
+    assert ut.calculate_quarter(dt.datetime(2025, 6, 22, 23, 59, 59)) == 95
+
+
+@pytest.mark.parametrize("convert", [p2.convert, p3.Tibber._convert])
+@pytest.mark.parametrize(("datum", "quarters"), DAYS.items())
+def test_convert(convert, datum, quarters):
+    _prices = convert(tibber_prices(datum))
+    _keys = list(_prices)
+    assert len(_keys) == quarters
+    for _i, _t in enumerate(instants(datum)):
+        # the price of a quarter is found at the index of calculate_quarter()
+        assert _keys[utils2.calculate_quarter(_t)] == _t.strftime("%Y-%m-%d %H:%M:%S%z")
+        assert _prices[_keys[_i]] == pytest.approx((0.2 + _i / 1000) * 100)
+
+
+@pytest.mark.parametrize("tibber_quarters", [True, False])
+@pytest.mark.parametrize("datum", DAYS)
+def test_get_slot(monkeypatch, tibber_quarters, datum):
+    pytest.importorskip("appdaemon")
+    import batman2
+
+    _bm = SimpleNamespace(tibber_quarters=tibber_quarters)
+    _calculate_quarter = utils2.calculate_quarter
+    _slots = []
+    for _t in instants(datum):
+        # freeze the clock of the app at the start of the quarter
+        monkeypatch.setattr(batman2.ut, "calculate_quarter", lambda datim=None, _t=_t: _calculate_quarter(_t))
+        _slots.append(batman2.BatMan2.get_slot(_bm))
+    _quarters = list(range(DAYS[datum]))
+    assert _slots == (_quarters if tibber_quarters else [_q // 4 for _q in _quarters])
+    if not tibber_quarters:
+        # one slot per hour of the day: 23, 24 or 25 hours
+        assert len(set(_slots)) == DAYS[datum] // 4
@@ -0,0 +1,103 @@
+"""Behaviour of the grid import limiter."""
+
+import gridctl2 as gc
+import pytest
+
+
+@pytest.fixture
+def limiter() -> gc.ImportLimiter:
+    return gc.ImportLimiter(p_max=8000, p_lim=7500, release=0.4, hold=23, deadband=25, floor=-8800, settle=23)
+
+
+def test_corrects_to_the_limit(limiter):
+    assert limiter.update(9000, 0.0)
+    assert limiter.correction == -1500
+    assert not limiter.update(7900, 1.0)  # between the limit and the maximum: hold
+    assert limiter.correction == -1500
+
+
+def test_no_windup_while_the_correction_has_no_effect(limiter):
+    limiter.update(9000, 0.0)
+    # the batteries have not followed yet; the import did not fall
+    for _t in range(1, 23):
+        assert not limiter.update(9000 + _t, float(_t))
+    assert limiter.correction == -1500
+    # the import fell but is still too high: deepen by the remaining excess
+    assert limiter.update(8600, 23.5)
+    assert limiter.correction == -2600
+
+
+def test_deepens_again_after_settling(limiter):
+    limiter.update(9000, 0.0)
+    assert not limiter.update(9500, 10.0)
+    assert limiter.update(9500, 23.0)
+    assert limiter.correction == -3500
+
+
+def test_floor(limiter):
+    _t = 0.0
+    for _ in range(20):
+        limiter.update(20000, _t)
+        _t += 23.0
+    assert limiter.correction == -8800
+
+
+def test_release(limiter):
+    limiter.update(9000, 0.0)
+    assert not limiter.update(7000, 10.0)  # hold
+    assert limiter.update(7000, 23.0)
+    # release no more than the room below the limit
+    assert limiter.correction == -1000
+    assert limiter.update(5000, 46.0)
+    assert limiter.correction == pytest.approx(-600)
+
+
+@pytest.fixture
+def guard() -> gc.OvercurrentGuard:
+    return gc.OvercurrentGuard(i_max=23.5, i_lim=21.0, release=0.4, hold=23, deadband=25, limit=8800, settle=23)
+
+
+def _send(guard: gc.OvercurrentGuard, current: float, power: float, now: float) -> int | None:
+    """Process a sample and send the grid target, as BatMan2 does."""
+    _target = guard.update(current, 230.0, power, now)
+    if _target is not None:
+        guard.sent = _target
+    return _target
+
+
+def test_guard_no_windup_on_a_sustained_overcurrent(guard):
+    guard.base = -3000
+    assert _send(guard, 25.0, -5750.0, 0.0) == -3000 + 920
+    # the batteries have not followed yet; the same excess is not added again
+    for _t in range(1, 22):
+        assert _send(guard, 25.0, -5750.0, float(_t)) is None
+    assert guard.correction == 920
+    # a rise of the current in the meantime is added
+    assert _send(guard, 26.0, -5980.0, 22.0) == -3000 + 920 + 230
+    # after settling the remaining excess is corrected
+    assert _send(guard, 24.0, -5520.0, 45.0) == -3000 + 920 + 230 + 690
+
+
+def test_guard_direction_and_limit(guard):
+    # charging from the grid through the PV circuit: less import
+    _send(guard, 25.0, 5750.0, 0.0)
+    assert guard.correction == -920
+    _t = 0.0
+    for _ in range(20):
+        _t += 23.0
+        _send(guard, 60.0, 13800.0, _t)
+    assert guard.correction == -8800
+
+
+def test_guard_release(guard):
+    _send(guard, 25.0, -5750.0, 0.0)
+    assert _send(guard, 22.0, -5060.0, 30.0) is None  # between i_lim and i_max: hold
+    assert guard.correction == 920
+    assert _send(guard, 20.0, -4600.0, 30.0) == 552  # released by 40%
+    assert _send(guard, 20.0, -4600.0, 40.0) is None  # hold
+    _t = 40.0
+    while guard.correction:
+        _t += 23.0
+        _send(guard, 20.0, -4600.0, _t)
+    # the exact base is restored
+    assert guard.sent == 0
@@ -0,0 +1,126 @@
+"""The vectorised plan must reproduce stance2.decide() quarter by quarter."""
+
+import itertools
+
+import const2 as cs
+import numpy as np
+import plan2 as pl
+import pytest
+import stance2 as st
+import utils2 as ut
+
+Q1: float = 15.0  # [cEUR/kWh]
+
+
+def decide_loop(
+    soc, min_soc, slot, greedy, ev, sunny, override, low_pv, prv_stance, setpoint, units=2, capacity=None
+) -> tuple[list[str], list[int]]:
+    """Run stance2.decide() for every quarter, as BatMan2 does in consecutive passes."""
+    _capacity = units * cs.BAT_CAPACITY if capacity is None else capacity
+    _stances: list[str] = []
+    _setpoints: list[int] = []
+    _stance, _sp = prv_stance, setpoint
+    for _q in range(len(soc)):
+        _inp = st.StanceInput(
+            float(soc[_q]),
+            float(min_soc),
+            int(slot[_q]),
+            int(greedy[_q]),
+            bool(ev[_q]),
+            sunny,
+            override,
+            bool(low_pv[_q]),
+            _stance,
+            _sp,
+            units,
+            _capacity,
+        )
+        _stance, _sp = st.decide(_inp)
+        _stances.append(_stance)
+        _setpoints.append(_sp)
+    return _stances, _setpoints
+
+
+def assert_same(
+    soc, min_soc, slot, greedy, ev, sunny, override, low_pv, prv_stance=cs.NOM, setpoint=0, units=2
+):
+    _n = len(soc)
+    ev = np.broadcast_to(np.asarray(ev, dtype=bool), (_n,))
+    low_pv = np.broadcast_to(np.asarray(low_pv, dtype=bool), (_n,))
+    _capacity = units * cs.BAT_CAPACITY
+    _codes, _sp = pl.plan_day(
+        soc, min_soc, slot, greedy, ev, sunny, override, low_pv, prv_stance, setpoint, units, _capacity
+    )
+    _stances, _setpoints = decide_loop(
+        soc, min_soc, slot, greedy, ev, sunny, override, low_pv, prv_stance, setpoint, units, _capacity
+    )
+    assert [pl.STANCES[_c] for _c in _codes] == _stances
+    assert _sp.tolist() == _setpoints
+
+
+def test_greed_matches_get_greedy():
+    _rng = np.random.default_rng(1)
+    _prices = _rng.normal(20, 10, 400)
+    for _sunny, _ll, _hh in itertools.product([False, True], [-2.0, 0.0, 12.0], [2.0, 12.5]):
+        _g = pl.greed(_prices, Q1, _ll, _hh, _sunny)
+        assert _g.tolist() == [ut.get_greedy(_p, _p - Q1, _ll, _hh, _sunny) for _p in _prices]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_days(seed):
+    _rng = np.random.default_rng(seed)
+    _n = int(_rng.choice([92, 96, 100]))
+    _soc = _rng.uniform(0, 100, _n).round(1)
+    if seed % 3 == 0:
+        _soc[:] = _rng.choice([0.0, 10.0, 25.0, 99.95, 100.0])
+    _price = _rng.normal(20, 10, _n)
+    _sunny = bool(_rng.integers(2))
+    _override = bool(_rng.integers(2))
+    _greedy = pl.greed(
+        _price, Q1, float(_rng.uniform(-3, 15)), float(_rng.uniform(2, 12)), _sunny and not _override
+    )
+    assert_same(
+        _soc,
+        float(_rng.uniform(0, 40)),
+        _rng.choice([-1, 0, 1], _n),
+        _greedy,
+        _rng.random(_n) < 0.2,
+        _sunny,
+        _override,
+        _rng.random(_n) < 0.3,
+        str(_rng.choice(pl.STANCES)),
+        int(_rng.integers(-2000, 1000)),
+        units=int(_rng.choice([1, 2, 3])),
+    )
+
+
+def _windows(n: int) -> np.ndarray:
+    """Greed for CHARGE in the night, for DISCHARGE in the evening, with a gap in both windows."""
+    _g = np.zeros(n, dtype=np.int8)
+    _g[4:24] = -1
+    _g[12] = 0
+    _g[n - 28 : n - 8] = 1
+    _g[n - 20] = 0
+    return _g
+
+
+@pytest.mark.parametrize("n", [92, 96, 100])  # the DST days and a normal day
+@pytest.mark.parametrize(("sunny", "override"), [(False, False), (True, False), (False, True), (True, True)])
+@pytest.mark.parametrize("ev", ["never", "always", "evening"])
+@pytest.mark.parametrize("soc", ["empty", "full", "almost full", "falling", "rising", "minimum"])
+def test_edge_cases(n, sunny, override, ev, soc):
+    _soc = {
+        "empty": np.zeros(n),
+        "full": np.full(n, 100.0),
+        "falling": np.linspace(100.0, 0.0, n),
+        "rising": np.linspace(0.0, 100.0, n),
+        "almost full": np.linspace(99.0, 100.0, n),
+        "minimum": np.linspace(20.0, 30.0, n),  # around the minimum SoC plus its margin
+    }[soc]
+    _ev = {"never": False, "always": True, "evening": np.arange(n) >= n - 24}[ev]
+    _slot = np.zeros(n, dtype=np.int8)
+    _slot[8:20] = -1
+    _slot[n - 24 : n - 12] = 1
+    for _prv, _sp in [(cs.NOM, 0), (cs.CHARGE, -2200), (cs.DISCHARGE, 1700), (cs.IDLE, 350)]:
+        assert_same(_soc, 22.5, _slot, _windows(n), _ev, sunny, override, False, _prv, _sp)
+        assert_same(_soc, 22.5, _slot, _windows(n), _ev, sunny, override, True, _prv, _sp)
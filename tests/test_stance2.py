@@ -0,0 +1,133 @@
+"""Properties of the stance decision kernel, checked over a grid of all inputs."""
+
+import itertools
+
+import const2 as cs
+import fleet2 as fl
+import numpy as np
+import plan2 as pl
+import pytest
+import stance2 as st
+
+GRID: list[st.StanceInput] = [
+    st.StanceInput(*_v)
+    for _v in itertools.product(
+        [0.0, 5.0, 12.5, 20.0, 23.0, 24.5, 30.0, 50.0, 75.0, 99.0, 99.95, 100.0],  # soc
+        [0.0, 10.0, 22.5, 40.0],  # min_soc
+        [-1, 0, 1],  # slot
+        [-1, 0, 1],  # greedy
+        [False, True],  # ev_charging
+        [False, True],  # sunny
+        [False, True],  # override
+        [False, True],  # low_pv
+        [cs.NOM, cs.IDLE, cs.CHARGE, cs.DISCHARGE],  # prv_stance
+        [cs.CHARGE_PWR, -1000, 0, 100, cs.DISCHARGE_PWR],  # setpoint
+    )
+]
+
+
+@pytest.fixture(scope="module")
+def decisions() -> list[tuple[st.StanceInput, str, int]]:
+    return [(_inp, *st.decide(_inp)) for _inp in GRID]
+
+
+def test_stances_are_known(decisions):
+    assert {_stance for _, _stance, _ in decisions} == {cs.NOM, cs.IDLE, cs.CHARGE, cs.DISCHARGE}
+
+
+def test_setpoint_sign_matches_stance(decisions):
+    for _inp, _stance, _sp in decisions:
+        if _stance == cs.CHARGE:
+            assert _sp <= 0, _inp
+        elif _stance == cs.DISCHARGE:
+            assert _sp > 0, _inp
+        elif _stance == cs.NOM:
+            assert _sp >= 0, _inp
+
+
+def test_charge_and_discharge_power_bounds(decisions):
+    for _inp, _stance, _sp in decisions:
+        if _stance == cs.CHARGE:
+            assert cs.CHARGE_PWR <= _sp <= 0, _inp
+        elif _stance == cs.DISCHARGE:
+            assert 0 < _sp <= cs.DISCHARGE_PWR, _inp
+            # never plan to discharge below the minimum SoC within the hour
+            assert _sp <= (_inp.soc - _inp.min_soc) / 100 * _inp.capacity / _inp.units, _inp
+
+
+def test_nom_and_idle_setpoints(decisions):
+    for _inp, _stance, _sp in decisions:
+        if _stance == cs.NOM:
+            assert _sp == (st._LOW_PV_PWR if _inp.low_pv else 0), _inp
+        elif _stance == cs.IDLE:
+            # the batteries are left alone; the current setpoint is kept
+            assert _sp == _inp.setpoint, _inp
+
+
+def test_idle_only_while_the_ev_charges(decisions):
+    for _inp, _stance, _ in decisions:
+        if _stance == cs.IDLE:
+            assert _inp.ev_charging, _inp
+
+
+def test_discharge_needs_energy_above_the_minimum_soc(decisions):
+    for _inp, _stance, _ in decisions:
+        if _stance == cs.DISCHARGE:
+            assert _inp.greedy > 0, _inp
+            assert _inp.soc > _inp.min_soc, _inp
+
+
+def test_decide_is_deterministic(decisions):
+    for _inp, _stance, _sp in decisions:
+        assert st.decide(_inp) == (_stance, _sp)
+        assert st.decide(st.StanceInput(*tuple(_inp))) == (_stance, _sp)
+
+
+@pytest.mark.parametrize(
+    ("soc", "min_soc", "expected"),
+    [
+        (50.0, 20.0, (50.0 - 20.0 - cs.MIN_DISCHARGE / 100) / 100 * 2 * cs.BAT_CAPACITY),
+        (23.0, 20.0, 0.0),  # less than MIN_DISCHARGE above the minimum
+        (10.0, 20.0, 0.0),
+    ],
+)
+def test_discharge_energy(soc, min_soc, expected):
+    assert st.discharge_energy(soc, min_soc, 2 * cs.BAT_CAPACITY) == pytest.approx(expected)
+
+
+def test_discharge_energy_of_the_fleet():
+    _two = st.discharge_energy(50.0, 20.0, 2 * cs.BAT_CAPACITY)
+    assert st.discharge_energy(50.0, 20.0, 3 * cs.BAT_CAPACITY) == pytest.approx(_two * 1.5)
+
+
+@pytest.mark.parametrize(
+    ("soc", "greedy", "stance", "fleet_pwr"),
+    [
+        (99.0, 0, cs.CHARGE, -0.01 * 3 * cs.BAT_CAPACITY * 4),  # fill 1 % in a quarter
+        (30.0, 1, cs.DISCHARGE, 0.1 * 3 * cs.BAT_CAPACITY),  # empty 10 % to the minimum SoC in an hour
+    ],
+)
+def test_fleet_of_three(soc, greedy, stance, fleet_pwr):
+    _fleet = fl.BatteryFleet(["bat1", "bat2", "bat3"])
+    _fleet.soc[:] = soc
+    _inp = st.StanceInput(
+        soc, 20.0, -1, greedy, False, False, False, False, cs.NOM, 0, len(_fleet), float(_fleet.capacity.sum())
+    )
+    _stance, _sp = st.decide(_inp)
+    assert _stance == stance
+    # as BatMan2.calc_stance() does
+    _setpoints = _fleet.allocate(_sp * len(_fleet), 20.0)
+    assert _setpoints.sum() == pytest.approx(fleet_pwr, abs=len(_fleet) * 4)
+    # the plan agrees
+    _codes, _plan = pl.plan_day(
+        np.array([soc]),
+        20.0,
+        np.array([-1]),
+        np.array([greedy]),
+        False,
+        False,
+        False,
+        units=len(_fleet),
+        capacity=float(_fleet.capacity.sum()),
+    )
+    assert (pl.STANCES[_codes[0]], int(_plan[0])) == (_stance, _sp)
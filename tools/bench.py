@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks of the hot functions of the apps.
+
+Every benchmark calls one function on fixed inputs: the synthetic prices of tools/fakes.py for
+DATE, a seeded day of sensor.eigen_bedrijf history and the state of apps that were initialized by
+tools/replay.py at START. The best time of a number of repeats is compared with the stored
+baseline (bench_baseline.json) and the run fails when a function got slower than the threshold.
+
+Times depend on the host, so the baseline also stores the time of a fixed pure-Python workload
+('calibration'); all times are scaled by the ratio of the calibration times before comparing.
+
+Examples:
+    tools/bench.py                      compare with the baseline; exit 1 on a slowdown
+    tools/bench.py --filter prices      only the benchmarks with 'prices' in their name
+    tools/bench.py --save               store the results as the new baseline
+"""
+
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import random
+import sys
+import time
+import timeit
+from collections.abc import Callable
+from typing import Any
+
+import fakes
+import replay
+
+BASELINE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+THRESHOLD: float = 0.25  # fail when a benchmark is more than 25% slower than its baseline
+DATE: dt.date = dt.date(2025, 6, 22)
+START: str = "2025-06-22T14:07:00"  # local time at which the apps are initialized
+APPS: list[str] = ["scrts", "bus", "prices", "nxtmorning", "eb_avg", "batman2"]
+# states the apps need to initialize
+STATES: dict[str, str] = {
+    **replay.SEED_STATES,
+    "sensor.bat1_state_of_charge": "55",
+    "sensor.bat2_state_of_charge": "53",
+    "number.bat1_power_setpoint": "0",
+    "number.bat2_power_setpoint": "0",
+    "sensor.eigen_bedrijf": "410",
+}
+
+
+def calibration() -> None:
+    """Fixed pure-Python workload to compare the speed of hosts."""
+    _rng = random.Random(0)
+    _data = [_rng.random() for _ in range(2000)]
+    sorted(_data)
+    {f"{_i:04d}": _v for _i, _v in enumerate(_data)}
+
+
+def eb_history(n: int = 8640) -> list[dict[str, Any]]:
+    """Return a day of sensor.eigen_bedrijf history (every 10 s) as get_history() does.
+
+    Includes the glitches that calc_stats() has to deal with: negative and non-numeric states.
+    """
+    _rng = random.Random(DATE.toordinal())
+    _rows: list[dict[str, Any]] = []
+    for _i in range(n):
+        _state: str = f"{250 + 150 * _rng.random() + (2000 if 6480 <= _i < 6840 else 0):.1f}"
+        if _i % 997 == 0:
+            _state = "unavailable"
+        elif _i % 499 == 0:
+            _state = "-35.0"
+        _rows.append({"entity_id": "sensor.eigen_bedrijf", "state": _state})
+    return _rows
+
+
+def benchmarks(apps: dict[str, Any]) -> dict[str, Callable[[], Any]]:
+    """Return the benchmarks by name; `apps` are the initialized apps of the replay."""
+    # the modules of the apps are found once the replay has put their directories on sys.path
+    import const2
+    import nxtmorning as nm
+    import prices2 as p2
+    import prices3 as p3
+    import utils2
+    import utils3
+
+    _tibber = fakes.FakeTibber()
+    _raw = _tibber.price_info(DATE, 15)  # as returned by the API
+    _pricedict = p3.Tibber._convert(_raw)  # [cEUR/kWh]
+    _prices = list(_pricedict.values())
+    _tib = p3.Tibber("token", "http://localhost", fetch=False)
+    _tib.set_prices(_pricedict)
+    _nm = apps["nxtmorning"]
+    _history = eb_history()
+    _eb = apps["eb_avg"]
+    _eb.values.extend(float(_s) for _s in (310, 295, 402, 388, 1250, 1310, 330, 301, 299, 287, 356, 344))
+    _bm = apps["batman2"]
+    _bm_prices = list(_bm.price["today"])
+
+    def _mc_slots() -> None:
+        _saved = dict(const2.STOCHASTIC)
+        const2.STOCHASTIC.update(enabled=True, seed=1)
+        try:
+            _bm.update_price_slots(_bm_prices)
+        finally:
+            const2.STOCHASTIC.update(_saved)
+
+    return {
+        "calibration": calibration,
+        "utils2.sort_index": lambda: utils2.sort_index(_prices, rev=False),
+        "utils3.sort_index": lambda: utils3.sort_index(_prices, rev=False),
+        "prices2.price_statistics": lambda: p2.price_statistics(_prices),
+        "prices2.get_price": lambda: p2.get_price(_pricedict, 23, 45),  # the last slot of the day
+        "prices3.Tibber.price_statistics": _tib.price_statistics,
+        "prices3.Tibber.create_lists": _tib.create_lists,
+        "prices3.Tibber._convert": lambda: p3.Tibber._convert(_raw),
+        "nxtmorning.find_time_for_elevation": lambda: nm.find_time_for_elevation(
+            _nm.location, DATE, nm.ELEVATION
+        ),
+        "nxtmorning.NextMorning.calc_stats": lambda: _nm.calc_stats(_history, nm.HISTORY_HOURS),
+        "eb_avg.calculate_average": _eb.calculate_average,
+        "batman2.BatMan2.update_price_slots": lambda: _bm.update_price_slots(_bm_prices),
+        "batman2.BatMan2.update_price_slots[mc]": _mc_slots,
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> float:
+    """Return the best time [s] per call of `repeat` runs of about 0.2 s each."""
+    _timer = timeit.Timer(fn)
+    _number, _ = _timer.autorange()
+    return min(_timer.repeat(repeat=repeat, number=_number)) / _number
+
+
+def run(names: str, repeat: int) -> dict[str, float]:
+    """Run the benchmarks whose name contains `names` (and always the calibration)."""
+    _start = dt.datetime.fromisoformat(START).timestamp()
+    _trace = [(_start - 60, _entity, _state) for _entity, _state in STATES.items()]
+    _results: dict[str, float] = {}
+    with replay.Replay(APPS, _start, _trace) as rp:
+        if rp.ad.errors:
+            raise RuntimeError(f"{rp.ad.errors} errors while initializing the apps")
+        for _name, _fn in benchmarks(rp.ad.apps).items():
+            if _name == "calibration" or names in _name:
+                _results[_name] = measure(_fn, repeat)
+                print(f"{_name:<45} {_results[_name] * 1e6:>12.1f} us", file=sys.stderr)
+    return _results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    """Return a report line per benchmark and whether it got too slow ('SLOWER')."""
+    _scale = results["calibration"] / baseline["calibration"] if "calibration" in baseline else 1.0
+    _lines = [f"host speed relative to the baseline: {1 / _scale:.2f}x"]
+    for _name, _t in results.items():
+        if _name == "calibration":
+            continue
+        _base = baseline.get(_name)
+        if _base is None:
+            _lines.append(f"{_name:<45} {_t * 1e6:>12.1f} us  (no baseline)")
+            continue
+        _ratio = _t / (_base * _scale)
+        _verdict = "SLOWER" if _ratio > 1 + threshold else ("faster" if _ratio < 1 - threshold else "ok")
+        _lines.append(f"{_name:<45} {_t * 1e6:>12.1f} us  {_ratio:>6.2f}x  {_verdict}")
+    return _lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs per benchmark")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown; 0.25 = 25%%")
+    parser.add_argument("--baseline", default=BASELINE, help="JSON file with the baseline times")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-7s %(name)s: %(message)s")
+    os.environ["TZ"] = replay.SECRETS["timezone"]
+    time.tzset()
+
+    results = run(args.filter, args.repeat)
+    if args.save:
+        _saved: dict[str, float] = {}
+        if args.filter and os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as _f:
+                _saved = json.load(_f)
+        _saved.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as _f:
+            json.dump(dict(sorted(_saved.items())), _f, indent=2)
+            _f.write("\n")
+        print(f"baseline saved to {args.baseline}")
+        return
+    with open(args.baseline, encoding="utf-8") as _f:
+        baseline: dict[str, float] = json.load(_f)
+    _lines = compare(results, baseline, args.threshold)
+    print("\n".join(_lines))
+    sys.exit(1 if any(_l.endswith("SLOWER") for _l in _lines) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of one control pass of BatMan2 and BatMan3.
+
+A pass is BatMan2.price_current_cb() or BatMan3.quarter_started_cb(): read the HA states, get the
+prices, decide on a stance and talk to the batteries. The apps run on the HA state store of
+tools/replay.py against the fake Sessy and Tibber servers of tools/fakes.py, whose latency is set
+per run, so the effect of I/O changes (concurrency, caching, dedup) shows up in the numbers:
+
+    wall    [ms] time of a pass
+    http    requests to the fakes per pass
+    peak    [kB] peak of the memory allocated during a pass (tracemalloc)
+    kept    [kB] memory still allocated after a pass, outside the threads of the fakes
+
+Passes are 15 minutes apart on the virtual clock, like in production. Memory is measured in
+separate passes, because tracemalloc slows down the ones that are timed. The fakes run in threads
+of this process, so 'peak' includes the handling of the requests that are in progress.
+
+Examples:
+    tools/bench_e2e.py --latency 0,0.005,0.02
+    tools/bench_e2e.py --apps batman3 --refresh --without-prices
+"""
+
+import argparse
+import datetime as dt
+import logging
+import os
+import statistics as stat
+import sys
+import threading
+import time
+import tracemalloc
+from typing import NamedTuple
+
+import bench
+import replay
+
+PASSES: int = 20
+QUARTER: float = 900.0  # [s]
+OFFSET: float = 20.0  # [s] after the start of the quarter; as the apps schedule their callbacks
+# the control pass of each app
+CALLBACKS: dict[str, str] = {"batman2": "price_current_cb", "batman3": "quarter_started_cb"}
+
+
+class PassStats(NamedTuple):
+    """Medians over the passes of one app at one latency."""
+
+    app: str
+    latency: float  # [s]
+    wall: float  # [s]
+    wall_max: float  # [s]
+    http: float  # requests per pass
+    peak: int  # [B]
+    kept: int  # [B]
+    errors: int
+
+
+def _do_pass(rp: replay.Replay, app: str, refresh: bool) -> None:
+    """Move to the next quarter and run the control pass of the app."""
+    _app = rp.ad.apps[app]
+    rp.clock.advance((rp.clock.now // QUARTER + 1) * QUARTER + OFFSET)
+    if refresh:
+        # as when the price service has new prices; the midnight path of the apps
+        _app.new_prices = True
+    rp.ad.call(app, getattr(_app, CALLBACKS[app]), (), {})
+
+
+def measure(app: str, latency: float, passes: int, refresh: bool, with_prices: bool) -> PassStats:
+    """Run `passes` timed and `passes` traced control passes of an app."""
+    _start = dt.datetime.fromisoformat(bench.START).timestamp()
+    _trace = [(_start - 60, _entity, _state) for _entity, _state in bench.STATES.items()]
+    _apps = ["scrts", "bus"] + (["prices"] if with_prices else []) + ["nxtmorning", app]
+    with replay.Replay(_apps, _start, _trace, latency=latency) as rp:
+        # let the apps finish starting up (e.g. BatMan3.warmup_cb())
+        rp.run(_start + OFFSET)
+        _errors = rp.ad.errors
+        _wall: list[float] = []
+        _http: list[int] = []
+        for _ in range(passes):
+            _calls = rp.sessy.total + rp.tibber.total
+            _t0 = time.perf_counter()
+            _do_pass(rp, app, refresh)
+            _wall.append(time.perf_counter() - _t0)
+            _http.append(rp.sessy.total + rp.tibber.total - _calls)
+
+        _peak: list[int] = []
+        _kept: list[int] = []
+        # ignore the allocations of the fakes' server threads in 'kept'
+        _main = [tracemalloc.Filter(False, threading.__file__, all_frames=True)]
+        tracemalloc.start(25)
+        try:
+            for _ in range(passes):
+                _before = tracemalloc.take_snapshot().filter_traces(_main)
+                tracemalloc.reset_peak()
+                _base = tracemalloc.get_traced_memory()[0]
+                _do_pass(rp, app, refresh)
+                _peak.append(tracemalloc.get_traced_memory()[1] - _base)
+                _after = tracemalloc.take_snapshot().filter_traces(_main)
+                _kept.append(sum(_s.size_diff for _s in _after.compare_to(_before, "filename")))
+        finally:
+            tracemalloc.stop()
+        return PassStats(
+            app=app,
+            latency=latency,
+            wall=stat.median(_wall),
+            wall_max=max(_wall),
+            http=stat.mean(_http),
+            peak=int(stat.median(_peak)),
+            kept=int(stat.median(_kept)),
+            errors=rp.ad.errors - _errors,
+        )
+
+
+def report(results: list[PassStats]) -> str:
+    _lines = [
+        f"{'app':<10} {'latency ms':>10} {'wall ms':>9} {'max ms':>9} {'http':>6} {'peak kB':>9} "
+        f"{'kept kB':>9} {'errors':>6}"
+    ]
+    for _r in results:
+        _lines.append(
+            f"{_r.app:<10} {_r.latency * 1000:>10.1f} {_r.wall * 1000:>9.2f} {_r.wall_max * 1000:>9.2f} "
+            f"{_r.http:>6.1f} {_r.peak / 1024:>9.1f} {_r.kept / 1024:>9.1f} {_r.errors:>6}"
+        )
+    return "\n".join(_lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apps", default="batman2,batman3", help="apps whose control pass is measured")
+    parser.add_argument("--latency", default="0,0.005,0.02", help="[s] comma separated latencies of the fakes")
+    parser.add_argument("--passes", type=int, default=PASSES, help="number of passes per app and latency")
+    parser.add_argument("--refresh", action="store_true", help="make every pass process new prices")
+    parser.add_argument(
+        "--without-prices", action="store_true", help="don't run the price service; the apps ask Tibber"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-7s %(name)s: %(message)s")
+    os.environ["TZ"] = replay.SECRETS["timezone"]
+    time.tzset()
+
+    results: list[PassStats] = []
+    for _app in args.apps.split(","):
+        if _app not in CALLBACKS:
+            parser.error(f"no control pass known for {_app}; choose from {', '.join(CALLBACKS)}")
+        for _latency in (float(_l) for _l in args.latency.split(",")):
+            results.append(measure(_app, _latency, args.passes, args.refresh, not args.without_prices))
+    print(report(results))
+    sys.exit(1 if any(_r.errors for _r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Local stand-ins for the Sessy batteries and the Tibber API.
+
+Both are small HTTP servers on localhost that run in a daemon thread, so the apps talk to them
+through their normal clients (requests, aiohttp) without any patching. Every request is counted
+and can be delayed by a fixed latency to mimic the network:
+
+    with FakeSessy(["bat1", "bat2", "p1"], latency=0.05) as sessy, FakeTibber() as tibber:
+        bat1 = bt.Sessy(sessy.device_url("bat1"), "user", "pass")
+        prices = p2.get_pricedict(token="token", url=tibber.url)
+        print(sessy.calls, tibber.calls)
+
+The servers take a `clock` so they follow the virtual clock of tools/replay.py: the SoC of the
+batteries is integrated over that clock and Tibber serves the prices of its date.
+"""
+
+import datetime as dt
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from zoneinfo import ZoneInfo
+
+STRATEGIES: tuple[str, ...] = ("POWER_STRATEGY_NOM", "POWER_STRATEGY_API", "POWER_STRATEGY_IDLE")
+TIMEZONE: str = "Europe/Amsterdam"
+
+
+class FakeServer:
+    """HTTP server on localhost that hands every request to handle()."""
+
+    def __init__(self, latency: float = 0.0, clock: Callable[[], float] = time.time) -> None:
+        """Initialize the server; it is started by start() or by entering the context.
+
+        Args:
+            latency: [s] delay of every response
+            clock: returns the current (virtual) UNIX time
+        """
+        self.latency = latency
+        self.clock = clock
+        self.calls: Counter[str] = Counter()  # number of requests per "METHOD /path"
+        self.lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        if self._server is None:
+            raise RuntimeError(f"{type(self).__name__} is not running")
+        _host, _port = self._server.server_address[:2]
+        return f"http://{_host}:{_port}"
+
+    def start(self) -> "FakeServer":
+        _fake = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real devices
+            # the headers and the body are written separately; don't let Nagle hold back the body
+            disable_nagle_algorithm = True
+
+            def _reply(self, method: str) -> None:
+                _len = int(self.headers.get("Content-Length") or 0)
+                _body = json.loads(self.rfile.read(_len) or b"null") if _len else None
+                with _fake.lock:
+                    _fake.calls[f"{method} {self.path}"] += 1
+                if _fake.latency:
+                    time.sleep(_fake.latency)
+                with _fake.lock:
+                    _status, _data = _fake.handle(method, self.path, _body)
+                _out = json.dumps(_data).encode()
+                self.send_response(_status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(_out)))
+                self.end_headers()
+                self.wfile.write(_out)
+
+            def do_GET(self) -> None:
+                self._reply("GET")
+
+            def do_POST(self) -> None:
+                self._reply("POST")
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=type(self).__name__, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    @property
+    def total(self) -> int:
+        """Return the total number of requests."""
+        return sum(self.calls.values())
+
+    def reset(self) -> None:
+        """Forget the requests counted so far."""
+        with self.lock:
+            self.calls.clear()
+
+    def handle(self, method: str, path: str, body: Any) -> tuple[int, Any]:
+        """Return the HTTP status and the JSON response for a request."""
+        raise NotImplementedError
+
+
+class FakeSessy(FakeServer):
+    """Any number of Sessy batteries (and the P1 dongle) behind one server.
+
+    Every device lives under its own path, e.g. http://127.0.0.1:8080/bat1/api/v1/power/status.
+    In the API strategy the battery follows its power setpoint and the SoC is integrated over the
+    clock; in the other strategies the power is 0 unless `power` returns something else.
+    """
+
+    def __init__(
+        self,
+        devices: list[str] | tuple[str, ...],
+        soc: float = 50.0,
+        capacity: float = 5200.0,
+        latency: float = 0.0,
+        clock: Callable[[], float] = time.time,
+        power: Callable[[str, dict[str, Any]], float] | None = None,
+    ) -> None:
+        """Initialize the batteries.
+
+        Args:
+            devices: names of the devices; the last path component of their URLs
+            soc: [%] initial SoC of every battery
+            capacity: [Wh] capacity of every battery
+            latency: [s] delay of every response
+            clock: returns the current (virtual) UNIX time
+            power: returns the power [W] of a device outside the API strategy; (+) discharging
+        """
+        super().__init__(latency=latency, clock=clock)
+        self.capacity = capacity
+        self.power = power
+        _now = clock()
+        # t: time up to which the SoC has been integrated
+        self.devices: dict[str, dict[str, Any]] = {
+            _d: {"strategy": STRATEGIES[0], "setpoint": 0, "grid_target": 0, "soc": soc, "power": 0, "t": _now}
+            for _d in devices
+        }
+
+    def device_url(self, device: str) -> str:
+        return f"{self.url}/{device}"
+
+    def soc(self, device: str) -> float:
+        """Return the SoC [%] of a device at the current time."""
+        with self.lock:
+            return float(self._integrate(self.devices[device])["soc"])
+
+    def _integrate(self, dev: dict[str, Any]) -> dict[str, Any]:
+        """Bring the SoC of a device up to the current time."""
+        _now = self.clock()
+        _hours = max(0.0, _now - dev["t"]) / 3600
+        dev["soc"] = min(100.0, max(0.0, dev["soc"] - dev["power"] * _hours / self.capacity * 100))
+        dev["t"] = _now
+        return dev
+
+    def _set_power(self, name: str, dev: dict[str, Any]) -> None:
+        if dev["strategy"] == "POWER_STRATEGY_API":
+            dev["power"] = float(dev["setpoint"])
+        elif self.power is not None:
+            dev["power"] = float(self.power(name, dev))
+        else:
+            dev["power"] = 0.0
+        if (dev["soc"] <= 0.0 and dev["power"] > 0) or (dev["soc"] >= 100.0 and dev["power"] < 0):
+            # empty or full
+            dev["power"] = 0.0
+
+    def handle(self, method: str, path: str, body: Any) -> tuple[int, Any]:
+        _name, _, _call = path.lstrip("/").partition("/")
+        _dev = self.devices.get(_name)
+        if _dev is None:
+            return 404, {"status": "error", "error": f"unknown device {_name}"}
+        self._integrate(_dev)
+        _ok = {"status": "ok"}
+        match method, _call:
+            case "GET", "api/v1/power/status":
+                self._set_power(_name, _dev)
+                return 200, {
+                    "status": "ok",
+                    "sessy": {
+                        "state_of_charge": _dev["soc"] / 100,
+                        "power": int(_dev["power"]),
+                        "power_setpoint": int(_dev["setpoint"]),
+                        "system_state": "SYSTEM_STATE_RUNNING_SAFE",
+                        "system_state_details": "",
+                        "strategy_overridden": False,
+                    },
+                }
+            case "GET", "api/v1/power/active_strategy":
+                return 200, {"status": "ok", "strategy": _dev["strategy"]}
+            case "POST", "api/v1/power/active_strategy":
+                if body.get("strategy") not in STRATEGIES:
+                    return 400, {"status": "error", "error": f"invalid strategy {body.get('strategy')}"}
+                _dev["strategy"] = body["strategy"]
+            case "POST", "api/v1/power/setpoint":
+                _dev["setpoint"] = int(body["setpoint"])
+            case "GET", "api/v1/meter/grid_target":
+                return 200, {"status": "ok", "grid_target": _dev["grid_target"]}
+            case "POST", "api/v1/meter/grid_target":
+                _dev["grid_target"] = int(body["grid_target"])
+            case _:
+                return 404, {"status": "error", "error": f"unknown call {method} {_call}"}
+        self._set_power(_name, _dev)
+        return 200, _ok
+
+
+def synthetic_prices(date: dt.date, slots: int) -> list[float]:
+    """Return a plausible day of prices [EUR/kWh]: night and midday dips, morning and evening peaks.
+
+    The noise is seeded by the date, so a date always gets the same prices.
+    """
+    _rng = random.Random(date.toordinal())
+    _prices = []
+    for _s in range(slots):
+        _h = (_s + 0.5) * 24 / slots
+        _shape = 0.06 * math.exp(-(((_h - 8) / 1.5) ** 2)) + 0.09 * math.exp(-(((_h - 19) / 2) ** 2))
+        _shape -= 0.05 * math.exp(-(((_h - 13.5) / 2.5) ** 2))
+        _prices.append(round(0.22 + _shape + _rng.gauss(0.0, 0.01), 4))
+    return _prices
+
+
+class FakeTibber(FakeServer):
+    """The Tibber GraphQL API as far as the price queries of the apps go."""
+
+    def __init__(
+        self,
+        homes: tuple[str, ...] = ("home-1",),
+        prices: Callable[[dt.date, int], list[float]] = synthetic_prices,
+        timezone: str = TIMEZONE,
+        latency: float = 0.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Initialize the API.
+
+        Args:
+            homes: IDs of the homes; each gets the same prices
+            prices: returns the total prices [EUR/kWh] of a date for a number of slots
+            timezone: local time zone of the homes
+            latency: [s] delay of every response
+            clock: returns the current (virtual) UNIX time
+        """
+        super().__init__(latency=latency, clock=clock)
+        self.homes = homes
+        self.prices = prices
+        self.tz = ZoneInfo(timezone)
+
+    def starts(self, date: dt.date, minutes: int) -> list[dt.datetime]:
+        """Return the start of every slot of the date; 92 or 100 quarters on DST days."""
+        _start = dt.datetime.combine(date, dt.time(), tzinfo=self.tz).astimezone(dt.UTC)
+        _starts = []
+        while (_local := _start.astimezone(self.tz)).date() == date:
+            _starts.append(_local)
+            _start += dt.timedelta(minutes=minutes)
+        return _starts
+
+    def price_info(self, date: dt.date, minutes: int) -> list[dict[str, Any]]:
+        _starts = self.starts(date, minutes)
+        _info = []
+        for _s, _total in zip(_starts, self.prices(date, len(_starts)), strict=True):
+            _tax = round(_total * 0.6, 4)
+            _info.append(
+                {
+                    "total": _total,
+                    "energy": round(_total - _tax, 4),
+                    "tax": _tax,
+                    "startsAt": _s.isoformat(timespec="milliseconds"),
+                }
+            )
+        return _info
+
+    def handle(self, method: str, path: str, body: Any) -> tuple[int, Any]:
+        _query = (body or {}).get("query", "") if method == "POST" else ""
+        if "priceInfo" not in _query:
+            return 400, {"errors": [{"message": "unsupported query"}]}
+        _today = dt.datetime.fromtimestamp(self.clock(), self.tz).date()
+        _key, _date = ("tomorrow", _today + dt.timedelta(days=1)) if "tomorrow" in _query else ("today", _today)
+        _minutes = 15 if "QUARTER_HOURLY" in _query else 60
+        _info = self.price_info(_date, _minutes)
+        _homes = [{"id": _h, "currentSubscription": {"priceInfo": {_key: _info}}} for _h in self.homes]
+        return 200, {"data": {"viewer": {"homes": _homes}}}
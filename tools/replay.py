@@ -0,0 +1,760 @@
+#!/usr/bin/env python3
+"""Replay recorded days of Home Assistant states through the actual AppDaemon apps.
+
+The apps run unmodified on a stand-in for `appdaemon.plugins.hass.hassapi.Hass` that is injected
+via sys.modules; AppDaemon itself is not needed. Time is virtual: datetime.now(), date.today(),
+time.time() and time.monotonic() follow a clock that jumps from one event to the next, so a day
+of entity changes is replayed in seconds (or paced with --speed). The Sessy batteries and the
+Tibber API are served by the fakes in tools/fakes.py.
+
+The trace is a CSV file as exported from the HA history panel, one state change per row:
+    entity_id       e.g. sensor.bat1_state_of_charge
+    state           the new state
+    last_changed    ISO 8601 time incl. UTC offset (or 'Z')
+
+The last state of every entity before the start of the replay is set before the apps are
+initialized. Without a trace the entities that the apps read are seeded from SEED_STATES and
+the state of the fake batteries, and sensor.eigen_bedrijf gets a synthetic house load. The apps and their arguments are read from their YAML files in git-apps; `!secret`
+values point to the fakes or are taken from --secrets (a JSON file with secrets.yaml entries).
+Apps with async callbacks (batman3a, tibberlive) need AppDaemon's event loop and are refused.
+The exit status is 1 when a callback of an app raised an exception.
+
+Example:
+    tools/replay.py history.csv --apps scrts,bus,prices,nxtmorning,batman2 --out changes.csv
+"""
+
+import argparse
+import csv
+import datetime as dt
+import functools
+import glob
+import heapq
+import importlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import traceback
+import types
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+import fakes
+
+ROOT: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+GIT_APPS: str = os.path.join(ROOT, "git-apps")
+# secrets.yaml entries that don't point to a fake
+SECRETS: dict[str, str] = {
+    "tibber_token": "replay",
+    "tibber_price_sensor": "sensor.electricity_price",
+    "str_latitude": "52.09",
+    "str_longitude": "5.12",
+    "city": "Utrecht",
+    "country": "Netherlands",
+    "timezone": fakes.TIMEZONE,
+}
+DEVICES: tuple[str, ...] = ("bat1", "bat2", "p1")  # Sessy devices; sessy_<device>_url in secrets.yaml
+SOC_ENTITY: str = "sensor.{bat}_state_of_charge"
+SETPOINT_ENTITY: str = "number.{bat}_power_setpoint"
+# states that the apps read but don't set; seeded when there is no trace
+SEED_STATES: dict[str, str] = {
+    "input_boolean.evneedspwr": "off",
+    "input_boolean.bat_ctrl_app": "on",
+    "input_boolean.bats_min_soc": "off",
+    "input_boolean.bat_winterstand": "off",
+    "input_boolean.batman_profile": "off",
+    "input_boolean.pvovercurrent": "off",
+    "input_number.home_baseload": "310",
+    "input_number.greed_ll": "0.0",
+    "input_number.greed_hh": "12.5",
+    "binary_sensor.lowpv": "off",
+    "sensor.bats_minimum_soc": "22.5",
+    "sensor.pv_kwh_meter_current": "12.4",
+    "sensor.pv_kwh_meter_voltage": "231",
+    "sensor.pv_kwh_meter_power": "-2860",
+    "sensor.p1_meter_power": "-2450",
+}
+LOAD_ENTITY: str = "sensor.eigen_bedrijf"  # [W] house load; the apps need its history
+LOAD_INTERVAL: float = 300.0  # [s] interval of the synthetic house load
+SOC_SYNC: float = 60.0  # [s] interval at which the SoC of the fake batteries is copied to HA (--sync-soc)
+
+_REAL_DATETIME = dt.datetime
+_REAL_DATE = dt.date
+_LEVELS: dict[str, int] = logging.getLevelNamesMapping()
+
+
+class VirtualClock:
+    """UNIX time that only moves when the scheduler moves it."""
+
+    def __init__(self, start: float) -> None:
+        self.now: float = start
+
+    def time(self) -> float:
+        return self.now
+
+    def time_ns(self) -> int:
+        return int(self.now * 1e9)
+
+    def advance(self, t: float) -> None:
+        self.now = max(self.now, t)
+
+    @contextmanager
+    def patched(self) -> Iterator["VirtualClock"]:
+        """Make datetime, date, time.time() and time.monotonic() follow the clock."""
+        _clock = self
+
+        class _Meta(type):
+            # instances of the real classes are instances of the virtual ones
+            def __instancecheck__(cls, obj: Any) -> bool:
+                return isinstance(obj, cls.__real__)  # type: ignore[attr-defined]
+
+            def __subclasscheck__(cls, sub: type) -> bool:
+                return issubclass(sub, cls.__real__)  # type: ignore[attr-defined]
+
+        class VirtualDate(_REAL_DATE, metaclass=_Meta):
+            __real__ = _REAL_DATE
+
+            @classmethod
+            def today(cls) -> Any:
+                return cls.fromtimestamp(_clock.now)
+
+        class VirtualDateTime(_REAL_DATETIME, metaclass=_Meta):
+            __real__ = _REAL_DATETIME
+
+            @classmethod
+            def now(cls, tz: dt.tzinfo | None = None) -> Any:
+                return cls.fromtimestamp(_clock.now, tz)
+
+            @classmethod
+            def today(cls) -> Any:
+                return cls.fromtimestamp(_clock.now)
+
+            @classmethod
+            def utcnow(cls) -> Any:
+                return cls.fromtimestamp(_clock.now, dt.UTC).replace(tzinfo=None)
+
+        _saved = (dt.datetime, dt.date, time.time, time.time_ns, time.monotonic)
+        dt.datetime, dt.date = VirtualDateTime, VirtualDate  # type: ignore[misc]
+        time.time, time.time_ns, time.monotonic = self.time, self.time_ns, self.time
+        try:
+            yield self
+        finally:
+            dt.datetime, dt.date, time.time, time.time_ns, time.monotonic = _saved  # type: ignore[misc]
+
+
+@functools.cache
+def _takes_kwargs(callback: Callable) -> bool:
+    """Return True when a scheduler callback takes `**kwargs` rather than one `kwargs` dict."""
+    _params = inspect.signature(callback).parameters.values()
+    return any(_p.kind is inspect.Parameter.VAR_KEYWORD for _p in _params)
+
+
+class _Listener:
+    """A listen_state() registration."""
+
+    __slots__ = ("app", "callback", "entity", "attribute", "new", "old", "duration", "kwargs", "pending")
+
+    def __init__(
+        self, app: str, callback: Callable, entity: str | None, attribute: str | None, **kw: Any
+    ) -> None:
+        self.app = app
+        self.callback = callback
+        self.entity = entity
+        self.attribute = attribute
+        self.new = kw.pop("new", None)
+        self.old = kw.pop("old", None)
+        _duration = kw.pop("duration", None)
+        if isinstance(_duration, dt.timedelta):
+            _duration = _duration.total_seconds()
+        self.duration: float = float(_duration or 0)
+        self.kwargs = kw
+        self.pending: str | None = None  # timer of a duration that is running
+
+
+class AppDaemon:
+    """The parts of AppDaemon the apps use: the states, the listeners, the scheduler and the apps."""
+
+    def __init__(self, clock: VirtualClock, config_dir: str, speed: float = 0.0) -> None:
+        """Initialize an empty hub.
+
+        Args:
+            clock: the virtual clock that the scheduler moves
+            config_dir: AppDaemon's configuration directory; the apps write their files here
+            speed: virtual seconds per real second; 0 to run as fast as possible
+        """
+        self.clock = clock
+        self.config_dir = config_dir
+        self.speed = speed
+        self.apps: dict[str, Any] = {}
+        self.states: dict[str, dict[str, Any]] = {}
+        self.history: dict[str, list[tuple[float, Any]]] = defaultdict(list)
+        self.listeners: dict[str, _Listener] = {}
+        self._by_entity: dict[str | None, set[str]] = defaultdict(set)
+        self.timers: dict[str, dict[str, Any]] = {}
+        self.queue: list[tuple[float, int, Callable, tuple, dict]] = []
+        self.changes: list[tuple[float, str, str, Any]] = []  # (time, app, entity, state) set by the apps
+        self.timing: dict[str, list[float]] = defaultdict(list)  # [s] wall time per callback
+        self.errors: int = 0
+        self.events: int = 0
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._wall0: float = 0.0
+        self._virt0: float = clock.now
+
+    # scheduler
+
+    def at(self, t: float, fn: Callable, *args: Any, **kwargs: Any) -> None:
+        """Queue fn(*args, **kwargs) at time t; events at the same time run in the order they were queued."""
+        heapq.heappush(self.queue, (t, next(self._seq), fn, args, kwargs))
+
+    def timer(
+        self, app: str | None, t: float, callback: Callable, kwargs: dict, repeat: Callable | None = None
+    ) -> str:
+        """Register a timer; `repeat` returns the next time from the last one.
+
+        Callbacks of an app go through call(); those of the replay itself (app None) are called directly.
+        """
+        _handle = f"timer-{next(self._ids)}"
+        self.timers[_handle] = {"app": app, "callback": callback, "kwargs": kwargs, "repeat": repeat}
+        self.at(t, self._fire_timer, _handle)
+        return _handle
+
+    def cancel_timer(self, handle: str | None) -> None:
+        self.timers.pop(str(handle), None)
+
+    def _fire_timer(self, handle: str) -> None:
+        _timer = self.timers.get(handle)
+        if _timer is None:
+            # cancelled
+            return
+        if _timer["repeat"] is None:
+            del self.timers[handle]
+        else:
+            self.at(_timer["repeat"](self.clock.now), self._fire_timer, handle)
+        if _timer["app"] is None:
+            _timer["callback"](**_timer["kwargs"])
+        elif _takes_kwargs(_timer["callback"]):
+            self.call(_timer["app"], _timer["callback"], (), _timer["kwargs"])
+        else:
+            # old-style `def cb(self, kwargs)`
+            self.call(_timer["app"], _timer["callback"], (_timer["kwargs"],), {})
+
+    def call(self, app: str, callback: Callable, args: tuple, kwargs: dict) -> Any:
+        """Run a callback of an app like AppDaemon does: errors are logged, not raised."""
+        _name = getattr(callback, "func", callback).__name__
+        _t0 = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        except Exception:
+            self.errors += 1
+            logging.getLogger(app).error("callback %s failed:\n%s", _name, traceback.format_exc())
+            return None
+        finally:
+            self.timing[f"{app}.{_name}"].append(time.perf_counter() - _t0)
+
+    def run(self, until: float) -> None:
+        """Process all events up to and including time `until`."""
+        self._wall0 = time.perf_counter()
+        self._virt0 = self.clock.now
+        while self.queue and self.queue[0][0] <= until:
+            _t, _, _fn, _args, _kwargs = heapq.heappop(self.queue)
+            if self.speed:
+                _ahead = (_t - self._virt0) / self.speed - (time.perf_counter() - self._wall0)
+                if _ahead > 0:
+                    time.sleep(_ahead)
+            self.clock.advance(_t)
+            self.events += 1
+            _fn(*_args, **_kwargs)
+        self.clock.advance(until)
+
+    # states
+
+    def set_state(self, entity: str, state: Any, attributes: dict | None, source: str) -> dict[str, Any]:
+        """Change the state of an entity and dispatch the change to the listeners."""
+        _now = self.clock.now
+        _old = self.states.get(entity)
+        _attr = {**(_old["attributes"] if _old else {}), **(attributes or {})}
+        if state is None and _old is not None:
+            state = _old["state"]
+        _changed = _old is None or _old["state"] != state
+        _stamp = _REAL_DATETIME.fromtimestamp(_now, dt.UTC).isoformat()
+        _new = {
+            "entity_id": entity,
+            "state": state,
+            "attributes": _attr,
+            "last_changed": _stamp if _changed else _old["last_changed"],  # type: ignore[index]
+            "last_updated": _stamp,
+        }
+        self.states[entity] = _new
+        if _changed:
+            self.history[entity].append((_now, state))
+        if source != "trace":
+            self.changes.append((_now, source, entity, state))
+        for _handle in self._by_entity.get(entity, set()) | self._by_entity.get(None, set()):
+            self._dispatch(self.listeners[_handle], entity, _old, _new)
+        return _new
+
+    def _dispatch(self, lst: _Listener, entity: str, old: dict | None, new: dict) -> None:
+        _attribute = lst.attribute or "state"
+        if _attribute == "all":
+            _o, _n = old, new
+        elif _attribute == "state":
+            _o, _n = (old or {}).get("state"), new["state"]
+        else:
+            _o, _n = (old or {}).get("attributes", {}).get(_attribute), new["attributes"].get(_attribute)
+        if _o == _n:
+            return
+        if lst.pending:
+            # the state changed before the duration was over
+            self.cancel_timer(lst.pending)
+            lst.pending = None
+        if (lst.new is not None and _n != lst.new) or (lst.old is not None and _o != lst.old):
+            return
+        _args = (entity, _attribute, _o, _n)
+        if lst.duration:
+            _elapsed = functools.partial(self._elapsed, lst, _args)
+            lst.pending = self.timer(None, self.clock.now + lst.duration, _elapsed, {})
+        else:
+            self.at(self.clock.now, self.call, lst.app, lst.callback, _args, lst.kwargs)
+
+    def _elapsed(self, lst: _Listener, args: tuple) -> None:
+        lst.pending = None
+        self.call(lst.app, lst.callback, args, lst.kwargs)
+
+    def listen(self, lst: _Listener) -> str:
+        _handle = f"state-{next(self._ids)}"
+        self.listeners[_handle] = lst
+        self._by_entity[lst.entity].add(_handle)
+        return _handle
+
+    def cancel_listen(self, handle: str) -> None:
+        _lst = self.listeners.pop(handle, None)
+        if _lst is not None:
+            self._by_entity[_lst.entity].discard(handle)
+            if _lst.pending:
+                self.cancel_timer(_lst.pending)
+
+    # trace
+
+    def load_trace(self, rows: list[tuple[float, str, str]], start: float, skip: set[str] | None = None) -> int:
+        """Set the states before `start` and queue the later changes. Returns the number of changes queued."""
+        _initial: dict[str, str] = {}
+        _n = 0
+        for _t, _entity, _state in sorted(rows):
+            if skip and _entity in skip:
+                continue
+            if _t <= start:
+                _initial[_entity] = _state
+                self.history[_entity].append((_t, _state))
+            else:
+                self.at(_t, self.set_state, _entity, _state, None, "trace")
+                _n += 1
+        for _entity, _state in _initial.items():
+            self.set_state(_entity, _state, None, "trace")
+        return _n
+
+
+class Hass:
+    """Stand-in for appdaemon.plugins.hass.hassapi.Hass on top of the replay's AppDaemon."""
+
+    def __init__(self, ad: AppDaemon, name: str, args: dict[str, Any]) -> None:
+        self.AD = ad
+        self.name = name
+        self.args = args
+        self.config_dir = ad.config_dir
+        self.logger = logging.getLogger(name)
+
+    # logging
+
+    def log(self, msg: str, *args: Any, level: str = "INFO", **kwargs: Any) -> None:
+        self.logger.log(_LEVELS.get(level, logging.INFO), msg, *args)
+
+    def get_main_log(self) -> logging.Logger:
+        return self.logger
+
+    def set_log_level(self, level: str) -> None:
+        self.logger.setLevel(level)
+
+    # apps
+
+    def get_app(self, name: str) -> Any:
+        return self.AD.apps.get(name)
+
+    # states
+
+    def get_state(
+        self, entity_id: str | None = None, attribute: str | None = None, default: Any = None, **kwargs: Any
+    ) -> Any:
+        if entity_id is None:
+            return {_e: dict(_s) for _e, _s in self.AD.states.items()}
+        _s = self.AD.states.get(entity_id)
+        if _s is None:
+            return default
+        if attribute is None or attribute == "state":
+            return _s["state"]
+        if attribute == "all":
+            return dict(_s)
+        return _s["attributes"].get(attribute, default)
+
+    def set_state(
+        self, entity_id: str, state: Any = None, attributes: dict | None = None, **kwargs: Any
+    ) -> dict:
+        return self.AD.set_state(entity_id, state, attributes, self.name)
+
+    def turn_on(self, entity_id: str, **kwargs: Any) -> None:
+        self.AD.set_state(entity_id, "on", None, self.name)
+
+    def turn_off(self, entity_id: str, **kwargs: Any) -> None:
+        self.AD.set_state(entity_id, "off", None, self.name)
+
+    def listen_state(self, callback: Callable, entity_id: str | None = None, **kwargs: Any) -> str:
+        _attribute = kwargs.pop("attribute", None)
+        return self.AD.listen(_Listener(self.name, callback, entity_id, _attribute, **kwargs))
+
+    def cancel_listen_state(self, handle: str) -> None:
+        self.AD.cancel_listen(handle)
+
+    def get_history(
+        self,
+        entity_id: str,
+        start_time: dt.datetime | None = None,
+        end_time: dt.datetime | None = None,
+        callback: Callable | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        _now = self.AD.clock.now
+        _t0 = start_time.timestamp() if start_time else _now - 86400
+        _t1 = min(end_time.timestamp(), _now) if end_time else _now
+        _history = self.AD.history.get(entity_id, [])
+        _changes = [(_t, _state) for _t, _state in _history if _t0 <= _t <= _t1]
+        _before = [_state for _t, _state in _history if _t < _t0]
+        if _before:
+            # like HA, the history starts with the state at the start of the period
+            _changes.insert(0, (_t0, _before[-1]))
+        _rows = [
+            {
+                "entity_id": entity_id,
+                "state": _state,
+                "attributes": {},
+                "last_changed": _REAL_DATETIME.fromtimestamp(_t, dt.UTC).isoformat(),
+            }
+            for _t, _state in _changes
+        ]
+        if callback is None:
+            return [_rows]
+        self.AD.at(_now, self.AD.call, self.name, callback, (), {"result": [_rows]})
+        return None
+
+    # scheduler
+
+    def run_in(self, callback: Callable, delay: float = 0, **kwargs: Any) -> str:
+        return self.AD.timer(self.name, self.AD.clock.now + float(delay), callback, kwargs)
+
+    def run_every(self, callback: Callable, start: Any = None, interval: float = 0, **kwargs: Any) -> str:
+        _interval = float(interval)
+        return self.AD.timer(self.name, self._start(start), callback, kwargs, repeat=lambda t: t + _interval)
+
+    def run_daily(self, callback: Callable, start: Any = None, **kwargs: Any) -> str:
+        _at = start if isinstance(start, dt.time) else dt.time.fromisoformat(str(start or "00:00:00"))
+        _first = self._next_daily(_at, self.AD.clock.now)
+        return self.AD.timer(self.name, _first, callback, kwargs, repeat=lambda t: self._next_daily(_at, t))
+
+    def cancel_timer(self, handle: str) -> None:
+        self.AD.cancel_timer(handle)
+
+    def _start(self, start: Any) -> float:
+        """Return the time of the first run of run_every()."""
+        _now = self.AD.clock.now
+        if start is None or start == "now":
+            return _now
+        if isinstance(start, str) and start.startswith("now+"):
+            return _now + float(start[4:])
+        if isinstance(start, _REAL_DATETIME):
+            return max(start.timestamp(), _now)
+        return self._next_daily(dt.time.fromisoformat(str(start)), _now)
+
+    @staticmethod
+    def _next_daily(at: dt.time, after: float) -> float:
+        """Return the first time after `after` on which the local time is `at`."""
+        _day = _REAL_DATETIME.fromtimestamp(after).date()
+        while (_t := _REAL_DATETIME.combine(_day, at).timestamp()) <= after:
+            _day += dt.timedelta(days=1)
+        return _t
+
+
+def install_hassapi() -> dict[str, Any]:
+    """Make `import appdaemon.plugins.hass.hassapi as hass` import the stand-in.
+
+    Returns:
+        the modules that were replaced, for restore_hassapi()
+    """
+    _names = ("appdaemon", "appdaemon.plugins", "appdaemon.plugins.hass", "appdaemon.plugins.hass.hassapi")
+    _saved = {_n: sys.modules.get(_n) for _n in _names}
+    _mods = [types.ModuleType(_n) for _n in _names]
+    for _parent, _child in itertools.pairwise(_mods):
+        _parent.__path__ = []  # type: ignore[attr-defined]
+        setattr(_parent, _child.__name__.rpartition(".")[2], _child)
+    _mods[-1].Hass = Hass  # type: ignore[attr-defined]
+    sys.modules.update({_m.__name__: _m for _m in _mods})
+    return _saved
+
+
+def restore_hassapi(saved: dict[str, Any]) -> None:
+    for _name, _mod in saved.items():
+        if _mod is None:
+            sys.modules.pop(_name, None)
+        else:
+            sys.modules[_name] = _mod
+
+
+def load_trace(filename: str) -> list[tuple[float, str, str]]:
+    """Read a CSV export of the HA history. Returns (UNIX time, entity, state) per row."""
+    _rows = []
+    with open(filename, newline="", encoding="utf-8") as _f:
+        for row in csv.DictReader(_f):
+            _ts = _REAL_DATETIME.fromisoformat(row["last_changed"])
+            _rows.append((_ts.timestamp(), row["entity_id"], row["state"]))
+    return _rows
+
+
+def load_apps(secrets: dict[str, str]) -> dict[str, dict[str, Any]]:
+    """Read the configuration of all apps from their YAML files; `!secret` is resolved from `secrets`."""
+    import yaml  # comes with AppDaemon
+
+    class _Loader(yaml.SafeLoader):
+        pass
+
+    def _secret(loader: yaml.SafeLoader, node: yaml.Node) -> str:
+        _key = str(loader.construct_scalar(node))  # type: ignore[arg-type]
+        if _key not in secrets:
+            logging.getLogger("replay").warning("secret %s is not set", _key)
+        return secrets.get(_key, "")
+
+    _Loader.add_constructor("!secret", _secret)
+    _apps: dict[str, dict[str, Any]] = {}
+    for _file in sorted(glob.glob(os.path.join(GIT_APPS, "*", "*.yaml"))):
+        with open(_file, encoding="utf-8") as _f:
+            for _doc in yaml.load_all(_f, Loader=_Loader):  # nosec B506
+                _apps.update(_doc or {})
+    return _apps
+
+
+class Replay:
+    """Run apps against the replay's AppDaemon, the virtual clock and the fakes.
+
+    with Replay(["scrts", "prices", "batman2"], start, trace=rows) as rp:
+        rp.run(start + 86400)
+        print(rp.ad.changes, rp.sessy.calls)
+    """
+
+    def __init__(
+        self,
+        apps: list[str],
+        start: float,
+        trace: list[tuple[float, str, str]] | None = None,
+        secrets: dict[str, str] | None = None,
+        latency: float = 0.0,
+        speed: float = 0.0,
+        config_dir: str | None = None,
+        sync_soc: bool = False,
+    ) -> None:
+        """Prepare a replay; the apps are loaded and initialized when entering the context.
+
+        Args:
+            apps: names of the apps to run, as in their YAML files
+            start: UNIX time at which the apps are initialized
+            trace: (UNIX time, entity, state) of recorded state changes
+            secrets: secrets.yaml entries; added to SECRETS
+            latency: [s] network latency of the fakes
+            speed: virtual seconds per real second; 0 to run as fast as possible
+            config_dir: AppDaemon's configuration directory; default is a temporary directory
+            sync_soc: let the fake batteries determine the SoC entities instead of the trace
+        """
+        self.names = apps
+        self.start = start
+        self.trace = trace or []
+        self.secrets = {**SECRETS, **(secrets or {})}
+        self.sync_soc = sync_soc
+        self.clock = VirtualClock(start)
+        self._tmp = tempfile.TemporaryDirectory(prefix="replay-") if config_dir is None else None
+        self.ad = AppDaemon(self.clock, config_dir or self._tmp.name, speed=speed)  # type: ignore[union-attr]
+        self.sessy = fakes.FakeSessy(DEVICES, latency=latency, clock=self.clock.time)
+        self.tibber = fakes.FakeTibber(
+            latency=latency, timezone=self.secrets["timezone"], clock=self.clock.time
+        )
+        self.queued: int = 0
+        self._patch: Any = None
+        self._hassapi: dict[str, Any] = {}
+
+    def __enter__(self) -> "Replay":
+        try:
+            return self._enter()
+        except BaseException:
+            self.__exit__(*sys.exc_info())
+            raise
+
+    def _enter(self) -> "Replay":
+        os.environ["TZ"] = self.secrets["timezone"]
+        time.tzset()
+        self.sessy.start()
+        self.tibber.start()
+        self.secrets["tibber_url"] = self.tibber.url
+        for _dev in DEVICES:
+            self.secrets[f"sessy_{_dev}_url"] = self.sessy.device_url(_dev)
+            self.secrets[f"sessy_{_dev}_auth"] = "replay.replay"
+        self._patch = self.clock.patched()
+        self._patch.__enter__()
+        self._hassapi = install_hassapi()
+        for _dir in sorted(glob.glob(os.path.join(GIT_APPS, "*", ""))):
+            if _dir not in sys.path:
+                sys.path.insert(0, _dir)
+        _bats = [_d for _d in DEVICES if _d != "p1"]
+        _skip = {SOC_ENTITY.format(bat=_b) for _b in _bats} if self.sync_soc else set()
+        if not self.trace:
+            self.trace = self.seed()
+            self.ad.timer(None, self.start, self.update_load, {}, repeat=lambda t: t + LOAD_INTERVAL)
+        self.queued = self.ad.load_trace(self.trace, self.start, skip=_skip)
+        if self.sync_soc:
+            self.copy_soc()
+            self.ad.timer(None, self.start + SOC_SYNC, self.copy_soc, {}, repeat=lambda t: t + SOC_SYNC)
+        self.load()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        for _name in reversed(list(self.ad.apps)):
+            _app = self.ad.apps[_name]
+            if hasattr(_app, "terminate"):
+                self.ad.call(_name, _app.terminate, (), {})
+        restore_hassapi(self._hassapi)
+        if self._patch is not None:
+            self._patch.__exit__(*exc)
+            self._patch = None
+        self.sessy.stop()
+        self.tibber.stop()
+        if self._tmp is not None:
+            self._tmp.cleanup()
+
+    def load(self) -> None:
+        """Create all apps, then initialize them in order of priority, like AppDaemon does."""
+        _config = load_apps(self.secrets)
+        _todo = []
+        for _name in self.names:
+            _cfg = _config.get(_name)
+            if _cfg is None:
+                raise KeyError(f"No app {_name} in {GIT_APPS}")
+            _cls = getattr(importlib.import_module(_cfg["module"]), _cfg["class"])
+            if any(inspect.iscoroutinefunction(_m) for _, _m in inspect.getmembers(_cls, inspect.isfunction)):
+                raise TypeError(f"{_name}: async apps can't be replayed")
+            self.ad.apps[_name] = _cls(self.ad, _name, _cfg)
+            _todo.append((int(_cfg.get("priority", 50)), _name))
+        for _, _name in sorted(_todo):
+            self.ad.call(_name, self.ad.apps[_name].initialize, (), {})
+
+    def seed(self) -> list[tuple[float, str, str]]:
+        """Return a trace that sets SEED_STATES, the SoC and setpoints of the fake batteries and a day of
+        house load history."""
+        _states = dict(SEED_STATES)
+        for _bat in DEVICES[:-1]:
+            _states[SOC_ENTITY.format(bat=_bat)] = f"{self.sessy.soc(_bat):.1f}"
+            _states[SETPOINT_ENTITY.format(bat=_bat)] = str(self.sessy.devices[_bat]["setpoint"])
+        _rows = [(self.start - 60, _entity, _state) for _entity, _state in _states.items()]
+        _t = self.start - 86400
+        while _t < self.start:
+            _rows.append((_t, LOAD_ENTITY, house_load(_t)))
+            _t += LOAD_INTERVAL
+        return _rows
+
+    def update_load(self, **kwargs: Any) -> None:
+        """Set the synthetic house load."""
+        self.ad.set_state(LOAD_ENTITY, house_load(self.clock.now), None, "fakes")
+
+    def copy_soc(self, **kwargs: Any) -> None:
+        """Copy the SoC of the fake batteries to their HA entities."""
+        for _bat in DEVICES[:-1]:
+            self.ad.set_state(SOC_ENTITY.format(bat=_bat), f"{self.sessy.soc(_bat):.1f}", None, "fakes")
+
+    def run(self, until: float) -> None:
+        self.ad.run(until)
+
+    def report(self, wall: float) -> str:
+        """Return a summary of the replay that took `wall` seconds."""
+        _span = self.clock.now - self.start
+        _lines = [
+            f"replayed {_REAL_DATETIME.fromtimestamp(self.start):%Y-%m-%d %H:%M} + {_span / 3600:.1f} h "
+            f"in {wall:.2f} s ({_span / max(wall, 1e-9):,.0f}x real time)",
+            f"events: {self.ad.events}, trace changes queued: {self.queued}, callback errors: {self.ad.errors}",
+            f"HTTP requests: Sessy {self.sessy.total}, Tibber {self.tibber.total}",
+            f"{'callback':<40} {'calls':>7} {'mean ms':>9} {'max ms':>9}",
+        ]
+        for _name, _t in sorted(self.ad.timing.items(), key=lambda kv: -sum(kv[1])):
+            _lines.append(f"{_name:<40} {len(_t):>7} {1000 * sum(_t) / len(_t):>9.2f} {1000 * max(_t):>9.2f}")
+        return "\n".join(_lines)
+
+
+def house_load(t: float) -> str:
+    """Return the synthetic house load [W] at UNIX time `t`; a base load with some noise."""
+    return f"{250 + 200 * random.Random(int(t)).random():.0f}"  # nosec B311
+
+
+def _when(value: str) -> float:
+    """Parse an ISO 8601 date or date-time; local time unless it has an offset."""
+    return _REAL_DATETIME.fromisoformat(value).timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", nargs="?", default="", help="CSV export of the HA history")
+    parser.add_argument("--apps", default="scrts,bus,prices,perf,recorder,nxtmorning,eb_avg,batman2")
+    parser.add_argument("--start", default="", help="ISO date(-time); default is the start of the trace")
+    parser.add_argument("--end", default="", help="ISO date(-time); default is the end of the trace")
+    parser.add_argument("--days", type=float, default=0.0, help="replay this many days from the start")
+    parser.add_argument("--secrets", default="", help="JSON file with secrets.yaml entries")
+    parser.add_argument("--latency", type=float, default=0.0, help="[s] latency of the fake servers")
+    parser.add_argument("--speed", type=float, default=0.0, help="e.g. 1000 for 1000x real time; 0 = max")
+    parser.add_argument("--sync-soc", action="store_true", help="take the SoC from the fake batteries")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the apps")
+    parser.add_argument("--out", default="", help="write the states set by the apps to this CSV file")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    _secrets: dict[str, str] = {}
+    if args.secrets:
+        with open(args.secrets, encoding="utf-8") as _f:
+            _secrets = json.load(_f)
+    os.environ["TZ"] = _secrets.get("timezone", SECRETS["timezone"])
+    time.tzset()
+    trace = load_trace(args.trace) if args.trace else []
+    if not (trace or args.start):
+        parser.error("either a trace or --start is required")
+    start = _when(args.start) if args.start else min(trace)[0]
+    if args.end:
+        end = _when(args.end)
+    elif args.days or not trace:
+        end = start + 86400 * (args.days or 1.0)
+    else:
+        end = max(trace)[0]
+
+    _t0 = time.perf_counter()
+    _apps = args.apps.split(",")
+    with Replay(_apps, start, trace, _secrets, args.latency, args.speed, sync_soc=args.sync_soc) as rp:
+        rp.run(end)
+        _wall = time.perf_counter() - _t0
+        print(rp.report(_wall), file=sys.stderr)
+        if args.out:
+            with open(args.out, "w", newline="", encoding="utf-8") as _f:
+                writer = csv.writer(_f)
+                writer.writerow(["time", "app", "entity_id", "state"])
+                for _t, _app, _entity, _state in rp.ad.changes:
+                    writer.writerow([_REAL_DATETIME.fromtimestamp(_t).isoformat(), _app, _entity, _state])
+    sys.exit(1 if rp.ad.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
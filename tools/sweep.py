@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Parameter sweep for the BatMan2 greed thresholds.
+
+Replays historical price and load traces through the BatMan2 stance logic for every
+combination of (greed_ll, greed_hh, SLOTS, AVG_RTE) in a grid and tabulates the resulting
+electricity cost. Combinations are evaluated in parallel on all cores of the host.
+
+The trace is a CSV file with one row per quarter and the columns:
+    timestamp   ISO 8601 local time incl. UTC offset (e.g. 2025-06-22T00:15:00+02:00)
+    price       total price [cEUR/kWh]
+    load        home consumption [W]
+    pv          (optional) PV production [W]
+    ev          (optional) 1 when the EV is charging
+    min_soc     (optional) sensor.bats_minimum_soc [%]
+
+Example:
+    tools/sweep.py trace.csv --greed-ll=-2,0,2 --greed-hh=10,12.5,15,20 --slots-charge=12,18,24
+"""
+
+import argparse
+import contextlib
+import csv
+import datetime as dt
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "git-apps", "batman2"))
+
+import const2 as cs  # noqa: E402
+import prices2 as p2  # noqa: E402
+import stance2 as st  # noqa: E402
+import utils2 as ut  # noqa: E402
+
+N_BATS: int = len(cs.BATTALK["bats"])
+SOC_START: float = 50.0  # [%]
+QRTR_HRS: float = 0.25  # [h] duration of a quarter
+
+# trace shared with the worker processes; set by _init_worker()
+_DAYS: list[dict[str, Any]] = []
+
+
+def load_trace(filename: str, min_soc: float) -> list[dict[str, Any]]:
+    """Read a CSV trace and split it into days.
+
+    Days that are incomplete (less than 92 quarters; the short DST day) are dropped.
+    """
+    days: dict[dt.date, dict[str, Any]] = {}
+    with open(filename, newline="", encoding="utf-8") as _f:
+        for row in csv.DictReader(_f):
+            _ts = dt.datetime.fromisoformat(row["timestamp"])
+            _d = days.setdefault(
+                _ts.date(), {"date": _ts.date(), "price": [], "load": [], "pv": [], "ev": [], "min_soc": []}
+            )
+            _d["price"].append(float(row["price"]))
+            _d["load"].append(float(row["load"]))
+            _d["pv"].append(float(row.get("pv") or 0.0))
+            _d["ev"].append(str(row.get("ev") or "0").strip() in ("1", "on", "True", "true"))
+            _d["min_soc"].append(float(row.get("min_soc") or min_soc))
+    return [days[_k] for _k in sorted(days) if len(days[_k]["price"]) >= 92]
+
+
+def simulate_day(day: dict[str, Any], soc: float, params: dict[str, Any]) -> tuple[float, float, int]:
+    """Simulate one day of quarters.
+
+    Returns:
+        cost [EUR], SoC at the end of the day [%] and the number of stance changes
+    """
+    _cap = N_BATS * cs.BAT_CAPACITY
+    _max_chrg = N_BATS * abs(cs.MAX_CHARGE)
+    _max_dchg = N_BATS * cs.MAX_DISCHARGE
+    _rte = params["rte"]
+    prices = day["price"]
+    sunny = ut.is_sunny_day(day["date"])
+    stats = p2.price_statistics(prices=prices)
+    slots = p2.price_slots(
+        prices, stats, soc, quarters=True, slots=[params["slots_c"], params["slots_d"]], rte=_rte
+    )
+    cheap = set(slots["cheap"])
+    expen = set(slots["expen"])
+    stance = cs.DEFAULT_STANCE
+    _sp = 0
+    flips = 0
+    cost = 0.0
+    for _q, _price in enumerate(prices):
+        _slot_class = -1 if _q in cheap else (1 if _q in expen else 0)
+        _greedy = ut.get_greedy(_price, _price - stats["q1"], params["greed_ll"], params["greed_hh"], sunny)
+        _inp = st.StanceInput(
+            soc, day["min_soc"][_q], _slot_class, _greedy, day["ev"][_q], sunny, False, False, stance, _sp
+        )
+        _new, _sp = st.decide(_inp)
+        flips += _new != stance
+        stance = _new
+        _net = day["load"][_q] - day["pv"][_q]  # [W] positive: home needs power
+        # battery power [W]; positive is discharging
+        match stance:
+            case cs.NOM:
+                _bat = min(max(_net, -_max_chrg), _max_dchg)
+            case cs.IDLE:
+                _bat = 0.0
+            case _:
+                _bat = float(N_BATS * _sp)
+        # respect the available energy and the available room in the batteries
+        if _bat > 0:
+            _bat = min(_bat, soc / 100 * _cap / QRTR_HRS)
+            soc -= _bat * QRTR_HRS / _cap * 100
+        else:
+            _bat = max(_bat, -((100 - soc) / 100 * _cap / QRTR_HRS) / _rte)
+            soc -= _bat * _rte * QRTR_HRS / _cap * 100
+        cost += (_net - _bat) * QRTR_HRS / 1000 * _price / 100
+    return cost, soc, flips
+
+
+def evaluate(params: dict[str, Any]) -> dict[str, Any]:
+    """Evaluate one combination of parameters over all days of the trace."""
+    soc = SOC_START
+    cost = 0.0
+    flips = 0
+    for day in _DAYS:
+        _c, soc, _f = simulate_day(day, soc, params)
+        cost += _c
+        flips += _f
+    return {**params, "cost": round(cost, 2), "flips": flips, "days": len(_DAYS)}
+
+
+def _init_worker(days: list[dict[str, Any]]) -> None:
+    """Receive the trace once per worker process instead of once per task."""
+    global _DAYS
+    _DAYS = days
+
+
+def sweep(days: list[dict[str, Any]], grid: list[dict[str, Any]], workers: int | None = None) -> list[dict]:
+    """Evaluate all combinations in the grid in a pool of worker processes."""
+    workers = workers or os.cpu_count() or 1
+    _chunk = max(1, len(grid) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(days,)) as pool:
+        results = list(pool.map(evaluate, grid, chunksize=_chunk))
+    return sorted(results, key=lambda r: r["cost"])
+
+
+def build_grid(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """Return the cartesian product of all parameter values."""
+    _keys = ["greed_ll", "greed_hh", "slots_c", "slots_d", "rte"]
+    _vals = [args.greed_ll, args.greed_hh, args.slots_charge, args.slots_discharge, args.rte]
+    return [dict(zip(_keys, _combo, strict=True)) for _combo in itertools.product(*_vals)]
+
+
+def _floats(value: str) -> list[float]:
+    return [float(_v) for _v in value.split(",")]
+
+
+def _ints(value: str) -> list[int]:
+    return [int(_v) for _v in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="CSV file with quarterly price and load history")
+    parser.add_argument("--greed-ll", type=_floats, default=[cs.PRICES["nul"]], help="comma separated")
+    parser.add_argument("--greed-hh", type=_floats, default=[cs.PRICES["top"]], help="comma separated")
+    parser.add_argument("--slots-charge", type=_ints, default=[cs.SLOTS[0]], help="comma separated")
+    parser.add_argument("--slots-discharge", type=_ints, default=[cs.SLOTS[1]], help="comma separated")
+    parser.add_argument("--rte", type=_floats, default=[cs.AVG_RTE], help="comma separated")
+    parser.add_argument("--min-soc", type=float, default=20.0, help="min. SoC [%%] if not in the trace")
+    parser.add_argument("--workers", type=int, default=None, help="default: all cores")
+    parser.add_argument("--out", default="", help="write the table to this CSV file")
+    args = parser.parse_args()
+
+    days = load_trace(args.trace, args.min_soc)
+    grid = build_grid(args)
+    print(f"Evaluating {len(grid)} combinations over {len(days)} days...", file=sys.stderr)
+    results = sweep(days, grid, workers=args.workers)
+
+    _fields = list(results[0].keys()) if results else []
+    with contextlib.ExitStack() as _stack:
+        _out = (
+            _stack.enter_context(open(args.out, "w", newline="", encoding="utf-8")) if args.out else sys.stdout
+        )
+        writer = csv.DictWriter(_out, fieldnames=_fields)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+    main()